@@ -0,0 +1,204 @@
+# export_state.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional
+
+from agent.services import Shared
+
+EXPORT_STATE_DB = os.environ.get("EXPORT_STATE_DB", "/data/agent-state.db")
+# Reports in one of these states will not receive new results anymore.
+FINISHED_REPORT_STATUSES = ("Done", "Stopped", "Interrupted")
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shipped_reports (
+    report_id TEXT PRIMARY KEY,
+    modification_time TEXT,
+    scan_run_status TEXT,
+    finished INTEGER NOT NULL DEFAULT 0,
+    shipped_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shipped_results (
+    result_id TEXT PRIMARY KEY,
+    report_id TEXT NOT NULL,
+    modification_time TEXT,
+    shipped_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shipped_results_report ON shipped_results (report_id);
+"""
+
+
+class StateDb:
+    """The agent's SQLite state file, shared by every store kept in it.
+
+    All stores of the process go through one connection and one lock. Each
+    registers its tables with `add_schema`; the file is only opened by the
+    first statement, so creating a store does not touch the disk.
+    """
+
+    def __init__(self, path: str = EXPORT_STATE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._schemas = []
+
+    def add_schema(self, schema: str):
+        """Create the tables of a store, now or when the file is opened."""
+        with self._lock:
+            if schema in self._schemas:
+                return
+            self._schemas.append(schema)
+            if self._db is not None:
+                self._db.executescript(schema)
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        for schema in self._schemas:
+            db.executescript(schema)
+        db.commit()
+        return db
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """The connection, locked for the duration of the block."""
+        with self._lock:
+            if self._db is None:
+                self._db = self._open()
+            yield self._db
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Like `connection`, committed at the end of the block, rolled back on error."""
+        with self.connection() as db:
+            with db:
+                yield db
+
+    def close(self):
+        """Close the file, the next statement opens it again."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_state_dbs: Dict[str, StateDb] = {}
+_state_dbs_lock = threading.Lock()
+
+
+def get_state_db(path: str = EXPORT_STATE_DB) -> StateDb:
+    """Return the process wide StateDb of ``path``, shared by every store kept there."""
+    key = os.path.abspath(path)
+    with _state_dbs_lock:
+        if key not in _state_dbs:
+            _state_dbs[key] = StateDb(path)
+        return _state_dbs[key]
+
+
+def result_key(row: Dict[str, Any]) -> str:
+    """Stable identifier of a CSV result row.
+
+    gvmd exports a "Result ID" column; rows without one are keyed on their content.
+    """
+    result_id = row.get("Result ID")
+    if result_id:
+        return result_id
+    digest = hashlib.sha1(repr(sorted(row.items())).encode("utf-8")).hexdigest()
+    return f"{row.get('report_id', '')}:{digest}"
+
+
+class ExportState:
+    """Persistent watermark of which reports and results were shipped to the panel."""
+
+    def __init__(self, path: str = EXPORT_STATE_DB):
+        self.db = get_state_db(path)
+        self.db.add_schema(_SCHEMA)
+
+    def is_report_shipped(self, report_id: str, modification_time: Optional[str]) -> bool:
+        """True when a finished report was fully shipped and has not changed since."""
+        with self.db.connection() as db:
+            row = db.execute(
+                "SELECT modification_time, finished FROM shipped_reports WHERE report_id = ?",
+                (report_id,),
+            ).fetchone()
+        return row is not None and bool(row[1]) and row[0] == modification_time
+
+    def is_result_shipped(self, result_id: str, modification_time: Optional[str]) -> bool:
+        with self.db.connection() as db:
+            row = db.execute(
+                "SELECT modification_time FROM shipped_results WHERE result_id = ?",
+                (result_id,),
+            ).fetchone()
+        return row is not None and row[0] == modification_time
+
+    def begin(self) -> "ExportBatch":
+        """Start collecting the reports and results of one export cycle."""
+        return ExportBatch(self)
+
+    def _commit(self, reports: Dict[str, tuple], results: Dict[str, tuple]):
+        now = time.time()
+        with self.db.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO shipped_results VALUES (?, ?, ?, ?)",
+                [(result_id, report_id, mtime, now) for result_id, (report_id, mtime) in results.items()],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO shipped_reports VALUES (?, ?, ?, ?, ?)",
+                [
+                    (report_id, mtime, status, int(status in FINISHED_REPORT_STATUSES), now)
+                    for report_id, (mtime, status) in reports.items()
+                ],
+            )
+
+    def forget_report(self, report_id: str):
+        """Drop the watermark of a report that was deleted from gvmd."""
+        with self.db.transaction() as db:
+            db.execute("DELETE FROM shipped_results WHERE report_id = ?", (report_id,))
+            db.execute("DELETE FROM shipped_reports WHERE report_id = ?", (report_id,))
+
+    def close(self):
+        self.db.close()
+
+
+class ExportBatch:
+    """Reports and results picked up in one cycle, persisted only once the upload succeeded."""
+
+    def __init__(self, state: ExportState):
+        self.state = state
+        self.reports = {}
+        self.results = {}
+
+    def skip_report(self, report_id: str, modification_time: Optional[str]) -> bool:
+        return self.state.is_report_shipped(report_id, modification_time)
+
+    def add_report(self, report_id: str, modification_time: Optional[str], scan_run_status: Optional[str]):
+        self.reports[report_id] = (modification_time, scan_run_status)
+
+    def add_result(self, row: Dict[str, Any]) -> bool:
+        """Register a result row, returns False when it was already shipped."""
+        key = result_key(row)
+        modification_time = row.get("Timestamp")
+        if key in self.results or self.state.is_result_shipped(key, modification_time):
+            return False
+        self.results[key] = (row.get("report_id", ""), modification_time)
+        return True
+
+    def discard(self):
+        self.reports.clear()
+        self.results.clear()
+
+    def commit(self):
+        self.state._commit(self.reports, self.results)
+        logger.info("Marked %d reports and %d results as shipped", len(self.reports), len(self.results))
+
+
+get_export_state = Shared(ExportState)
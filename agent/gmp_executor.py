@@ -0,0 +1,124 @@
+# gmp_executor.py
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+GMP_EXECUTOR_WORKERS = int(os.environ.get("GMP_EXECUTOR_WORKERS", "8"))
+DEFAULT_LIMIT = 4
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_RETRY_AFTER = 5
+
+# Maximum number of in-flight calls per operation, overridable with GMP_LIMIT_<OPERATION>.
+OPERATION_LIMITS = {
+    "start_scan": 4,
+    "start_scans": 2,
+    "active_scans_count": 2,
+    "check_is_vas_online": 8,
+    "get_results": 1,
+}
+# Seconds a request waits for the operation, overridable with GMP_TIMEOUT_<OPERATION>.
+OPERATION_TIMEOUTS = {
+    "start_scan": 60.0,
+    "start_scans": 600.0,
+    "active_scans_count": 30.0,
+    "check_is_vas_online": 10.0,
+    "get_results": 600.0,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class GmpExecutorError(Exception):
+    """Base class for requests the executor refused or gave up on."""
+
+    def __init__(self, message: str, retry_after: int = DEFAULT_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GmpBusy(GmpExecutorError):
+    """Raised when an operation already has its maximum number of calls in flight."""
+
+
+class GmpTimeout(GmpExecutorError):
+    """Raised when an operation did not finish within its timeout."""
+
+
+def _env_override(prefix: str, operation: str, default, cast):
+    return cast(os.environ.get(f"{prefix}{operation.upper()}", default))
+
+
+class GmpExecutor:
+    """Runs blocking GMP calls off the event loop on a bounded thread pool.
+
+    Each operation has its own concurrency limit. A slot is held until the
+    worker thread actually finishes, so calls that timed out for the client
+    still count against the limit and cannot pile up behind it.
+    """
+
+    def __init__(self, max_workers: int = GMP_EXECUTOR_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gmp")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {}
+        self._limits = {
+            operation: _env_override("GMP_LIMIT_", operation, limit, int)
+            for operation, limit in OPERATION_LIMITS.items()
+        }
+        self._timeouts = {
+            operation: _env_override("GMP_TIMEOUT_", operation, timeout, float)
+            for operation, timeout in OPERATION_TIMEOUTS.items()
+        }
+
+    def _acquire(self, operation: str) -> bool:
+        with self._lock:
+            in_flight = self._in_flight.get(operation, 0)
+            if in_flight >= self._limits.get(operation, DEFAULT_LIMIT):
+                return False
+            self._in_flight[operation] = in_flight + 1
+            return True
+
+    def _release(self, operation: str, _future=None):
+        with self._lock:
+            self._in_flight[operation] -= 1
+
+    def in_flight(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._in_flight)
+
+    async def run(self, operation: str, func: Callable, *args, timeout: float = None, **kwargs) -> Any:
+        """Run ``func(*args, **kwargs)`` on the executor.
+
+        Args:
+            operation: name used for the concurrency limit and default timeout.
+            func: blocking callable.
+            timeout: seconds to wait, defaults to the operation timeout.
+
+        Raises:
+            GmpBusy: the operation is at its concurrency limit.
+            GmpTimeout: the call did not finish in time.
+        """
+        if not self._acquire(operation):
+            logger.info("Rejecting %s, concurrency limit reached", operation)
+            raise GmpBusy(f"Too many concurrent {operation} requests")
+
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._release(operation)
+            raise
+        future.add_done_callback(functools.partial(self._release, operation))
+
+        if timeout is None:
+            timeout = self._timeouts.get(operation, DEFAULT_TIMEOUT)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            logger.info("%s did not finish within %ss", operation, timeout)
+            raise GmpTimeout(f"{operation} timed out after {timeout}s")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
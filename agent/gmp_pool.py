@@ -0,0 +1,230 @@
+# gmp_pool.py
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Optional, Tuple
+
+import gvm
+from gvm.errors import GvmError, GvmResponseError
+from gvm.protocols import gmp as openvas_gmp
+from gvm import transforms
+
+from agent.metrics import gmp_call
+from agent.services import Shared
+
+GMP_HOST = os.environ.get("GMP_HOST", "localhost")
+GMP_PORT = int(os.environ.get("GMP_PORT", "9390"))
+GMP_POOL_SIZE = int(os.environ.get("GMP_POOL_SIZE", "4"))
+# Sessions reports in gvmd's XML format are fetched on, see `get_report_pool`.
+GMP_REPORT_POOL_SIZE = int(os.environ.get("GMP_REPORT_POOL_SIZE", "2"))
+GMP_CHECKOUT_TIMEOUT = float(os.environ.get("GMP_CHECKOUT_TIMEOUT", "60"))
+GMP_SOCKET_TIMEOUT = float(os.environ.get("GMP_SOCKET_TIMEOUT", "120"))
+# Sessions idle for longer than this are pinged before being handed out again.
+GMP_HEALTHCHECK_INTERVAL = float(os.environ.get("GMP_HEALTHCHECK_INTERVAL", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class GmpPoolTimeout(Exception):
+    """Raised when no GMP session could be checked out in time."""
+
+
+class GmpSession:
+    """A single authenticated GMP connection to gvmd."""
+
+    def __init__(self, hostname: str, port: int, username: str, password: str, timeout: float,
+                 transform: Optional[Callable[[], Callable]] = transforms.EtreeTransform):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        # Factory of the python-gvm response transform, None answers with the raw response text.
+        self.transform = transform
+        self.gmp = None
+        self.last_used = 0.0
+
+    def open(self):
+        """Connect, negotiate the GMP version and authenticate."""
+        connection = gvm.connections.TLSConnection(
+            hostname=self.hostname, port=self.port, timeout=self.timeout
+        )
+        transform = self.transform() if self.transform is not None else None
+        gmp = openvas_gmp.Gmp(connection, transform=transform).determine_supported_gmp()
+        gmp.connect()
+        try:
+            with gmp_call("authenticate"):
+                gmp.authenticate(self.username, self.password)
+        except Exception:
+            gmp.disconnect()
+            raise
+        self.gmp = gmp
+        self.last_used = time.monotonic()
+        logger.info("Opened GMP session to %s:%s", self.hostname, self.port)
+
+    def close(self):
+        if self.gmp is None:
+            return
+        try:
+            self.gmp.disconnect()
+        except Exception as e:
+            logger.debug("Error while closing GMP session: %s", str(e))
+        self.gmp = None
+
+    def is_healthy(self) -> bool:
+        """Cheap liveness probe, only issued for sessions that sat idle."""
+        if self.gmp is None or not self.gmp.is_connected():
+            return False
+        if time.monotonic() - self.last_used < GMP_HEALTHCHECK_INTERVAL:
+            return True
+        try:
+            self.gmp.get_version()
+            return True
+        except Exception as e:
+            logger.info("GMP session failed health check: %s", str(e))
+            return False
+
+
+class _ReconnectOnFirstCommand:
+    """The ``Gmp`` of a reused session, as handed out by the pool.
+
+    gvmd or a proxy may have dropped the connection while it sat idle, which
+    the health check only notices after ``GMP_HEALTHCHECK_INTERVAL``. When the
+    first command fails on the connection itself, the session is reopened and
+    the command sent once more; gvmd's own error answers are passed on as is.
+    """
+
+    def __init__(self, session: GmpSession):
+        self._session = session
+        self._first = True
+
+    def __getattr__(self, name):
+        attr = getattr(self._session.gmp, name)
+        if not self._first or not callable(attr):
+            return attr
+
+        def first_command(*args, **kwargs):
+            if not self._first:
+                return getattr(self._session.gmp, name)(*args, **kwargs)
+            self._first = False
+            try:
+                return attr(*args, **kwargs)
+            except GvmResponseError:
+                raise
+            except (GvmError, OSError) as e:
+                logger.info("Reused GMP session failed on %s, reconnecting: %s", name, str(e))
+            self._session.close()
+            self._session.open()
+            return getattr(self._session.gmp, name)(*args, **kwargs)
+
+        return first_command
+
+
+class GmpSessionPool:
+    """Bounded, thread-safe pool of authenticated GMP sessions.
+
+    Sessions are opened lazily, reused across calls and transparently
+    re-established when gvmd drops the connection (e.g. after a restart):
+    idle sessions are probed before reuse, and a reused session whose first
+    command fails on the connection is reopened and the command retried once.
+    The pool is blocking; coroutines must use it from a worker thread.
+    """
+
+    def __init__(
+            self,
+            username: str,
+            password: str,
+            hostname: str = GMP_HOST,
+            port: int = GMP_PORT,
+            size: int = GMP_POOL_SIZE,
+            checkout_timeout: float = GMP_CHECKOUT_TIMEOUT,
+            socket_timeout: float = GMP_SOCKET_TIMEOUT,
+            transform: Optional[Callable[[], Callable]] = transforms.EtreeTransform,
+    ):
+        self.username = username
+        self.password = password
+        self.hostname = hostname
+        self.port = port
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.socket_timeout = socket_timeout
+        self.transform = transform
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    def _checkout(self) -> Tuple[GmpSession, bool]:
+        """An idle healthy session or a new one, and whether it was reused."""
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if session.is_healthy():
+                return session, True
+            session.close()
+
+        session = GmpSession(self.hostname, self.port, self.username, self.password, self.socket_timeout,
+                             self.transform)
+        session.open()
+        return session, False
+
+    def _checkin(self, session: GmpSession):
+        session.last_used = time.monotonic()
+        self._idle.put(session)
+
+    @contextmanager
+    def session(self):
+        """Check a GMP session out of the pool for the duration of the block.
+
+        Yields:
+            An authenticated, version specific ``Gmp`` object.
+
+        Raises:
+            GmpPoolTimeout: every session stayed busy for ``checkout_timeout``.
+        """
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise GmpPoolTimeout(f"No GMP session available after {self.checkout_timeout}s")
+        session = None
+        try:
+            session, reused = self._checkout()
+            yield _ReconnectOnFirstCommand(session) if reused else session.gmp
+        except GvmResponseError:
+            # gvmd rejected the command, the connection itself is fine.
+            if session is not None:
+                self._checkin(session)
+                session = None
+            raise
+        except BaseException:
+            if session is not None:
+                session.close()
+                session = None
+            raise
+        finally:
+            if session is not None:
+                self._checkin(session)
+            self._slots.release()
+
+    def close(self):
+        """Close every idle session."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+get_shared_pool = Shared(GmpSessionPool)
+# Sessions answering with the raw response text: reports are parsed incrementally
+# from that text instead of from a tree python-gvm would build of the whole response.
+get_report_pool = Shared(partial(GmpSessionPool, size=GMP_REPORT_POOL_SIZE, transform=None))
+
+
+def close_shared_pools():
+    """Close the idle sessions of the process wide pools, if they were created."""
+    for pool in (get_shared_pool.peek(), get_report_pool.peek()):
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,145 @@
+# log_watcher.py
+import logging
+import os
+import threading
+
+from agent.services import Shared
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # optional, fall back to stat polling
+    INotify = None
+
+LOG_FILE = "/usr/local/var/log/gvm/gvmd.log"
+VT_CHECK = b"Updating VTs in database ... done"
+POLL_INTERVAL = float(os.environ.get("VT_LOG_POLL_INTERVAL", "5"))
+READ_CHUNK = 64 * 1024
+# Longest inotify wait between checks of the stop flag.
+STOP_CHECK_INTERVAL = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class VtReadinessWatcher:
+    """Tail gvmd.log in the background until gvmd reports that VTs are loaded.
+
+    The log is read incrementally from the last offset; truncation or rotation
+    (a new inode at the same path) restarts reading from the beginning of the
+    new file. Readiness is a one-way latch, the thread exits once it is set.
+    """
+
+    def __init__(self, path: str = LOG_FILE, marker: bytes = VT_CHECK, poll_interval: float = POLL_INTERVAL):
+        self.path = path
+        self.marker = marker
+        self.poll_interval = poll_interval
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._inode = None
+        self._offset = 0
+        # Trailing bytes of the last chunk, so a marker split across reads still matches.
+        self._carry = b""
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="vt-log-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop tailing, waiting at most ``timeout`` seconds for the thread to exit."""
+        self._stop.set()
+        if self._thread is not None and timeout:
+            self._thread.join(timeout)
+
+    def _run(self):
+        notifier = self._create_notifier()
+        try:
+            while not self._stop.is_set():
+                try:
+                    if self._scan():
+                        self._ready.set()
+                        logger.info("VTs are loaded, %s reported: %s", self.path, self.marker.decode())
+                        return
+                except OSError as e:
+                    logger.info("Failed to read log file: %s", str(e))
+                self._sleep(notifier)
+        finally:
+            if notifier is not None:
+                notifier.close()
+
+    def _create_notifier(self):
+        if INotify is None:
+            return None
+        try:
+            notifier = INotify()
+            notifier.add_watch(
+                os.path.dirname(self.path),
+                inotify_flags.MODIFY | inotify_flags.CREATE | inotify_flags.MOVED_TO | inotify_flags.DELETE,
+            )
+            return notifier
+        except OSError as e:
+            logger.info("inotify unavailable, polling %s instead: %s", self.path, str(e))
+            return None
+
+    def _sleep(self, notifier):
+        if notifier is None:
+            self._stop.wait(self.poll_interval)
+            return
+        # Wake up on any change in the log directory, or after the poll interval at the latest.
+        # Read in short slices, a blocking read would not notice `stop`.
+        remaining = self.poll_interval
+        while remaining > 0 and not self._stop.is_set():
+            timeout = min(remaining, STOP_CHECK_INTERVAL)
+            if notifier.read(timeout=int(timeout * 1000)):
+                return
+            remaining -= timeout
+
+    def _scan(self) -> bool:
+        """Read whatever was appended since the last call.
+
+        Returns:
+            - bool: True once the marker line has been seen.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            if self._inode is not None:
+                logger.info("%s was rotated, reading it from the start", self.path)
+            self._inode = stat.st_ino
+            self._offset = 0
+            self._carry = b""
+
+        if stat.st_size == self._offset:
+            return False
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                self._offset += len(chunk)
+                data = self._carry + chunk
+                if self.marker in data:
+                    return True
+                self._carry = data[-(len(self.marker) - 1):]
+        return False
+
+
+def _start_watcher() -> VtReadinessWatcher:
+    watcher = VtReadinessWatcher()
+    watcher.start()
+    return watcher
+
+
+# The process wide watcher, started on first use.
+get_vt_watcher = Shared(_start_watcher)
@@ -1,24 +1,110 @@
+import contextlib
 import json
+import os
 import sys
-import threading
 import time
+from typing import List, Optional, Union
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 
-from agent.telemetry import get_server_stats, send_telemetry, send_scan_telemetry
-from openvas_wrapper import OpenVas
+from agent.telemetry import get_server_stats, send_telemetry, send_scan_telemetry, get_targets
+from agent.metrics import REGISTRY, CONTENT_TYPE
+from agent.gmp_executor import GmpExecutor, GmpBusy, GmpTimeout, GmpExecutorError
+from agent.gmp_pool import close_shared_pools
+from agent.openvas_wrapper import OpenVas, SCAN_GROUP_SIZE, SCAN_PROFILES, ScanProfile
+from agent.serialization import dumps
+from agent.scheduler import ScanScheduler, DEFAULT_PRIORITY
+from agent.task_poller import UnknownTask, get_task_poller
+from agent.retention import RetentionWorker
+from agent.pipeline import ScanPipeline
+from agent.report_workers import shutdown_report_workers
+from agent.scan_events import ScanEventListener
+from agent.services import LoopService
+from agent.log_watcher import get_vt_watcher
 import logging
 
-app = FastAPI()
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the background services once the server is up, stop them on shutdown.
+
+    Nothing here talks to gvmd or the panel, the services do that from their
+    own threads, so the API is ready as soon as the socket is bound.
+    """
+    logging.info("init openvas agent")
+    # Tailing gvmd.log from the start makes the first check_is_vas_online a flag read.
+    get_vt_watcher()
+    services = background_services()
+    for service in services:
+        service.start()
+    yield
+    logging.info("stopping openvas agent")
+    for service in reversed(services):
+        service.stop()
+    # Every loop finishes its current iteration before the pools below are closed.
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for service in reversed(services):
+        if isinstance(service, LoopService):
+            service.join(max(deadline - time.monotonic(), 0))
+    gmp_executor.shutdown()
+    # The telemetry exports share the process wide workers and pools with the API.
+    shutdown_report_workers()
+    close_shared_pools()
+
+
+app = FastAPI(lifespan=lifespan)
 
 openvas = OpenVas()
 
+gmp_executor = GmpExecutor()
+
+task_poller = get_task_poller(openvas)
+
+scan_events = ScanEventListener(task_poller)
+
+# Seconds lifespan shutdown waits for the background services to finish their iteration.
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "30"))
+
+# Upper bound for a single /wait_task request, clients re-issue it to keep waiting.
+MAX_WAIT_TASK_TIMEOUT = 240
+MAX_BATCH_TARGETS = 1000
+
 default_scan_config_id = "daba56c8-73ec-11df-a475-002264764cea"  # Default to GVMD_FULL_FAST_CONFIG
 
+scheduler = ScanScheduler(openvas, fetch_targets=get_targets, scan_config_id=default_scan_config_id)
+
+retention = RetentionWorker(openvas)
+
+pipeline = ScanPipeline(openvas, submit=scheduler.submit, task_poller=task_poller)
+
 
 class StartScanRequest(BaseModel):
     target: str
+    # Named entry of SCAN_PROFILES, the ids below override single parts of it.
+    profile: Optional[str] = None
+    scan_config_id: Optional[str] = None
+    port_list_id: Optional[str] = None
+    scanner_id: Optional[str] = None
+    # Run a discovery scan first and queue this profile only for live hosts with open ports.
+    pipeline: bool = False
+    priority: int = DEFAULT_PRIORITY
+
+
+class StartScansRequest(BaseModel):
+    targets: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_TARGETS)
+    group_size: int = Field(SCAN_GROUP_SIZE, ge=1)
+    # Same meaning as in StartScanRequest.
+    profile: Optional[str] = None
+    scan_config_id: Optional[str] = None
+    port_list_id: Optional[str] = None
+    scanner_id: Optional[str] = None
+
+
+class QueueTargetsRequest(BaseModel):
+    targets: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_TARGETS)
+    priority: int = DEFAULT_PRIORITY
 
 
 class ScanTask(BaseModel):
@@ -26,30 +112,155 @@ class ScanTask(BaseModel):
     target_id: str
 
 
+@app.exception_handler(GmpBusy)
+async def gmp_busy_handler(request: Request, exc: GmpBusy):
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(GmpTimeout)
+async def gmp_timeout_handler(request: Request, exc: GmpTimeout):
+    return JSONResponse(status_code=504, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+def resolve_profile(request: Union[StartScanRequest, StartScansRequest]) -> ScanProfile:
+    if request.profile is None:
+        profile = ScanProfile(default_scan_config_id)
+    elif request.profile in SCAN_PROFILES:
+        profile = SCAN_PROFILES[request.profile]
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown scan profile {request.profile}")
+    return ScanProfile(
+        request.scan_config_id or profile.config_id,
+        request.port_list_id or profile.port_list_id,
+        request.scanner_id or profile.scanner_id,
+    )
+
+
 @app.post("/start_scan")
 async def start_scan(request: StartScanRequest):
+    profile = resolve_profile(request)
     try:
-        task_id = openvas.start_scan(request.target, default_scan_config_id)
-        return {"task_id": task_id}
+        if request.pipeline:
+            tasks = await gmp_executor.run("start_scan", pipeline.start_discovery, [request.target], profile,
+                                           request.priority)
+        else:
+            task_id = await gmp_executor.run("start_scan", openvas.start_scan, request.target, *profile)
+            return {"task_id": task_id}
+    except GmpExecutorError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if request.target not in tasks:
+        raise HTTPException(status_code=500, detail=f"Failed to start discovery scan of {request.target}")
+    return {"task_id": tasks[request.target], "phase": "discovery"}
 
 
 @app.get("/wait_task/{task_id}")
-async def wait_task(task_id: str):
+async def wait_task(task_id: str, timeout: float = MAX_WAIT_TASK_TIMEOUT):
+    """Long-poll until the task finished or ``timeout`` seconds passed."""
+    timeout = min(max(timeout, 0), MAX_WAIT_TASK_TIMEOUT)
     try:
-        result = openvas.wait_task(task_id)
-        return {"result": result}
+        state = await task_poller.wait_finished(task_id, timeout)
+        if state is None:
+            return {"result": False, "status": None, "progress": None}
+        return {"result": state.done, "status": state.status, "progress": state.progress}
+    except UnknownTask:
+        raise HTTPException(status_code=404, detail=f"Unknown task {task_id}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/wait_task/{task_id}/events")
+async def wait_task_events(task_id: str):
+    """Server-Sent Events stream of the task's status and progress until it finishes."""
+    states = task_poller.stream(task_id)
+    try:
+        # Unknown tasks are answered with a 404 before the stream starts.
+        first = await states.__anext__()
+    except UnknownTask:
+        raise HTTPException(status_code=404, detail=f"Unknown task {task_id}")
+
+    async def events():
+        state = first
+        try:
+            while True:
+                if state is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: progress\ndata: {json.dumps(state.to_dict())}\n\n"
+                state = await states.__anext__()
+        except StopAsyncIteration:
+            return
+        except UnknownTask:
+            # Deleted from gvmd while it was watched.
+            yield "event: not_found\ndata: {}\n\n"
+        finally:
+            await states.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/start_scans")
+async def start_scans(request: StartScansRequest):
+    profile = resolve_profile(request)
+    try:
+        tasks = await gmp_executor.run("start_scans", openvas.start_scans, request.targets, profile.config_id,
+                                       request.group_size, profile.port_list_id, profile.scanner_id)
+        failed = [target for target in request.targets if target not in tasks]
+        return {"tasks": tasks, "failed": failed}
+    except GmpExecutorError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/scheduler")
+async def scheduler_status():
+    return scheduler.status()
+
+
+@app.get("/retention")
+async def retention_status():
+    return retention.status()
+
+
+@app.get("/pipeline")
+async def pipeline_status():
+    return pipeline.status()
+
+
+@app.get("/scanners")
+async def scanners_status():
+    return openvas.scanners.status()
+
+
+@app.get("/scan_events")
+async def scan_events_status():
+    return scan_events.status()
+
+
+@app.post("/scheduler/targets")
+async def queue_targets(request: QueueTargetsRequest):
+    queued = [target for target in request.targets if scheduler.submit(target, request.priority)]
+    return {"queued": queued, "queue_depth": scheduler.queue_depth()}
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
 # get_scanned_targets_count
 @app.get("/get_scanned_targets_count")
 async def get_scanned_targets_count():
     try:
-        count = openvas.active_scans_count()
+        count = await gmp_executor.run("active_scans_count", openvas.active_scans_count)
         return {"count": count}
+    except GmpExecutorError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -58,8 +269,10 @@ async def get_scanned_targets_count():
 @app.get("/check_is_vas_online")
 async def check_is_vas_online():
     try:
-        online = openvas.check_is_vas_online()
+        online = await gmp_executor.run("check_is_vas_online", openvas.check_is_vas_online)
         return {"online": online}
+    except GmpBusy:
+        raise
     except Exception as e:
         return {"online": False}
 
@@ -67,37 +280,42 @@ async def check_is_vas_online():
 @app.get("/get_results")
 async def get_results():
     try:
-        results = openvas.get_results()
+        results = await gmp_executor.run("get_results", openvas.get_results)
         return {"results": results}
+    except GmpExecutorError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def telemetry_thread():
-    while True:
-        # check is macos
-        if sys.platform == 'darwin':
-            return
-        server_stats = get_server_stats()
-        json_stats = json.dumps(server_stats, indent=4)
-        send_telemetry(json_stats)
-        time.sleep(10)  # 30 Sec interval
+def send_server_telemetry():
+    server_stats = get_server_stats()
+    send_telemetry(dumps(server_stats))
 
 
 def send_scan_results():
-    while True:
-        logging.info("init send_scan_results")
-        vas_online = openvas.check_is_vas_online()
-        if vas_online:
-            send_scan_telemetry()
+    logging.info("init send_scan_results")
+    scan_events.begin_export()
+    if openvas.check_is_vas_online():
+        send_scan_telemetry()
+    else:
         logging.info("check_is_vas_online() False")
-        time.sleep(15)  # 15 Sec interval
+
+
+telemetry_service = LoopService("telemetry", send_server_telemetry, interval=10)
+
+# Returns as soon as a scan finishes, otherwise on the fallback timer.
+export_service = LoopService("send_scan_results", send_scan_results, wait=scan_events.wait_for_export)
+
+
+def background_services() -> list:
+    """Everything started with the app, in start order."""
+    services = [] if sys.platform == 'darwin' else [telemetry_service]
+    services += [scan_events, export_service, scheduler, retention, pipeline, task_poller, openvas.scanners]
+    return services
 
 
 if __name__ == "__main__":
-    logging.info("init openvas agent")
-    threading.Thread(target=telemetry_thread, daemon=True).start()
-    threading.Thread(target=send_scan_results, daemon=True).start()
     import uvicorn
 
     uvicorn.run(app, host="0.0.0.0", port=8011)
@@ -0,0 +1,221 @@
+# metrics.py
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Upper bounds in seconds, from a cached lookup to a full report download.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic counter, one series per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. the size of the last batch."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Fixed bucket histogram, observing is a bisect and three additions under a lock."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format of every registered metric."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+GMP_CALL_SECONDS = REGISTRY.register(Histogram(
+    "openvas_agent_gmp_call_seconds", "Duration of OpenVas wrapper methods and GMP commands.", ("method",)))
+GMP_CALL_ERRORS = REGISTRY.register(Counter(
+    "openvas_agent_gmp_call_errors_total", "OpenVas wrapper methods and GMP commands that raised.",
+    ("method", "error")))
+PANEL_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "openvas_agent_panel_request_seconds", "Duration of requests to the panel, retries included.", ("path",)))
+PANEL_REQUEST_ERRORS = REGISTRY.register(Counter(
+    "openvas_agent_panel_request_errors_total", "Panel requests that failed or were not answered with 200.",
+    ("path", "reason")))
+PANEL_BYTES_SENT = REGISTRY.register(Counter(
+    "openvas_agent_panel_bytes_sent_total", "Request body bytes sent to the panel, after compression.", ("path",)))
+LOOP_SECONDS = REGISTRY.register(Histogram(
+    "openvas_agent_loop_iteration_seconds", "Duration of one iteration of a background loop.", ("loop",)))
+REPORT_ROWS_PARSED = REGISTRY.register(Counter(
+    "openvas_agent_report_rows_parsed_total", "Result rows parsed from gvmd reports."))
+REPORT_WORKER_FAILURES = REGISTRY.register(Counter(
+    "openvas_agent_report_worker_failures_total", "Reports the parsing workers failed on.", ("reason",)))
+SCANNER_ACTIVE_TASKS = REGISTRY.register(Gauge(
+    "openvas_agent_scanner_active_tasks", "Queued and running tasks per gvmd scanner.", ("scanner",)))
+SCANNER_HEALTHY = REGISTRY.register(Gauge(
+    "openvas_agent_scanner_healthy", "1 when the scanner passed its last verify_scanner.", ("scanner",)))
+EXPORT_ROWS = REGISTRY.register(Histogram(
+    "openvas_agent_export_cycle_rows", "New result rows sent per export cycle.", buckets=COUNT_BUCKETS))
+
+
+def timed(method: str = None):
+    """Record duration and errors of the decorated function in ``GMP_CALL_SECONDS``.
+
+    Generator functions are measured until they are exhausted or closed.
+    """
+
+    def decorator(func):
+        name = method or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    yield from func(*args, **kwargs)
+                except Exception as e:
+                    GMP_CALL_ERRORS.inc(method=name, error=type(e).__name__)
+                    raise
+                finally:
+                    GMP_CALL_SECONDS.observe(time.perf_counter() - started, method=name)
+            return wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                GMP_CALL_ERRORS.inc(method=name, error=type(e).__name__)
+                raise
+            finally:
+                GMP_CALL_SECONDS.observe(time.perf_counter() - started, method=name)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def gmp_call(method: str):
+    """Like `timed`, for a single GMP command issued inline."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        GMP_CALL_ERRORS.inc(method=method, error=type(e).__name__)
+        raise
+    finally:
+        GMP_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
@@ -6,26 +6,47 @@ import logging
 import base64
 import os
 import socket
+import threading
 import time
 from io import StringIO
-from typing import Union, List, Dict, Any
+from typing import Union, List, Dict, Any, Iterator, Optional, Tuple, NamedTuple
 
-import gvm
+from gvm.errors import GvmResponseError
 from gvm.protocols import gmp as openvas_gmp
-from gvm import transforms
+from gvm.transforms import check_command_status
+from lxml import etree
+
+from agent.export_state import ExportBatch
+from agent.gmp_pool import GmpSessionPool, get_report_pool, get_shared_pool
+from agent.log_watcher import get_vt_watcher
+from agent.metrics import REPORT_ROWS_PARSED, gmp_call, timed
+from agent.report_parser import ResultRecord, fetch_report_results
+from agent.report_workers import ReportWorkerPool, get_report_workers
+from agent.scanners import LOCAL_SCANNER_ID, ScannerBalancer, get_scanner_balancer
+from agent.target_index import TargetIndex, TARGET_REUSE, get_target_index, hosts_key
+from agent.task_poller import get_active_tasks_cache, task_started, ACTIVE_TASK_STATUSES
 
 ALL_IANA_ASSIGNED_TCP_UDP = "4a4717fe-57d2-11e1-9a26-406186ea4fc5"
 GVMD_FULL_FAST_CONFIG = "daba56c8-73ec-11df-a475-002264764cea"
 GVMD_FULL_DEEP_ULTIMATE_CONFIG = "74db13d6-7489-11df-91b9-002264764cea"
-OPENVAS_SCANNER_ID = "08b69003-5fc2-4037-a479-93b440211c73"
+OPENVAS_SCANNER_ID = LOCAL_SCANNER_ID
+GVMD_DISCOVERY_CONFIG = "8715c877-47a0-438d-98a3-27c7a6ab2196"
+ALL_TCP_NMAP_TOP_100_UDP = "730ef368-57e2-11e1-a90f-406186ea4fc5"
 GMP_USERNAME = "admin"
 GMP_PASSWORD = "admin"
 WAIT_TIME = 30
-hostname = "localhost"
-IS_UPDATE_VT = False
-
-LOG_FILE = "/usr/local/var/log/gvm/gvmd.log"
-VT_CHECK = b"Updating VTs in database ... done"
+ACTIVE_TASKS_FILTER = ('rows=-1 first=1 status="Requested" or status="Queued" '
+                       'or status="Running" or status="Stop Requested"')
+FINISHED_TASKS_FILTER = 'rows=-1 first=1 status="Done" or status="Stopped" or status="Interrupted"'
+# Hosts grouped into one gvmd target/task by start_scans.
+SCAN_GROUP_SIZE = int(os.environ.get("SCAN_GROUP_SIZE", "1"))
+REPORT_PAGE_SIZE = int(os.environ.get("REPORT_PAGE_SIZE", "500"))
+REPORT_RESULT_FILTER = "apply_overrides=0 levels=hml min_qod=70 sort-reverse=severity"
+# "xml" parses gvmd's native report format incrementally, "csv" decodes the CSV
+# Results format (the parity scenario of benchmarks/run.py compares both).
+REPORT_PARSER = os.environ.get("REPORT_PARSER", "xml")
+# With REPORT_PARSER=csv, every report fetched by get_results is also written there as CSV.
+REPORT_SAVE_DIR = os.environ.get("REPORT_SAVE_DIR", "")
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -36,35 +57,94 @@ logging.basicConfig(level=logging.INFO,
 logger = logging.getLogger(__name__)
 
 
+class ScanProfile(NamedTuple):
+    """gvmd scan config, port list and scanner a task is created with.
+
+    Without a scanner id, every task goes to the least loaded healthy scanner.
+    """
+
+    config_id: str
+    port_list_id: str = ALL_IANA_ASSIGNED_TCP_UDP
+    scanner_id: Optional[str] = None
+
+
+SCAN_PROFILES = {
+    "full_fast": ScanProfile(GVMD_FULL_FAST_CONFIG),
+    "full_deep": ScanProfile(GVMD_FULL_DEEP_ULTIMATE_CONFIG),
+    "discovery": ScanProfile(GVMD_DISCOVERY_CONFIG, ALL_TCP_NMAP_TOP_100_UDP),
+}
+
+_report_format_ids = {}
+_report_formats_lock = threading.Lock()
+
+
 class OpenVas:
     """OpenVas wrapper to enable using openvas scanner from ostorlab agent class."""
 
-    def start_scan(self, target: str, scan_config_id: str) -> str:
+    def __init__(
+            self,
+            pool: GmpSessionPool = None,
+            page_size: int = REPORT_PAGE_SIZE,
+            report_workers: Optional[ReportWorkerPool] = None,
+            report_pool: GmpSessionPool = None,
+    ):
+        """
+        Args:
+            pool: GMP session pool to use, defaults to the process wide pool.
+            report_pool: pool of raw text sessions XML reports are fetched on,
+                defaults to the process wide one.
+            page_size: number of results fetched per report page.
+            report_workers: processes reports are parsed in, defaults to the
+                process wide pool (none with REPORT_WORKERS=0).
+        """
+        self.pool = pool if pool is not None else get_shared_pool(GMP_USERNAME, GMP_PASSWORD)
+        self.page_size = page_size
+        self._report_workers = report_workers
+        self._report_pool = report_pool
+
+    @property
+    def scanners(self) -> ScannerBalancer:
+        return get_scanner_balancer(self.pool)
+
+    @property
+    def report_pool(self) -> GmpSessionPool:
+        if self._report_pool is None:
+            self._report_pool = get_report_pool(GMP_USERNAME, GMP_PASSWORD)
+        return self._report_pool
+
+    @property
+    def report_workers(self) -> Optional[ReportWorkerPool]:
+        if self._report_workers is None:
+            self._report_workers = get_report_workers()
+        return self._report_workers
+
+    @timed()
+    def start_scan(
+            self,
+            target: str,
+            scan_config_id: str,
+            port_list_id: str = ALL_IANA_ASSIGNED_TCP_UDP,
+            scanner_id: Optional[str] = None,
+    ) -> str:
         """Start OpenVas scan on the ip provided.
 
         Args:
             target: Target IP or Domain to scan.
             scan_config_id: scan configuration used by the task.
+            port_list_id: port list of the target.
+            scanner_id: scanner running the task, the least loaded one if None.
         Returns:
             OpenVas task identifier.
         """
-        connection = gvm.connections.TLSConnection(hostname=hostname)
-        transform = transforms.EtreeTransform()
-        with openvas_gmp.Gmp(connection, transform=transform) as gmp:
-            gmp.authenticate(GMP_USERNAME, GMP_PASSWORD)
-            logger.debug("Creating target")
-            target_id = self._create_target(gmp, target, ALL_IANA_ASSIGNED_TCP_UDP)
-            logger.debug("Creating task for target %s", target_id)
+        with self.pool.session() as gmp:
             logger.info("Config ID is %s", str(scan_config_id))
-            task_id = self._create_task(
+            task_id, report_id = self._launch(
                 gmp,
+                [target],
                 target,
-                target_id,
-                GVMD_FULL_FAST_CONFIG,
-                OPENVAS_SCANNER_ID,
+                ScanProfile(scan_config_id, port_list_id, scanner_id),
             )
-            logger.debug("Creating report for task %s", task_id)
-            report_id = self._start_task(gmp, task_id)
+            get_active_tasks_cache().invalidate()
             logger.info(
                 "Started scan of host %s. Corresponding report ID is %s",
                 str(target),
@@ -72,13 +152,181 @@ class OpenVas:
             )
             return task_id
 
+    @timed()
+    def start_scans(
+            self,
+            targets: List[str],
+            scan_config_id: str,
+            group_size: int = SCAN_GROUP_SIZE,
+            port_list_id: str = ALL_IANA_ASSIGNED_TCP_UDP,
+            scanner_id: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """Start OpenVas scans for a batch of targets over a single GMP session.
+
+        Up to ``group_size`` hosts share one gvmd target and task, which turns
+        three round trips per host into three per group.
+
+        Args:
+            targets: Target IPs or Domains to scan.
+            scan_config_id: scan configuration used by the tasks.
+            group_size: maximum number of hosts per gvmd target/task.
+            port_list_id: port list of the targets.
+            scanner_id: scanner running the tasks, placed per group on the least
+                loaded one if None.
+        Returns:
+            dict: target -> OpenVas task identifier. Targets whose group failed
+            to start are left out, as are the remaining groups when the session
+            breaks; groups started before that keep their tasks.
+        """
+        targets = list(dict.fromkeys(targets))
+        group_size = max(1, group_size)
+        profile = ScanProfile(scan_config_id, port_list_id, scanner_id)
+        tasks = {}
+        try:
+            with self.pool.session() as gmp:
+                for i in range(0, len(targets), group_size):
+                    group = targets[i:i + group_size]
+                    label = group[0] if len(group) == 1 else f"{group[0]} (+{len(group) - 1})"
+                    try:
+                        task_id, report_id = self._launch(gmp, group, label, profile)
+                    except GvmResponseError as e:
+                        logger.info("Failed to start scan of %s: %s", label, str(e))
+                        continue
+                    logger.info(
+                        "Started scan of hosts %s. Corresponding report ID is %s",
+                        label,
+                        str(report_id),
+                    )
+                    tasks.update((target, task_id) for target in group)
+        except Exception as e:
+            # Raised out of the session so the pool drops the broken connection.
+            # The started groups are still returned, callers retrying the rest
+            # must not start them a second time.
+            logger.info("Scan batch aborted after %d of %d targets: %s", len(tasks), len(targets), str(e))
+        finally:
+            get_active_tasks_cache().invalidate()
+        return tasks
+
+    def _launch(
+            self,
+            gmp: openvas_gmp.Gmp,
+            hosts: List[str],
+            label: str,
+            profile: ScanProfile,
+    ) -> Tuple[str, str]:
+        """Start a scan of ``hosts``, reusing their target and previous task when possible.
+
+        A finished task scanning the same hosts with the same config and scanner
+        is re-run with start_task. Otherwise a task is created on the known
+        target, or on a new target when none exists. Index entries gvmd rejects
+        are dropped and the next fallback is tried.
+
+        Returns:
+            - (task id, report id).
+        """
+        scan_config_id, port_list_id, scanner_id = profile
+        if scanner_id is None:
+            scanner_id = self.scanners.choose(gmp)
+        task_id, report_id = self._launch_on(gmp, hosts, label, scan_config_id, port_list_id, scanner_id)
+        # Counted only once the task runs, a failed start must not leave load on the scanner.
+        self.scanners.count_started(scanner_id)
+        return task_id, report_id
+
+    def _launch_on(
+            self,
+            gmp: openvas_gmp.Gmp,
+            hosts: List[str],
+            label: str,
+            scan_config_id: str,
+            port_list_id: str,
+            scanner_id: str,
+    ) -> Tuple[str, str]:
+        index = self._get_target_index(gmp)
+        target_id = index.get_target(hosts, port_list_id) if index is not None else None
+        if target_id is not None:
+            task_id = index.get_task(target_id, scan_config_id, scanner_id)
+            if task_id is not None:
+                try:
+                    if self._is_task_idle(gmp, task_id):
+                        logger.debug("Re-running task %s", task_id)
+                        return task_id, self._start_task(gmp, task_id)
+                except GvmResponseError as e:
+                    logger.info("Cannot re-run task %s: %s", task_id, str(e))
+                    index.forget_task(task_id)
+            try:
+                logger.debug("Creating task for known target %s", target_id)
+                task_id = self._create_task(gmp, label, target_id, scan_config_id, scanner_id)
+            except GvmResponseError as e:
+                logger.info("Cannot reuse target %s: %s", target_id, str(e))
+                index.forget_target(target_id)
+                target_id = None
+            else:
+                index.add_task(target_id, scan_config_id, scanner_id, task_id)
+                return task_id, self._start_task(gmp, task_id)
+
+        logger.debug("Creating target")
+        target_id = self._create_target(gmp, hosts, port_list_id)
+        logger.debug("Creating task for target %s", target_id)
+        task_id = self._create_task(gmp, label, target_id, scan_config_id, scanner_id)
+        if index is not None:
+            index.add_target(hosts, port_list_id, target_id)
+            index.add_task(target_id, scan_config_id, scanner_id, task_id)
+        logger.debug("Creating report for task %s", task_id)
+        return task_id, self._start_task(gmp, task_id)
+
+    @staticmethod
+    def _is_task_idle(gmp: openvas_gmp.Gmp, task_id: str) -> bool:
+        """True when the task is not queued or running, so starting it again is safe."""
+        response = gmp.get_task(task_id)
+        check_command_status(response)
+        status = response.findtext("task/status")
+        return status is not None and status not in ACTIVE_TASK_STATUSES
+
+    def _get_target_index(self, gmp: openvas_gmp.Gmp) -> Optional[TargetIndex]:
+        """Return the target index, loading it from gvmd the first time it is used.
+
+        Returns:
+            - None when target reuse is disabled.
+        """
+        if not TARGET_REUSE:
+            return None
+        index = get_target_index()
+        if not index.synced:
+            try:
+                index.load(*self._list_reusable(gmp))
+            except Exception as e:
+                # The local copy is used until gvmd can be listed.
+                logger.info("Failed to load target index from gvmd: %s", str(e))
+        return index
+
+    @staticmethod
+    def _list_reusable(gmp: openvas_gmp.Gmp) -> Tuple[dict, dict]:
+        """List the targets and tasks known to gvmd in the shape `TargetIndex.load` expects."""
+        targets = {}
+        for target in gmp.get_targets(filter_string="rows=-1 first=1").xpath("target"):
+            port_list = target.find("port_list")
+            hosts = (target.findtext("hosts") or "").split(",")
+            if port_list is None or not hosts_key(hosts):
+                continue
+            targets[(hosts_key(hosts), port_list.attrib.get("id"))] = target.attrib.get("id")
+        tasks = {}
+        for task in gmp.get_tasks(filter_string="rows=-1 first=1", details=False).xpath("task"):
+            refs = [task.find(tag) for tag in ("target", "config", "scanner")]
+            if any(ref is None or not ref.attrib.get("id") for ref in refs):
+                continue
+            tasks[tuple(ref.attrib.get("id") for ref in refs)] = task.attrib.get("id")
+        return targets, tasks
+
     def _create_target(
-            self, gmp: openvas_gmp.Gmp, target: str, port_list_id: str
+            self, gmp: openvas_gmp.Gmp, target: Union[str, List[str]], port_list_id: str
     ) -> str:
-        name = f"Testing Host {target} {datetime.datetime.now()}"
+        hosts = [target] if isinstance(target, str) else list(target)
+        label = hosts[0] if len(hosts) == 1 else f"{hosts[0]} (+{len(hosts) - 1})"
+        name = f"Testing Host {label} {datetime.datetime.now()}"
         response = gmp.create_target(
-            name=name, hosts=[target], port_list_id=port_list_id
+            name=name, hosts=hosts, port_list_id=port_list_id
         )
+        check_command_status(response)
         return response.get("id")
 
     def _create_task(
@@ -108,6 +356,7 @@ class OpenVas:
             target_id=target_id,
             scanner_id=scanner_id,
         )
+        check_command_status(response)
         return response.get("id")
 
     def _start_task(self, gmp: openvas_gmp.Gmp, task_id: str) -> str:
@@ -121,208 +370,431 @@ class OpenVas:
             - task result.
         """
         response = gmp.start_task(task_id)
+        check_command_status(response)
+        # A re-run task keeps its id, the poller must not report its previous run.
+        task_started(task_id)
         return response[0].text
 
+    @timed()
     def check_is_vas_online(self):
         """Check if openvas is online.
 
         Returns:
             - bool: True if openvas is online, False otherwise.
         """
-        print("check_is_vas_online")
-        global IS_UPDATE_VT
-        print("IS_UPDATE_VT -> ", IS_UPDATE_VT)
-        if not IS_UPDATE_VT:
-            try:
-                if not os.path.exists(LOG_FILE):
-                    logger.info("Log file does not exist: %s", LOG_FILE)
-                    return False
-
-                with open(LOG_FILE, "rb") as f:
-                    for line in f.readlines():
-                        if VT_CHECK in line:
-                            IS_UPDATE_VT = True
-                            return True
-                    logger.info("VTs are not updated yet")
-                    return False
-            except Exception as e:
-                logger.info("Failed to read log file: %s", str(e))
-                return False
+        # gvmd.log is tailed by a background watcher, this is just a flag read.
+        if not get_vt_watcher().is_ready():
+            logger.info("VTs are not updated yet")
+            return False
 
         try:
-            connection = gvm.connections.TLSConnection(hostname="localhost")
-            transform = transforms.EtreeTransform()
-            with openvas_gmp.Gmp(connection, transform=transform) as gmp:
-                try:
-                    gmp.authenticate(GMP_USERNAME, GMP_PASSWORD)
-                    return True
-                except Exception as e:
-                    logger.info("Failed to connect to OpenVas: %s", str(e))
-                    return False
+            # Checking a session out authenticates it, or health checks an
+            # already open one.
+            with self.pool.session():
+                return True
         except Exception as e:
             logger.info("Failed to connect to OpenVas: %s", str(e))
             return False
 
-    def wait_task(self, task_id: str) -> bool:
+    @timed()
+    def wait_task(self, task_id: str, timeout: float = None) -> bool:
         """check gmp task status and wait until it is Done.
 
         Args:
             task_id: task id.
+            timeout: give up after this many seconds, wait forever if None.
 
         Returns:
             - bool task status.
         """
         logger.info("Waiting for task %s", task_id)
-        connection = gvm.connections.TLSConnection(hostname=hostname)
-        transform = transforms.EtreeTransform()
-        with openvas_gmp.Gmp(connection, transform=transform) as gmp:
-            gmp.authenticate(GMP_USERNAME, GMP_PASSWORD)
-            while True:
-                try:
-                    resp_tasks = gmp.get_tasks().xpath("task")
-                    for task in resp_tasks:
-                        logger.debug("Checking task %s", task.xpath("@id")[0])
-                        if task.xpath("@id")[0] == task_id:
-                            logger.info(
-                                "Scan progress %s", str(task.find("progress").text)
-                            )
-                            if task.find("status").text == "Done":
-                                return True
-                except socket.timeout:
-                    logger.info("Socket timeout error")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            try:
+                # Only hold a pooled session while querying, not while sleeping.
+                with self.pool.session() as gmp:
+                    resp_tasks = gmp.get_task(task_id).xpath("task")
+                for task in resp_tasks:
+                    logger.info(
+                        "Scan progress %s", str(task.find("progress").text)
+                    )
+                    if task.find("status").text == "Done":
+                        return True
+            except socket.timeout:
+                logger.info("Socket timeout error")
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(WAIT_TIME, remaining))
+            else:
                 time.sleep(WAIT_TIME)
 
+    @timed()
+    def get_task_states(self, filter_string: str = "rows=-1 first=1") -> Dict[str, tuple]:
+        """Fetch status and progress of every matching task in a single query.
+
+        Args:
+            filter_string: gvmd filter selecting the tasks.
+
+        Returns:
+            - dict: task id -> (name, status, progress).
+        """
+        with self.pool.session() as gmp:
+            resp_tasks = gmp.get_tasks(filter_string=filter_string, details=False).xpath("task")
+        states = {}
+        for task in resp_tasks:
+            try:
+                progress = int(task.findtext("progress") or 0)
+            except ValueError:
+                progress = 0
+            states[task.attrib.get("id")] = (task.findtext("name"), task.findtext("status"), progress)
+        return states
+
+    @timed()
+    def get_active_task_states(self) -> Dict[str, tuple]:
+        """Like `get_task_states`, restricted server side to queued and running tasks."""
+        return self.get_task_states(ACTIVE_TASKS_FILTER)
+
+    @timed()
     def active_scans_count(self) -> int:
         """Fetch the number of currently scanned targets.
 
+        Answered from the shared active task cache, which queries gvmd at most
+        once per ``ACTIVE_TASKS_TTL`` seconds.
+
         Returns:
             - int: The number of targets currently being scanned.
         """
         try:
-            connection = gvm.connections.TLSConnection(hostname=hostname)
-            transform = transforms.EtreeTransform()
-            with openvas_gmp.Gmp(connection, transform=transform) as gmp:
-                gmp.authenticate(GMP_USERNAME, GMP_PASSWORD)
-                resp_tasks = gmp.get_tasks().xpath("task")
-                scanned_targets_count = sum(1 for task in resp_tasks if task.find("status").text != "Done")
-                return scanned_targets_count
+            return len(get_active_tasks_cache().get(self))
         except Exception as e:
             logger.info("Failed to get active scans count: %s", str(e))
             return 0
 
-    def get_report(self, report_id, file_name):
-        # First, find the right report ID
-        connection = gvm.connections.TLSConnection(hostname=hostname)
-        transform = transforms.EtreeTransform()
-        with openvas_gmp.Gmp(connection, transform=transform) as gmp:
-            gmp.authenticate(GMP_USERNAME, GMP_PASSWORD)
-            resp = gmp.get_report_formats()
-            report_formats = resp.xpath("//report_format")  # [-1].xpath("@id")
-            report_format_id = False
-            extension = ""
-            for f in report_formats:
-                save_file = False
-                if f.xpath(".//name")[1].text == "CSV Results":
-                    report_format_id = f.xpath("@id")[0]
-                    save_file = True
-                    extension = "csv"
-                elif f.xpath(".//name")[1].text == "XML":
-                    report_format_id = f.xpath("@id")[0]
-                    save_file = True
-                    extension = "xml"
-
-                # Print the data and/or add it to a file
-                resp = gmp.get_report(report_id, report_format_id=report_format_id, ignore_pagination=True)
-
-                if save_file == True:
-                    if extension == "csv":
-                        f = open("{}.{}".format(file_name, extension), "wb")
-                        csv_in_b64 = resp.xpath('report/text()')[0]
-                        csv = base64.b64decode(csv_in_b64)
-                        f.write(csv)
-                        f.close()
-                        print("Report saved to {}.{}".format(file_name, extension))
-                    if extension == "xml":
-                        f = open("{}.{}".format(file_name, extension), "w")
-                        resp = gmp.get_report(report_id, report_format_id=report_format_id, ignore_pagination=True)
-                        print("xml resp")
-                        # data = print_pretty_xml(resp)
-                        # f.write(data)
-                        # f.close()
-
-    def get_results(self) -> Union[str, list[dict[Any, Any]]]:
+    @timed()
+    def get_finished_tasks(self) -> Dict[str, tuple]:
+        """Fetch every task that will not run anymore.
+
+        Returns:
+            - dict: task id -> (target id, modification time).
+        """
+        with self.pool.session() as gmp:
+            resp_tasks = gmp.get_tasks(filter_string=FINISHED_TASKS_FILTER, details=False).xpath("task")
+        return {
+            task.attrib.get("id"): (task.find("target").attrib.get("id"), task.findtext("modification_time"))
+            for task in resp_tasks
+        }
+
+    @timed()
+    def get_report_index(self) -> List[tuple]:
+        """List every report without its results.
+
+        Returns:
+            - list: (report id, task id, modification time, scan run status).
+        """
+        with self.pool.session() as gmp:
+            all_reports = gmp.get_reports(details=False, filter_string="rows=-1 first=1").xpath("report")
+        return [
+            (
+                report.attrib.get("id"),
+                report.find("task").attrib.get("id"),
+                report.findtext("modification_time"),
+                report.findtext("report/scan_run_status"),
+            )
+            for report in all_reports
+        ]
+
+    @timed()
+    def delete_task(self, task_id: str) -> bool:
+        """Delete a task together with its reports, bypassing the trashcan.
+
+        Returns:
+            - bool: False if the task is running again and was kept.
+        """
+        with self.pool.session() as gmp:
+            # The task may have been re-run since it was picked for deletion.
+            if not self._is_task_idle(gmp, task_id):
+                return False
+            check_command_status(gmp.delete_task(task_id, ultimate=True))
+        if TARGET_REUSE:
+            get_target_index().forget_task(task_id)
+        return True
+
+    @timed()
+    def delete_target_if_unused(self, target_id: str) -> bool:
+        """Delete a target unless a task still uses it.
+
+        Returns:
+            - bool: True if the target was deleted.
+        """
+        with self.pool.session() as gmp:
+            target = gmp.get_target(target_id, tasks=True).find("target")
+            if target is None or target.findtext("in_use") == "1":
+                return False
+            check_command_status(gmp.delete_target(target_id, ultimate=True))
+        if TARGET_REUSE:
+            get_target_index().forget_target(target_id)
+        return True
+
+    @timed()
+    def get_open_port_hosts(self, task_id: str) -> List[str]:
+        """Hosts of the task's last report with at least one open port.
+
+        gvmd only lists hosts it found alive in a report, and their ports section
+        holds every port a finding was reported on ("general/..." pseudo ports
+        excluded).
+
+        Returns:
+            - list: host addresses, empty if the task has no report.
+        """
+        with self.pool.session() as gmp:
+            task = gmp.get_task(task_id)
+            check_command_status(task)
+            last_report = task.find("task/last_report/report")
+            if last_report is None:
+                return []
+            response = gmp.get_report(
+                last_report.attrib.get("id"),
+                filter_string="apply_overrides=0 levels=hmlg min_qod=0 rows=-1 first=1",
+                details=True,
+                ignore_pagination=True,
+            )
+        hosts = {}
+        for port in response.xpath("report/report/ports/port"):
+            name = (port.text or "").strip()
+            host = port.findtext("host")
+            if host and name and not name.startswith("general/"):
+                hosts[host.strip()] = None
+        return list(hosts)
+
+    def _get_report_format_id(self, gmp: openvas_gmp.Gmp, name: str) -> str:
+        """Resolve a report format id by name.
+
+        Report format ids never change for a running gvmd, so they are looked up
+        once and cached for the life of the process.
+
+        Args:
+            gmp: GMP object.
+            name: report format name, e.g. "CSV Results" or "XML".
+
+        Returns:
+            - str: report format id, empty if gvmd has no such format.
+        """
+        with _report_formats_lock:
+            if not _report_format_ids:
+                report_formats_response = gmp.get_report_formats()
+                for report_format in report_formats_response.xpath('report_format'):
+                    _report_format_ids[report_format.find('name').text] = report_format.attrib.get("id")
+                logger.info("Cached %d report formats", len(_report_format_ids))
+            for format_name, report_format_id in _report_format_ids.items():
+                if format_name.startswith(name):
+                    return report_format_id
+        return ""
+
+    @timed()
+    def get_report(self, report_id: str, file_name: str, report_format: str = "CSV Results") -> str:
+        """Download a complete report once and save it to disk.
+
+        Args:
+            report_id: report to download.
+            file_name: path of the file to write, without extension.
+            report_format: "CSV Results" or "XML".
+
+        Returns:
+            - str: path of the saved report.
+        """
+        with self.pool.session() as gmp:
+            report_format_id = self._get_report_format_id(gmp, report_format)
+            if not report_format_id:
+                raise ValueError(f"Report format {report_format} not found")
+            response = gmp.get_report(report_id, report_format_id=report_format_id, ignore_pagination=True)
+
+        report_element = response.find("report")
+        if report_format == "XML":
+            path = "{}.{}".format(file_name, "xml")
+            with open(path, "wb") as f:
+                f.write(etree.tostring(report_element))
+        else:
+            path = "{}.{}".format(file_name, "csv")
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(report_element.find("report_format").tail))
+        logger.info("Report saved to %s", path)
+        return path
+
+    @timed()
+    def get_results(self, batch: ExportBatch = None) -> Union[str, list[dict[Any, Any]]]:
         """get gmp report result in json format with detailed keys.
 
+        Args:
+            batch: optional export batch; finished reports it already shipped are
+                not fetched again and already shipped results are left out.
+
         Returns:
             - Union[str, list[dict[Any, Any]]]: JSON formatted
         """
-        connection = gvm.connections.TLSConnection(hostname=hostname)
-        transform = transforms.EtreeTransform()
-        with openvas_gmp.Gmp(connection, transform=transform) as gmp:
-            gmp.authenticate(GMP_USERNAME, GMP_PASSWORD)
-            report_format_id = ""
+        try:
+            return [dict(row.items()) for row in self.iter_results(batch)]
+        except Exception as e:
+            logger.info("Failed to get results: %s", str(e))
+            if batch is not None:
+                batch.discard()
+            return ""
 
-            report_formats_response = gmp.get_report_formats()
-            report_formats = report_formats_response.xpath('report_format')
-            print("Report Formats Response -> ", report_formats_response)
-            for report_format in report_formats:
-                print("Report Format -> ", report_format.find('name').text)
-                if report_format.find('name').text.startswith("CSV Results"):
-                    report_format_id = report_format.attrib.get("id")
+    @timed()
+    def iter_results(self, batch: ExportBatch = None) -> Iterator[Union[ResultRecord, Dict[str, str]]]:
+        """Stream the result rows of every report, one report page at a time.
 
-            if not report_format_id:
-                print("CSV report format not found")
-                return ""
+        Args:
+            batch: optional export batch, see `get_results`. A report is only added
+                to the batch once all of its rows were consumed.
 
-            print("Report Format Id -> ", report_format_id)
+        Yields:
+            - ResultRecord parsed from the XML report, or with REPORT_PARSER=csv
+              the trimmed CSV result row; both tagged with their ``report_id``.
+        """
+        with self.pool.session() as gmp:
+            report_format_id = ""
+            if REPORT_PARSER == "csv":
+                report_format_id = self._get_report_format_id(gmp, "CSV Results")
+                if not report_format_id:
+                    logger.info("CSV report format not found")
+                    return
+
+                logger.debug("Report format id %s", report_format_id)
 
             result_reports = []
-            try:
-                all_reports_response = gmp.get_reports()
-                all_reports = all_reports_response.xpath('report')
-                print("All Reports Response -> ", all_reports_response)
-                for report in all_reports:
-                    print("Report -> ", report.tag)
-                    result_reports.append(report.attrib.get("id"))
-
-                print("result_reports -> ", result_reports)
-
-                if not result_reports:
-                    print("No reports found")
-                    return ""
-
-                json_results = []
-                for report_id in result_reports:
-                    print("Report ID -> ", report_id)
-                    print("Get Report Another Func")
-                    self.get_report(report_id, "report")
-                    response = gmp.get_report(
-                        report_id,
-                        report_format_id=report_format_id,
-                        # ignore_pagination=True,
-                        details=True,
-                        filter_string="apply_overrides=0 levels=hml rows=100 min_qod=70 first=1 sort-reverse=severity",
-                    )
-                    print("Get Report Response -> ", response)
-                    report_element = response.find("report")
-                    if (
-                            report_element is not None
-                            and report_element.find("report_format") is not None
-                    ):
-                        content = report_element.find("report_format").tail
-                        data = str(base64.b64decode(content), "utf-8")
-
-                        csv_reader = csv.DictReader(StringIO(data))
-                        for row in csv_reader:
-
-                            trimmed_row = {k: v.strip() for k, v in row.items() if v and v.strip()}
-                            if trimmed_row:  # Boş olmayan verileri ekle
-                                trimmed_row['report_id'] = report_id
-                                json_results.append(trimmed_row)
-
-                # json_output = json.dumps(json_results, indent=4)
-                # print(json_output)
-                return json_results
-            except Exception as e:
-                print(e)
-                return ""
+            all_reports_response = gmp.get_reports(details=False, filter_string="rows=-1 first=1")
+            all_reports = all_reports_response.xpath('report')
+            logger.debug("Listed %d reports", len(all_reports))
+            for report in all_reports:
+                report_id = report.attrib.get("id")
+                modification_time = report.findtext("modification_time")
+                if batch is not None and batch.skip_report(report_id, modification_time):
+                    continue
+                result_reports.append((report_id, modification_time, report.findtext("report/scan_run_status")))
+            del all_reports, all_reports_response
+
+            logger.debug("%d reports to export", len(result_reports))
+
+            if not result_reports:
+                logger.info("No reports found")
+                return
+
+            if self.report_workers is None:
+                for report_id, modification_time, scan_run_status in result_reports:
+                    logger.debug("Exporting report %s", report_id)
+                    if REPORT_PARSER == "csv":
+                        rows = self._iter_report_rows(gmp, report_id, report_format_id)
+                    else:
+                        rows = self._iter_xml_report_rows(report_id)
+                    yield from self._add_report_rows(batch, rows, report_id, modification_time, scan_run_status)
+                return
+
+        # The workers fetch on their own sessions, this one is not held while they parse.
+        parsed = self.report_workers.map_reports(
+            [report_id for report_id, _, _ in result_reports], report_format_id, self.page_size)
+        for (report_id, modification_time, scan_run_status), (_, rows) in zip(result_reports, parsed):
+            logger.debug("Exporting report %s", report_id)
+            yield from self._add_report_rows(batch, rows, report_id, modification_time, scan_run_status)
+
+    @staticmethod
+    def _add_report_rows(
+            batch: Optional[ExportBatch], rows: Iterator, report_id: str, modification_time: str,
+            scan_run_status: str,
+    ) -> Iterator:
+        """Yield the rows of one report not shipped yet, then add the report to the batch."""
+        for row in rows:
+            if batch is not None and not batch.add_result(row):
+                continue
+            yield row
+
+        if batch is not None:
+            batch.add_report(report_id, modification_time, scan_run_status)
+
+    def _iter_xml_report_rows(self, report_id: str, gmp: openvas_gmp.Gmp = None) -> Iterator[ResultRecord]:
+        """Walk an XML report page by page, parsing each page incrementally.
+
+        Args:
+            report_id: report to fetch.
+            gmp: GMP object answering with the raw response text, a session of
+                `report_pool` is checked out if None.
+
+        Yields:
+            - ResultRecord: one result of the report.
+        """
+        if gmp is None:
+            with self.report_pool.session() as gmp:
+                yield from self._iter_xml_report_rows(report_id, gmp)
+            return
+        first = 1
+        while True:
+            page_rows = 0
+            filter_string = f"{REPORT_RESULT_FILTER} rows={self.page_size} first={first}"
+            with gmp_call("get_report_page"):
+                records = fetch_report_results(gmp, report_id, filter_string)
+            for record in records:
+                page_rows += 1
+                yield record
+            REPORT_ROWS_PARSED.inc(page_rows)
+            if page_rows < self.page_size:
+                return
+            first += self.page_size
+
+    def _iter_report_rows(
+            self, gmp: openvas_gmp.Gmp, report_id: str, report_format_id: str
+    ) -> Iterator[Dict[str, str]]:
+        """Walk a CSV report page by page with ``first=``/``rows=``.
+
+        Args:
+            gmp: GMP object.
+            report_id: report to fetch.
+            report_format_id: id of the "CSV Results" report format.
+
+        Yields:
+            - dict: trimmed CSV result row.
+        """
+        save_path = os.path.join(REPORT_SAVE_DIR, f"{report_id}.csv") if REPORT_SAVE_DIR else None
+        first = 1
+        while True:
+            with gmp_call("get_report_page"):
+                response = gmp.get_report(
+                    report_id,
+                    report_format_id=report_format_id,
+                    details=True,
+                    filter_string=f"{REPORT_RESULT_FILTER} rows={self.page_size} first={first}",
+                )
+            report_element = response.find("report")
+            if report_element is None or report_element.find("report_format") is None:
+                return
+            content = report_element.find("report_format").tail
+            del response, report_element
+            if not content:
+                return
+            with gmp_call("decode_report_page"):
+                data = str(base64.b64decode(content), "utf-8")
+            del content
+            if save_path:
+                self._save_report_page(save_path, data, first == 1)
+
+            page_rows = 0
+            for row in csv.DictReader(StringIO(data)):
+                page_rows += 1
+                trimmed_row = {k: v.strip() for k, v in row.items() if v and v.strip()}
+                if trimmed_row:  # Boş olmayan verileri ekle
+                    trimmed_row['report_id'] = report_id
+                    yield trimmed_row
+
+            REPORT_ROWS_PARSED.inc(page_rows)
+            if page_rows < self.page_size:
+                return
+            first += self.page_size
+
+    @staticmethod
+    def _save_report_page(path: str, data: str, first_page: bool):
+        """Append a fetched CSV page to the on-disk copy of its report."""
+        if not first_page:
+            # Every page repeats the CSV header.
+            data = data.split("\n", 1)[1] if "\n" in data else ""
+        with open(path, "w" if first_page else "a", encoding="utf-8") as f:
+            f.write(data)
@@ -0,0 +1,227 @@
+# pipeline.py
+import collections
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from agent.export_state import EXPORT_STATE_DB, get_state_db
+from agent.openvas_wrapper import SCAN_PROFILES, ScanProfile
+from agent.services import LoopService
+from agent.task_poller import FINISHED_TASK_STATUSES, TaskState, TaskStatePoller
+
+# Retry period of the startup reconciliation while gvmd cannot be queried yet.
+PIPELINE_RETRY_INTERVAL = float(os.environ.get("PIPELINE_RETRY_INTERVAL", "30"))
+PIPELINE_DB = os.environ.get("PIPELINE_DB", EXPORT_STATE_DB)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_discoveries (
+    task_id TEXT PRIMARY KEY,
+    config_id TEXT NOT NULL,
+    port_list_id TEXT NOT NULL,
+    scanner_id TEXT,
+    priority INTEGER NOT NULL
+);
+"""
+
+
+class PendingDiscoveries:
+    """Persistent discovery task id -> (deep scan profile, priority) map."""
+
+    def __init__(self, path: str = PIPELINE_DB):
+        self.db = get_state_db(path)
+        self.db.add_schema(_SCHEMA)
+
+    def load(self) -> Dict[str, tuple]:
+        with self.db.connection() as db:
+            rows = db.execute(
+                "SELECT task_id, config_id, port_list_id, scanner_id, priority FROM pending_discoveries"
+            ).fetchall()
+        return {task_id: (ScanProfile(config_id, port_list_id, scanner_id), priority)
+                for task_id, config_id, port_list_id, scanner_id, priority in rows}
+
+    def add(self, task_ids, profile: ScanProfile, priority: int):
+        with self.db.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO pending_discoveries VALUES (?, ?, ?, ?, ?)",
+                [(task_id,) + tuple(profile) + (priority,) for task_id in task_ids],
+            )
+
+    def remove(self, task_id: str):
+        with self.db.transaction() as db:
+            db.execute("DELETE FROM pending_discoveries WHERE task_id = ?", (task_id,))
+
+    def close(self):
+        self.db.close()
+
+
+class ScanPipeline(LoopService):
+    """Two-phase scans: a cheap discovery scan first, the deep scan only where it pays off.
+
+    Finished discovery tasks are reported by the shared task poller. When one
+    is done, its hosts that turned out alive with at least one open port are
+    queued for the deep scan through ``submit`` (the scheduler), the rest of the
+    address space is never handed to the full scan. Pending discoveries are
+    kept on disk; those that finished while the agent was down are picked up
+    by one task listing at start. The pipeline only listens to the poller
+    while discoveries are pending, so an idle pipeline costs no listings.
+    """
+
+    def __init__(
+            self,
+            openvas,
+            submit: Callable[..., bool],
+            task_poller: TaskStatePoller,
+            discovery_profile: ScanProfile = SCAN_PROFILES["discovery"],
+            retry_interval: float = PIPELINE_RETRY_INTERVAL,
+            pending: Optional[PendingDiscoveries] = None,
+    ):
+        super().__init__("scan-pipeline", self.run_once, wait=self._wait_for_work)
+        self.openvas = openvas
+        self.submit = submit
+        self.task_poller = task_poller
+        self.discovery_profile = discovery_profile
+        self.retry_interval = retry_interval
+        self.store = pending if pending is not None else PendingDiscoveries()
+        self._lock = threading.Lock()
+        # discovery task id -> (deep scan profile, priority)
+        self._pending: Dict[str, tuple] = {}
+        self._loaded = False
+        self._reconciled = False
+        self._listening = False
+        self._finished = collections.deque()
+        self._decisions = collections.deque(maxlen=50)
+        self._wake = threading.Event()
+
+    def _load(self):
+        """Restore the discoveries pending before a restart, called with the lock held."""
+        if not self._loaded:
+            self._loaded = True
+            self._pending.update(self.store.load())
+            self._listen()
+
+    def _listen(self):
+        """Listen to finished tasks exactly while discoveries are pending, called with the lock held."""
+        if bool(self._pending) == self._listening:
+            return
+        self._listening = not self._listening
+        if self._listening:
+            self.task_poller.add_finished_listener(self._task_finished)
+        else:
+            self.task_poller.remove_finished_listener(self._task_finished)
+
+    def start_discovery(self, targets: List[str], profile: ScanProfile, priority: int) -> Dict[str, str]:
+        """Start the discovery phase for ``targets``.
+
+        Args:
+            targets: hosts or networks to discover.
+            profile: scan profile of the deep phase.
+            priority: scheduler priority of the deep phase.
+
+        Returns:
+            - dict: target -> discovery task id.
+        """
+        # Discovery is cheap, all targets of a request share one task.
+        tasks = self.openvas.start_scans(
+            targets,
+            self.discovery_profile.config_id,
+            group_size=len(targets),
+            port_list_id=self.discovery_profile.port_list_id,
+            scanner_id=self.discovery_profile.scanner_id,
+        )
+        task_ids = set(tasks.values())
+        with self._lock:
+            self._load()
+            self.store.add(task_ids, profile, priority)
+            for task_id in task_ids:
+                self._pending[task_id] = (profile, priority)
+            self._listen()
+        self.start()
+        return tasks
+
+    def _record(self, decision: str, **details):
+        entry = {"time": time.time(), "decision": decision}
+        entry.update(details)
+        with self._lock:
+            self._decisions.append(entry)
+        logger.info("Pipeline %s %s", decision, details)
+
+    def _task_finished(self, state: TaskState):
+        # Called from the poller thread, the promotion runs on the pipeline's own.
+        self._finished.append((state.task_id, state.status))
+        self._wake.set()
+
+    def _take(self, task_id: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._pending.pop(task_id, None)
+            self._listen()
+            return entry
+
+    def finish(self, task_id: str, status: Optional[str]):
+        """Promote the live hosts of a finished discovery task, ignore other tasks."""
+        entry = self._take(task_id)
+        if entry is None:
+            return
+        profile, priority = entry
+        try:
+            if status != "Done":
+                self._record("dropped", task_id=task_id, status=status)
+            else:
+                hosts = self.openvas.get_open_port_hosts(task_id)
+                queued = [host for host in hosts if self.submit(host, priority, profile)]
+                self._record("promoted", task_id=task_id, live_hosts=len(hosts), queued=queued)
+        except Exception:
+            # Retried by the caller, the scheduler skips hosts that are already queued.
+            with self._lock:
+                self._pending.setdefault(task_id, entry)
+                self._listen()
+            raise
+        self.store.remove(task_id)
+
+    def reconcile(self):
+        """Settle the pending discoveries that finished or vanished while nobody listened."""
+        with self._lock:
+            self._load()
+            pending = list(self._pending)
+        if not pending:
+            return
+        states = self.openvas.get_task_states()
+        for task_id in pending:
+            state = states.get(task_id)
+            if state is None or state[1] in FINISHED_TASK_STATUSES:
+                self.finish(task_id, state[1] if state else None)
+
+    def status(self) -> dict:
+        with self._lock:
+            self._load()
+            pending = list(self._pending)
+            decisions = list(self._decisions)
+        return {"pending_discoveries": pending, "decisions": decisions}
+
+    def run_once(self):
+        """Reconcile once after the start, then promote the discoveries that finished."""
+        if not self._reconciled:
+            self.reconcile()
+            self._reconciled = True
+        while self._finished and not self._stop.is_set():
+            task_id, status = self._finished[0]
+            try:
+                self.finish(task_id, status)
+            except Exception as e:
+                logger.info("Pipeline promotion of %s failed: %s", task_id, str(e))
+                return
+            self._finished.popleft()
+
+    def _wait_for_work(self):
+        # A failed reconciliation or promotion is retried after retry_interval.
+        retry = not self._reconciled or bool(self._finished)
+        self._wake.wait(self.retry_interval if retry else None)
+        self._wake.clear()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        super().stop(timeout)
@@ -0,0 +1,221 @@
+# report_parser.py
+from typing import Dict, Iterable, Iterator, Union
+
+from gvm.errors import GvmError, GvmResponseError
+from lxml import etree
+
+# Characters of the response text handed to the parser at a time.
+FEED_SIZE = 64 * 1024
+
+# Panel field name -> ResultRecord slot. The names are the CSV Results columns
+# the panel has always received, so both parsers produce the same payload: as in
+# gvmd's CSV export, "CVSS" is the result's numeric severity and "Severity" its
+# threat level (High, Medium, Low).
+RESULT_FIELDS = {
+    "IP": "ip",
+    "Hostname": "hostname",
+    "Port": "port",
+    "Port Protocol": "port_protocol",
+    "CVSS": "cvss",
+    "Severity": "severity",
+    "QoD": "qod",
+    "Solution Type": "solution_type",
+    "NVT Name": "nvt_name",
+    "Summary": "summary",
+    "Specific Result": "specific_result",
+    "NVT OID": "nvt_oid",
+    "CVEs": "cves",
+    "Task ID": "task_id",
+    "Task Name": "task_name",
+    "Timestamp": "timestamp",
+    "Result ID": "result_id",
+    "Impact": "impact",
+    "Solution": "solution",
+    "Affected Software/OS": "affected",
+    "Vulnerability Insight": "insight",
+    "Vulnerability Detection Method": "detection_method",
+    "Product Detection Result": "product_detection",
+    "BIDs": "bids",
+    "CERTs": "certs",
+    "Other References": "other_references",
+    "report_id": "report_id",
+}
+CERT_REF_TYPES = {"cert-bund": "CERT-Bund", "dfn-cert": "DFN-CERT"}
+
+
+class ResultRecord:
+    """One report result, holding only the fields sent to the panel.
+
+    Behaves like the trimmed CSV row dicts it replaces for ``get``/``items``, so
+    export state and serialization treat both alike.
+    """
+
+    __slots__ = tuple(RESULT_FIELDS.values())
+
+    def __init__(self, **fields):
+        for slot in self.__slots__:
+            setattr(self, slot, fields.get(slot) or "")
+
+    def __reduce__(self):
+        # Pickled as a plain tuple, records come back from the report workers by pickle.
+        return _record_from_values, (tuple(getattr(self, slot) for slot in self.__slots__),)
+
+    def get(self, field: str, default=None):
+        slot = RESULT_FIELDS.get(field)
+        value = getattr(self, slot) if slot else ""
+        return value if value else default
+
+    def items(self):
+        return self.to_dict().items()
+
+    def to_dict(self) -> Dict[str, str]:
+        """Panel payload, empty fields left out like in the CSV path."""
+        return {field: value for field, value in zip(RESULT_FIELDS, (getattr(self, s) for s in self.__slots__))
+                if value}
+
+
+def _record_from_values(values: tuple) -> ResultRecord:
+    record = ResultRecord.__new__(ResultRecord)
+    for slot, value in zip(ResultRecord.__slots__, values):
+        setattr(record, slot, value)
+    return record
+
+
+def _text(element) -> str:
+    return element.text.strip() if element.text else ""
+
+
+def _parse_nvt(nvt, fields: dict):
+    tags = {}
+    refs = {}
+    fields["nvt_oid"] = nvt.get("oid", "")
+    for child in nvt:
+        tag = child.tag
+        if tag == "name":
+            fields["nvt_name"] = _text(child)
+        elif tag == "tags" and child.text:
+            for item in child.text.split("|"):
+                name, _, value = item.partition("=")
+                tags[name] = value.strip()
+        elif tag == "solution":
+            fields["solution"] = _text(child)
+            fields["solution_type"] = child.get("type", "")
+        elif tag == "refs":
+            for ref in child:
+                refs.setdefault(ref.get("type", "").lower(), []).append(ref.get("id", ""))
+    fields["summary"] = tags.get("summary", "")
+    fields["impact"] = tags.get("impact", "")
+    fields["affected"] = tags.get("affected", "")
+    fields["insight"] = tags.get("insight", "")
+    fields["detection_method"] = tags.get("vuldetect", "")
+    if not fields.get("solution"):
+        fields["solution"] = tags.get("solution", "")
+    if not fields.get("solution_type"):
+        fields["solution_type"] = tags.get("solution_type", "")
+    fields["cves"] = ",".join(refs.get("cve", ()))
+    fields["bids"] = ",".join(refs.get("bid", ()))
+    fields["certs"] = ",".join(f"{label}: {ref}" for kind, label in CERT_REF_TYPES.items()
+                               for ref in refs.get(kind, ()))
+    fields["other_references"] = ",".join(refs.get("url", ()))
+
+
+def _parse_detection(detection) -> str:
+    """"<product> (OID: <detecting NVT>)" like the CSV export, empty without a product."""
+    details = {}
+    for detail in detection.iterfind("result/details/detail"):
+        details[detail.findtext("name", "")] = detail.findtext("value", "").strip()
+    if not details.get("product"):
+        return ""
+    return f"{details['product']} (OID: {details.get('source_oid', '')})"
+
+
+def _parse_result(result, report_id: str, task_id: str, task_name: str) -> ResultRecord:
+    # One pass over the children, path lookups cost more than the parsing itself.
+    fields = {"result_id": result.get("id", ""), "task_id": task_id, "task_name": task_name,
+              "report_id": report_id}
+    for child in result:
+        tag = child.tag
+        if tag == "host":
+            fields["ip"] = _text(child)
+            for detail in child:
+                if detail.tag == "hostname":
+                    fields["hostname"] = _text(detail)
+        elif tag == "port":
+            port, _, fields["port_protocol"] = _text(child).partition("/")
+            fields["port"] = port if port.isdigit() else ""
+        elif tag == "nvt":
+            _parse_nvt(child, fields)
+        elif tag == "severity":
+            fields["cvss"] = _text(child)
+        elif tag == "threat":
+            fields["severity"] = _text(child)
+        elif tag == "detection":
+            fields["product_detection"] = _parse_detection(child)
+        elif tag == "qod":
+            for detail in child:
+                if detail.tag == "value":
+                    fields["qod"] = _text(detail)
+        elif tag == "description":
+            fields["specific_result"] = _text(child)
+        elif tag == "creation_time":
+            fields["timestamp"] = _text(child)
+        elif tag == "name" and not fields.get("nvt_name"):
+            fields["nvt_name"] = _text(child)
+    return ResultRecord(**fields)
+
+
+def iter_xml_results(chunks: Iterable[Union[bytes, str]], report_id: str) -> Iterator[ResultRecord]:
+    """Parse a ``get_reports_response`` incrementally, chunk by chunk.
+
+    Apart from the chunks themselves, only the result being parsed and the
+    report header are kept in memory; every result element is cleared and dropped from the tree once converted.
+
+    Raises:
+        GvmResponseError: gvmd answered with an error status.
+    """
+    parser = etree.XMLPullParser(events=("start", "end"), tag=("get_reports_response", "task", "result"),
+                                 huge_tree=True)
+    task_id = task_name = ""
+    status = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            tag = element.tag
+            if event == "start":
+                if tag == "get_reports_response":
+                    status = element.get("status")
+                continue
+            parent = element.getparent()
+            if tag == "result":
+                # Nested <result> elements (e.g. in <detection>) are part of their parent result.
+                if parent is None or parent.tag != "results":
+                    continue
+                yield _parse_result(element, report_id, task_id, task_name)
+                element.clear()
+                while element.getprevious() is not None:
+                    del parent[0]
+            elif tag == "task":
+                if parent is not None and parent.tag == "report" and not task_id:
+                    task_id = element.get("id", "")
+                    task_name = element.findtext("name", "").strip()
+            elif parent is None:
+                if not status or not status.startswith("2"):
+                    raise GvmResponseError(status, element.get("status_text"))
+                return
+    raise GvmError("Report response ended before it was complete")
+
+
+def _slices(text: str) -> Iterator[str]:
+    for start in range(0, len(text), FEED_SIZE):
+        yield text[start:start + FEED_SIZE]
+
+
+def fetch_report_results(gmp, report_id: str, filter_string: str) -> Iterator[ResultRecord]:
+    """Request a report page in gvmd's native XML format and parse it.
+
+    ``gmp`` must answer with the raw response text, i.e. be a session of
+    `gmp_pool.get_report_pool`; the text is fed to the parser in slices, so no
+    tree of the whole page is ever built.
+    """
+    response = gmp.get_report(report_id, filter_string=filter_string, details=True)
+    return iter_xml_results(_slices(response), report_id)
@@ -0,0 +1,229 @@
+# report_workers.py
+import collections
+import contextlib
+import logging
+import multiprocessing
+import os
+import pickle
+import resource
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, Optional, Tuple
+
+from agent.metrics import REPORT_ROWS_PARSED, REPORT_WORKER_FAILURES
+from agent.services import Shared
+
+# Processes fetching and parsing reports, 0 parses in the calling thread like before.
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Address space limit of every worker, a report that needs more fails instead of
+# pushing the host into swap. 0 disables the limit.
+REPORT_WORKER_MEMORY_MB = int(os.environ.get("REPORT_WORKER_MEMORY_MB", "1024"))
+# Workers are replaced after this many reports, returning fragmented heap to the OS.
+REPORT_WORKER_MAX_TASKS = int(os.environ.get("REPORT_WORKER_MAX_TASKS", "20"))
+# Parsed rows are handed back through files there, defaults to the system temp dir.
+REPORT_WORKER_SPOOL_DIR = os.environ.get("REPORT_WORKER_SPOOL_DIR", "")
+REPORT_WORKER_NICE = int(os.environ.get("REPORT_WORKER_NICE", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(memory_mb: int, nice: int):
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if nice > 0:
+        # Parsing is throughput work, the API and telemetry threads go first.
+        os.nice(nice)
+
+
+def _parse_report(report_id: str, report_format_id: str, page_size: int, spool_dir: str) -> Tuple[str, int]:
+    """Worker side: fetch one report on the worker's own GMP session and spool its rows.
+
+    Returns:
+        - tuple: spool file path and number of rows written to it.
+    """
+    from agent.openvas_wrapper import OpenVas
+
+    openvas = OpenVas(page_size=page_size)
+    fd, path = tempfile.mkstemp(prefix=f"report-{report_id}-", suffix=".pickle", dir=spool_dir or None)
+    count = 0
+    try:
+        with os.fdopen(fd, "wb") as f, contextlib.ExitStack() as stack:
+            pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+            if report_format_id:
+                gmp = stack.enter_context(openvas.pool.session())
+                rows = openvas._iter_report_rows(gmp, report_id, report_format_id)
+            else:
+                rows = openvas._iter_xml_report_rows(report_id)
+            for row in rows:
+                pickler.dump(row)
+                # Rows share no objects worth deduplicating, keep the memo from growing.
+                pickler.clear_memo()
+                count += 1
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, count
+
+
+def _read_spool(path: str) -> Iterator:
+    f = open(path, "rb")
+    # Unlinked right away, the rows stay readable through the open file and
+    # nothing is left on disk however far the consumer iterates.
+    os.unlink(path)
+    return _iter_spool(f)
+
+
+def _iter_spool(f) -> Iterator:
+    with f:
+        unpickler = pickle.Unpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+
+def _discard_spool(future: Future):
+    # Reports parsed ahead but never read, e.g. the export was abandoned.
+    if future.cancelled() or future.exception() is not None:
+        return
+    path, _ = future.result()
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class ReportWorkerPool:
+    """Fetches and parses reports in a pool of worker processes.
+
+    Decoding and parsing are CPU bound and would otherwise hold the GIL against
+    the API and the telemetry thread. Each worker opens its own GMP session,
+    fetches a whole report page by page and writes the parsed rows to a spool
+    file; the caller reads the files back in report order, so memory use on
+    this side stays at one row whatever the report size.
+    """
+
+    def __init__(
+            self,
+            workers: int = REPORT_WORKERS,
+            memory_mb: int = REPORT_WORKER_MEMORY_MB,
+            max_tasks: int = REPORT_WORKER_MAX_TASKS,
+            spool_dir: str = REPORT_WORKER_SPOOL_DIR,
+            nice: int = REPORT_WORKER_NICE,
+    ):
+        """
+        Args:
+            workers: number of worker processes.
+            memory_mb: address space limit of each worker, 0 for none.
+            max_tasks: reports handled by a worker before it is replaced, 0 for no limit.
+            spool_dir: directory of the spool files, the system temp dir if empty.
+            nice: niceness increment of the workers.
+        """
+        self.workers = workers
+        self.memory_mb = memory_mb
+        self.max_tasks = max_tasks
+        self.spool_dir = spool_dir
+        self.nice = nice
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # Fork would copy the agent's threads and held locks into the workers.
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.memory_mb, self.nice),
+                    max_tasks_per_child=self.max_tasks or None,
+                )
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def map_reports(
+            self, report_ids: Iterable[str], report_format_id: str, page_size: int
+    ) -> Iterator[Tuple[str, Iterator]]:
+        """Parse reports in the workers, in parallel but handed back in order.
+
+        At most two reports per worker are parsed ahead of the one being read.
+
+        Args:
+            report_ids: reports to parse.
+            report_format_id: id of the "CSV Results" format, empty for the XML parser.
+            page_size: results per report page.
+
+        Yields:
+            - tuple: report id and an iterator over its rows. The rows of a report
+              must be consumed before the next report is requested.
+
+        Raises:
+            MemoryError: a worker exceeded its memory limit.
+            BrokenProcessPool: a worker died; the pool is recreated on next use.
+        """
+        executor = self._get_executor()
+        report_ids = iter(report_ids)
+        pending = collections.deque()
+
+        def submit_next():
+            report_id = next(report_ids, None)
+            if report_id is not None:
+                pending.append((report_id, executor.submit(
+                    _parse_report, report_id, report_format_id, page_size, self.spool_dir)))
+
+        try:
+            for _ in range(self.workers * 2):
+                submit_next()
+            while pending:
+                report_id, future = pending.popleft()
+                submit_next()
+                try:
+                    path, count = future.result()
+                except BrokenProcessPool:
+                    REPORT_WORKER_FAILURES.inc(reason="worker_died")
+                    logger.error("Report worker died while parsing %s", report_id)
+                    self._reset(executor)
+                    raise
+                except MemoryError:
+                    REPORT_WORKER_FAILURES.inc(reason="memory_limit")
+                    logger.error("Report %s exceeds the %d MB worker memory limit", report_id, self.memory_mb)
+                    raise
+                except Exception:
+                    REPORT_WORKER_FAILURES.inc(reason="error")
+                    raise
+                REPORT_ROWS_PARSED.inc(count)
+                yield report_id, _read_spool(path)
+        finally:
+            for _, future in pending:
+                if not future.cancel():
+                    future.add_done_callback(_discard_spool)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_shared_workers = Shared(ReportWorkerPool)
+
+
+def get_report_workers() -> Optional[ReportWorkerPool]:
+    """Return the process wide worker pool, None when REPORT_WORKERS is 0."""
+    return _shared_workers() if REPORT_WORKERS > 0 else None
+
+
+def shutdown_report_workers(wait: bool = False):
+    """Stop the process wide worker pool, if one was created, whoever used it."""
+    workers = _shared_workers.peek()
+    if workers is not None:
+        workers.shutdown(wait=wait)
@@ -0,0 +1,129 @@
+# retention.py
+import datetime
+import logging
+import os
+from typing import List
+
+from agent.export_state import ExportState, get_export_state
+from agent.services import LoopService
+
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", "3600"))
+# Finished tasks older than this are deleted once their reports were shipped.
+RETENTION_MAX_AGE_DAYS = float(os.environ.get("RETENTION_MAX_AGE_DAYS", "7"))
+# The most recent finished tasks kept regardless of age, older ones go once shipped.
+RETENTION_KEEP_LAST = int(os.environ.get("RETENTION_KEEP_LAST", "200"))
+# Tasks deleted per run, and the pause between two deletions.
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "20"))
+RETENTION_DELETE_DELAY = float(os.environ.get("RETENTION_DELETE_DELAY", "2"))
+RETENTION_DRY_RUN = os.environ.get("RETENTION_DRY_RUN", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_time(value: str) -> datetime.datetime:
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        # Unknown age, treat as brand new so the count policy decides.
+        return datetime.datetime.now(datetime.timezone.utc)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+class RetentionWorker(LoopService):
+    """Deletes finished tasks, their reports and unused targets after export.
+
+    Only tasks whose every report is marked as fully shipped in the export
+    state are candidates. Of those, tasks older than ``max_age_days`` or beyond
+    the ``keep_last`` most recent ones are deleted, at most ``batch_size`` per
+    run with ``delete_delay`` seconds in between so gvmd keeps serving scans.
+    The first run is one ``interval`` after the start.
+    """
+
+    def __init__(
+            self,
+            openvas,
+            export_state: ExportState = None,
+            interval: float = RETENTION_INTERVAL,
+            max_age_days: float = RETENTION_MAX_AGE_DAYS,
+            keep_last: int = RETENTION_KEEP_LAST,
+            batch_size: int = RETENTION_BATCH_SIZE,
+            delete_delay: float = RETENTION_DELETE_DELAY,
+            dry_run: bool = RETENTION_DRY_RUN,
+    ):
+        super().__init__("retention", self.run_once, interval, delay=interval)
+        self.openvas = openvas
+        self.export_state = export_state if export_state is not None else get_export_state()
+        self.max_age = datetime.timedelta(days=max_age_days)
+        self.keep_last = keep_last
+        self.batch_size = batch_size
+        self.delete_delay = delete_delay
+        self.dry_run = dry_run
+        self.deleted_tasks = 0
+        self.deleted_targets = 0
+
+    def candidates(self) -> List[tuple]:
+        """Tasks the policies allow to delete, oldest first.
+
+        Returns:
+            - list: (task id, target id, report ids).
+        """
+        tasks = self.openvas.get_finished_tasks()
+        reports_by_task = {}
+        for report_id, task_id, modification_time, status in self.openvas.get_report_index():
+            reports_by_task.setdefault(task_id, []).append((report_id, modification_time))
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        newest_first = sorted(tasks.items(), key=lambda item: _parse_time(item[1][1]), reverse=True)
+        candidates = []
+        for rank, (task_id, (target_id, modification_time)) in enumerate(newest_first):
+            expired = now - _parse_time(modification_time) > self.max_age
+            if not expired and rank < self.keep_last:
+                continue
+            reports = reports_by_task.get(task_id, [])
+            if not all(self.export_state.is_report_shipped(r, m) for r, m in reports):
+                continue
+            candidates.append((task_id, target_id, [r for r, _ in reports]))
+        candidates.reverse()
+        return candidates
+
+    def run_once(self) -> int:
+        """Delete one batch of candidates.
+
+        Returns:
+            - int: number of tasks deleted (or that would be, in dry-run mode).
+        """
+        batch = self.candidates()[:self.batch_size]
+        deleted = 0
+        for task_id, target_id, report_ids in batch:
+            if self._stop.is_set():
+                break
+            if self.dry_run:
+                logger.info("Retention dry-run: would delete task %s, %d reports and target %s",
+                            task_id, len(report_ids), target_id)
+                deleted += 1
+                continue
+            try:
+                if not self.openvas.delete_task(task_id):
+                    logger.info("Task %s was re-run, keeping it", task_id)
+                    continue
+                for report_id in report_ids:
+                    self.export_state.forget_report(report_id)
+                deleted += 1
+                self.deleted_tasks += 1
+                if target_id and self.openvas.delete_target_if_unused(target_id):
+                    self.deleted_targets += 1
+            except Exception as e:
+                logger.info("Failed to delete task %s: %s", task_id, str(e))
+            self._stop.wait(self.delete_delay)
+        if batch:
+            logger.info("Retention removed %d of %d candidate tasks", deleted, len(batch))
+        return deleted
+
+    def status(self) -> dict:
+        return {
+            "dry_run": self.dry_run,
+            "deleted_tasks": self.deleted_tasks,
+            "deleted_targets": self.deleted_targets,
+        }
@@ -0,0 +1,203 @@
+# scan_events.py
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # optional, scan events are not listened to without it
+    mqtt = None
+
+from agent.task_poller import TaskState, TaskStatePoller, get_active_tasks_cache
+
+# The broker ospd-openvas and the notus scanner publish to (scripts/mosquitto.sh).
+MQTT_BROKER_HOST = os.environ.get("MQTT_BROKER_HOST", "localhost")
+MQTT_BROKER_PORT = int(os.environ.get("MQTT_BROKER_PORT", "1883"))
+SCAN_EVENTS_TOPIC = os.environ.get("SCAN_EVENTS_TOPIC", "scanner/#")
+SCAN_EVENTS = os.environ.get("SCAN_EVENTS", "1") == "1"
+# Result export period without scan events, the former fixed timer.
+EXPORT_INTERVAL = float(os.environ.get("EXPORT_INTERVAL", "15"))
+# Result export period while scanner events are arriving, finished scans trigger it directly.
+EXPORT_FALLBACK_INTERVAL = float(os.environ.get("EXPORT_FALLBACK_INTERVAL", "300"))
+# Scans without an event for this long are dropped from the progress model.
+SCAN_PROGRESS_TTL = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class ScanProgress:
+    """Live view of one scanner scan, built from its MQTT events.
+
+    ``scan_id`` is the OSP scan id, which gvmd sets to the id of the task's report.
+    """
+
+    __slots__ = ("scan_id", "hosts", "results", "started_at", "updated_at")
+
+    def __init__(self, scan_id: str, now: float):
+        self.scan_id = scan_id
+        # host ip -> last status ("running", "finished", ...)
+        self.hosts: Dict[str, str] = {}
+        self.results = 0
+        self.started_at = now
+        self.updated_at = now
+
+    def to_dict(self) -> dict:
+        finished = sum(1 for status in self.hosts.values() if status == "finished")
+        return {
+            "scan_id": self.scan_id,
+            "hosts": len(self.hosts),
+            "hosts_finished": finished,
+            "results": self.results,
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class ScanEventListener:
+    """Consumes the scanner's status and result messages from the MQTT broker.
+
+    Events keep the in-memory progress model current and wake the task poller,
+    so gvmd is asked about a task right when something happened to it instead
+    of on the next poll. When the poller sees a task finish, result export is
+    requested at once; `wait_for_export` replaces the fixed export timer.
+    GMP polling stays in place at a slower period to reconcile missed events.
+    """
+
+    def __init__(self, task_poller: TaskStatePoller, host: str = MQTT_BROKER_HOST, port: int = MQTT_BROKER_PORT,
+                 topic: str = SCAN_EVENTS_TOPIC):
+        self.task_poller = task_poller
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.connected = False
+        self._lock = threading.Lock()
+        self._scans: Dict[str, ScanProgress] = {}
+        self._export_requested = threading.Event()
+        self._events = 0
+        self._last_event = None
+        self._client = None
+        self._listening = False
+
+    def _task_finished(self, state: TaskState):
+        logger.info("Task %s finished (%s), requesting result export", state.task_id, state.status)
+        self._export_requested.set()
+
+    def events_flowing(self) -> bool:
+        """True when scanner events arrived lately, a connection alone is not enough.
+
+        The broker mostly carries notus traffic of authenticated local checks,
+        unauthenticated scans can run for hours without a single event.
+        """
+        with self._lock:
+            last_event = self._last_event
+        return (self.connected and last_event is not None
+                and time.monotonic() - last_event < EXPORT_FALLBACK_INTERVAL)
+
+    def wait_for_export(self) -> bool:
+        """Block until an export is due, see `begin_export`.
+
+        Returns:
+            - bool: True when a finished scan requested it, False on the timer.
+        """
+        return self._export_requested.wait(EXPORT_FALLBACK_INTERVAL if self.events_flowing() else EXPORT_INTERVAL)
+
+    def begin_export(self):
+        """Called before every export; requests made while it runs trigger the next one."""
+        self._export_requested.clear()
+
+    def handle_message(self, payload: bytes):
+        """Apply one scanner message to the progress model."""
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.debug("Ignoring non JSON scan event")
+            return
+        if not isinstance(message, dict) or not message.get("scan_id"):
+            return
+        message_type = message.get("message_type", "")
+        scan_id = message["scan_id"]
+        now = time.time()
+        with self._lock:
+            self._events += 1
+            self._last_event = time.monotonic()
+            scan = self._scans.get(scan_id)
+            if scan is None:
+                scan = self._scans[scan_id] = ScanProgress(scan_id, now)
+            scan.updated_at = now
+            host = message.get("host_ip", "")
+            if message_type == "scan.status":
+                scan.hosts[host] = message.get("status", "")
+            elif message_type == "result.scan":
+                scan.results += 1
+            elif message_type == "scan.start" and host:
+                scan.hosts.setdefault(host, "requested")
+
+        if message_type == "scan.start" or (message_type == "scan.status" and message.get("status") == "finished"):
+            # Something started or finished, the cached active task list is stale.
+            get_active_tasks_cache().invalidate()
+            self.task_poller.wake()
+
+    def _expire(self):
+        deadline = time.time() - SCAN_PROGRESS_TTL
+        with self._lock:
+            for scan_id in [s for s, scan in self._scans.items() if scan.updated_at < deadline]:
+                del self._scans[scan_id]
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.info("MQTT broker refused the connection: %s", mqtt.connack_string(rc))
+            return
+        self.connected = True
+        client.subscribe(self.topic)
+        logger.info("Listening to scan events on %s:%s (%s)", self.host, self.port, self.topic)
+        # Events may have been missed while disconnected.
+        self.task_poller.wake()
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        # Wake the export loop, it goes back to the shorter timer until reconnected.
+        self._export_requested.set()
+        logger.info("Disconnected from the MQTT broker (%s), polling until reconnected", rc)
+
+    def _on_message(self, client, userdata, msg):
+        self.handle_message(msg.payload)
+        self._expire()
+
+    def status(self) -> dict:
+        with self._lock:
+            scans = [scan.to_dict() for scan in self._scans.values()]
+            events = self._events
+        return {"enabled": self._client is not None, "connected": self.connected, "events": events,
+                "events_flowing": self.events_flowing(), "scans": scans}
+
+    def start(self):
+        """Connect in the background, the client reconnects on its own."""
+        if not self._listening:
+            # Finishes seen by the reconciliation polls request an export too.
+            self.task_poller.add_finished_listener(self._task_finished)
+            self._listening = True
+        if self._client is not None or not SCAN_EVENTS:
+            return
+        if mqtt is None:
+            logger.info("paho-mqtt is not installed, scan events are disabled")
+            return
+        client = mqtt.Client(client_id=f"openvas-agent-{os.getpid()}")
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        client.reconnect_delay_set(min_delay=1, max_delay=60)
+        client.connect_async(self.host, self.port, keepalive=60)
+        client.loop_start()
+        self._client = client
+
+    def stop(self):
+        if self._client is not None:
+            self._client.loop_stop()
+            self._client.disconnect()
+            self._client = None
+        self.connected = False
+        # Releases a wait_for_export in progress.
+        self._export_requested.set()
@@ -0,0 +1,194 @@
+# scanners.py
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+from gvm.protocols import gmp as openvas_gmp
+
+from agent.metrics import SCANNER_ACTIVE_TASKS, SCANNER_HEALTHY
+from agent.services import LoopService, Shared
+from agent.task_poller import ACTIVE_TASKS_TTL, ACTIVE_TASK_STATUSES
+
+# gvmd's built-in OpenVAS scanner, used when no registered scanner is usable.
+LOCAL_SCANNER_ID = "08b69003-5fc2-4037-a479-93b440211c73"
+# gvmd scanner type of the CVE scanner, it cannot run regular scan configs.
+CVE_SCANNER_TYPE = "3"
+# How often the scanner list is re-read and every scanner verified.
+SCANNER_VERIFY_INTERVAL = float(os.environ.get("SCANNER_VERIFY_INTERVAL", "60"))
+# Relative capacity per scanner, "<scanner id>:<weight>,..."; unlisted scanners weigh 1.
+SCANNER_CAPACITY = os.environ.get("SCANNER_CAPACITY", "")
+ACTIVE_TASKS_BY_SCANNER_FILTER = "rows=-1 first=1 " + " or ".join(f'status="{s}"' for s in ACTIVE_TASK_STATUSES)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_capacities(value: str) -> Dict[str, float]:
+    capacities = {}
+    for item in value.split(","):
+        scanner_id, _, weight = item.strip().partition(":")
+        if not scanner_id:
+            continue
+        try:
+            capacities[scanner_id] = max(float(weight or 1), 0.1)
+        except ValueError:
+            logger.info("Ignoring invalid scanner capacity %r", item)
+    return capacities
+
+
+class ScannerState:
+    """One scanner registered in gvmd and the tasks it is running."""
+
+    __slots__ = ("scanner_id", "name", "capacity", "healthy", "active", "verified_at", "error")
+
+    def __init__(self, scanner_id: str, name: str, capacity: float):
+        self.scanner_id = scanner_id
+        self.name = name
+        self.capacity = capacity
+        # Unverified scanners are trusted until the first verification says otherwise.
+        self.healthy = True
+        self.active = 0
+        self.verified_at = 0.0
+        self.error = None
+
+    @property
+    def load(self) -> float:
+        return self.active / self.capacity
+
+    def to_dict(self) -> dict:
+        return {
+            "scanner_id": self.scanner_id,
+            "name": self.name,
+            "capacity": self.capacity,
+            "healthy": self.healthy,
+            "active_tasks": self.active,
+            "load": round(self.load, 3),
+            "verified_at": self.verified_at,
+            "error": self.error,
+        }
+
+
+class ScannerBalancer(LoopService):
+    """Places new tasks on the least loaded healthy scanner.
+
+    Scanners are discovered with ``get_scanners`` and checked with
+    ``verify_scanner`` every ``verify_interval`` seconds; a scanner failing the
+    check is drained, it keeps its running tasks but gets no new ones until it
+    verifies again. Running tasks per scanner are counted from gvmd at most once
+    per ``load_ttl`` and bumped locally for every task started in between, so
+    a batch of submissions spreads over the scanners instead of piling onto
+    the one that was idle at the last count. Load is weighted by capacity.
+    """
+
+    def __init__(self, pool, verify_interval: float = SCANNER_VERIFY_INTERVAL, load_ttl: float = ACTIVE_TASKS_TTL,
+                 capacities: Dict[str, float] = None):
+        super().__init__("scanner-balancer", self.verify, verify_interval)
+        self.pool = pool
+        self.verify_interval = verify_interval
+        self.load_ttl = load_ttl
+        self.capacities = capacities if capacities is not None else parse_capacities(SCANNER_CAPACITY)
+        self._lock = threading.Lock()
+        self._scanners: Dict[str, ScannerState] = {}
+        self._verified_at = float("-inf")
+        self._counted_at = 0.0
+
+    def refresh(self, gmp: openvas_gmp.Gmp):
+        """Re-read the registered scanners and verify each of them."""
+        # Counted from the attempt, a gvmd that cannot list scanners is not asked on every placement.
+        self._verified_at = time.monotonic()
+        found = {}
+        for scanner in gmp.get_scanners(filter_string="rows=-1 first=1").xpath("scanner"):
+            scanner_id = scanner.attrib.get("id")
+            if not scanner_id or scanner.findtext("type") == CVE_SCANNER_TYPE:
+                continue
+            found[scanner_id] = scanner.findtext("name") or scanner_id
+        now = time.time()
+        verified = {}
+        for scanner_id in found:
+            try:
+                response = gmp.verify_scanner(scanner_id)
+                ok = str(response.get("status", "")).startswith("2")
+                verified[scanner_id] = (ok, None if ok else response.get("status_text"))
+            except Exception as e:
+                verified[scanner_id] = (False, str(e))
+        with self._lock:
+            scanners = {}
+            for scanner_id, name in found.items():
+                state = self._scanners.get(scanner_id)
+                if state is None:
+                    state = ScannerState(scanner_id, name, self.capacities.get(scanner_id, 1.0))
+                state.name = name
+                healthy, error = verified[scanner_id]
+                if state.healthy and not healthy:
+                    logger.info("Draining scanner %s (%s): %s", name, scanner_id, error)
+                elif not state.healthy and healthy:
+                    logger.info("Scanner %s (%s) verified again", name, scanner_id)
+                state.healthy, state.error, state.verified_at = healthy, error, now
+                scanners[scanner_id] = state
+            self._scanners = scanners
+        self._publish()
+
+    def count_active(self, gmp: openvas_gmp.Gmp):
+        """Count the queued and running tasks of every scanner."""
+        counts = {}
+        for task in gmp.get_tasks(filter_string=ACTIVE_TASKS_BY_SCANNER_FILTER, details=False).xpath("task"):
+            scanner = task.find("scanner")
+            if scanner is not None:
+                counts[scanner.attrib.get("id")] = counts.get(scanner.attrib.get("id"), 0) + 1
+        with self._lock:
+            for scanner_id, state in self._scanners.items():
+                state.active = counts.get(scanner_id, 0)
+            self._counted_at = time.monotonic()
+        self._publish()
+
+    def choose(self, gmp: openvas_gmp.Gmp) -> str:
+        """Pick the scanner of a new task, see `count_started` once it runs.
+
+        Falls back to gvmd's local scanner when no scanner is known or healthy.
+        """
+        try:
+            # Without the background thread (e.g. in scripts) scanners are verified on use.
+            if self._thread is None and time.monotonic() - self._verified_at >= self.verify_interval:
+                self.refresh(gmp)
+            if time.monotonic() - self._counted_at >= self.load_ttl:
+                self.count_active(gmp)
+        except Exception as e:
+            # Placement must not fail a submission, the last known state is used.
+            logger.info("Failed to refresh scanner load: %s", str(e))
+        with self._lock:
+            candidates = [state for state in self._scanners.values() if state.healthy]
+            if not candidates:
+                return LOCAL_SCANNER_ID
+            chosen = min(candidates, key=lambda state: ((state.active + 1) / state.capacity, state.scanner_id))
+            return chosen.scanner_id
+
+    def count_started(self, scanner_id: str):
+        """Count a task that was started on ``scanner_id`` until the next count from gvmd."""
+        with self._lock:
+            state = self._scanners.get(scanner_id)
+            if state is None:
+                return
+            state.active += 1
+            active = state.active
+        SCANNER_ACTIVE_TASKS.set(active, scanner=scanner_id)
+
+    def _publish(self):
+        with self._lock:
+            states = [(state.scanner_id, state.active, state.healthy) for state in self._scanners.values()]
+        for scanner_id, active, healthy in states:
+            SCANNER_ACTIVE_TASKS.set(active, scanner=scanner_id)
+            SCANNER_HEALTHY.set(int(healthy), scanner=scanner_id)
+
+    def status(self) -> List[dict]:
+        with self._lock:
+            return [state.to_dict() for state in self._scanners.values()]
+
+    def verify(self):
+        """One iteration of the background thread, verify the scanners and count their load."""
+        with self.pool.session() as gmp:
+            self.refresh(gmp)
+            self.count_active(gmp)
+
+
+get_scanner_balancer = Shared(ScannerBalancer)
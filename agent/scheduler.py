@@ -0,0 +1,332 @@
+# scheduler.py
+import collections
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+import psutil
+
+from agent.export_state import EXPORT_STATE_DB, get_state_db
+from agent.openvas_wrapper import ScanProfile
+from agent.services import LoopService
+from agent.tuning import get_tuning
+
+# Unset, the scanner's own limit chosen by the startup tuning is used.
+MAX_CONCURRENT_SCANS = int(os.environ["MAX_CONCURRENT_SCANS"]) if os.environ.get("MAX_CONCURRENT_SCANS") else None
+# Used when neither the environment nor the tuning file sets a limit.
+DEFAULT_MAX_CONCURRENT_SCANS = 4
+MAX_CPU_PERCENT = float(os.environ.get("SCHEDULER_MAX_CPU_PERCENT", "85"))
+MAX_MEMORY_PERCENT = float(os.environ.get("SCHEDULER_MAX_MEMORY_PERCENT", "85"))
+SCHEDULER_INTERVAL = float(os.environ.get("SCHEDULER_INTERVAL", "10"))
+MAX_PENDING_TARGETS = int(os.environ.get("SCHEDULER_MAX_PENDING_TARGETS", "1000"))
+# Admissions of a target gvmd failed to start before it is given up.
+MAX_START_ATTEMPTS = int(os.environ.get("SCHEDULER_MAX_START_ATTEMPTS", "3"))
+DEFAULT_PRIORITY = 100
+PANEL_DOCKER_TYPE = 2
+SCHEDULER_QUEUE_DB = os.environ.get("SCHEDULER_QUEUE_DB", EXPORT_STATE_DB)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_targets (
+    target TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    sequence INTEGER NOT NULL,
+    config_id TEXT NOT NULL,
+    port_list_id TEXT NOT NULL,
+    scanner_id TEXT
+);
+"""
+
+
+class CpuSampler:
+    """Host CPU utilisation since this sampler's previous sample.
+
+    ``psutil.cpu_percent(interval=None)`` measures since the previous call of
+    anybody in the process, so telemetry's samples every 10 s would cut the
+    scheduler's window short. The first sample only sets the baseline and
+    returns 0.0, like psutil does.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = None
+
+    @staticmethod
+    def _busy_total() -> tuple:
+        times = psutil.cpu_times()
+        # Guest time is already part of user and nice time, iowait is idle time.
+        total = sum(times) - getattr(times, "guest", 0) - getattr(times, "guest_nice", 0)
+        return total - times.idle - getattr(times, "iowait", 0), total
+
+    def percent(self) -> float:
+        busy, total = self._busy_total()
+        with self._lock:
+            last, self._last = self._last, (busy, total)
+        if last is None or total <= last[1]:
+            return 0.0
+        return round(min(max((busy - last[0]) / (total - last[1]) * 100, 0.0), 100.0), 1)
+
+
+class PendingTargets:
+    """Persistent copy of the scheduler queue.
+
+    Targets handed out by the panel, queued through the API or by the scan
+    pipeline stay here until they were started or given up, so a restart
+    does not lose them.
+    """
+
+    def __init__(self, path: str = SCHEDULER_QUEUE_DB):
+        self.db = get_state_db(path)
+        self.db.add_schema(_SCHEMA)
+
+    def load(self) -> List[tuple]:
+        """Every pending target.
+
+        Returns:
+            - list: (priority, sequence, target, ScanProfile) tuples.
+        """
+        with self.db.connection() as db:
+            rows = db.execute(
+                "SELECT priority, sequence, target, config_id, port_list_id, scanner_id FROM pending_targets"
+            ).fetchall()
+        return [(priority, sequence, target, ScanProfile(config_id, port_list_id, scanner_id))
+                for priority, sequence, target, config_id, port_list_id, scanner_id in rows]
+
+    def add(self, target: str, priority: int, sequence: int, profile: ScanProfile):
+        with self.db.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO pending_targets VALUES (?, ?, ?, ?, ?, ?)",
+                (target, priority, sequence) + tuple(profile),
+            )
+
+    def remove(self, targets: Iterable[str]):
+        with self.db.transaction() as db:
+            db.executemany("DELETE FROM pending_targets WHERE target = ?", [(target,) for target in targets])
+
+    def close(self):
+        self.db.close()
+
+
+class ScanScheduler(LoopService):
+    """Admits pending targets to the scanner based on free capacity.
+
+    Targets wait in a local priority queue (lower value first, FIFO within a
+    priority) that is kept on disk until they started, see `PendingTargets`.
+    Each cycle the scheduler computes the free scan slots from the active task
+    count and the live CPU/memory headroom, asks the panel for at most that
+    many targets and starts them.
+    """
+
+    def __init__(
+            self,
+            openvas,
+            fetch_targets: Callable[..., dict],
+            scan_config_id: str,
+            max_concurrent_scans: Optional[int] = MAX_CONCURRENT_SCANS,
+            max_cpu_percent: float = MAX_CPU_PERCENT,
+            max_memory_percent: float = MAX_MEMORY_PERCENT,
+            interval: float = SCHEDULER_INTERVAL,
+            max_pending: int = MAX_PENDING_TARGETS,
+            max_attempts: int = MAX_START_ATTEMPTS,
+            pending: Optional[PendingTargets] = None,
+    ):
+        super().__init__("scan-scheduler", self.admit, interval)
+        self.openvas = openvas
+        self.fetch_targets = fetch_targets
+        self.scan_config_id = scan_config_id
+        self._max_concurrent_scans = max_concurrent_scans
+        self.max_cpu_percent = max_cpu_percent
+        self.max_memory_percent = max_memory_percent
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._queue = []
+        self._queued = set()
+        self._counter = itertools.count()
+        self.pending = pending if pending is not None else PendingTargets()
+        self._loaded = False
+        self._decisions = collections.deque(maxlen=50)
+        # target -> failed start attempts, dropped once it started or was given up.
+        self._attempts = {}
+        self._cpu = CpuSampler()
+        self.admitted_total = 0
+
+    @property
+    def max_concurrent_scans(self) -> int:
+        """The explicit limit, else ospd-openvas' max_scans from the tuning file."""
+        if self._max_concurrent_scans is not None:
+            return self._max_concurrent_scans
+        return get_tuning().get_int("SCANNER_MAX_SCANS", DEFAULT_MAX_CONCURRENT_SCANS)
+
+    def _load(self):
+        """Restore the targets still queued before a restart, called with the lock held."""
+        if self._loaded:
+            return
+        self._loaded = True
+        entries = self.pending.load()
+        for entry in entries:
+            heapq.heappush(self._queue, entry)
+            self._queued.add(entry[2])
+        self._counter = itertools.count(max((entry[1] for entry in entries), default=-1) + 1)
+        if entries:
+            logger.info("Scheduler restored %d pending targets", len(entries))
+
+    def submit(self, target: str, priority: int = DEFAULT_PRIORITY, profile: ScanProfile = None) -> bool:
+        """Queue a target, returns False if it is already queued or the queue is full.
+
+        Args:
+            target: host to scan.
+            priority: lower values are admitted first.
+            profile: scan profile, the scheduler's scan config with the default
+                port list and scanner if None.
+        """
+        if profile is None:
+            profile = ScanProfile(self.scan_config_id)
+        with self._lock:
+            self._load()
+            if target in self._queued or len(self._queue) >= self.max_pending:
+                return False
+            sequence = next(self._counter)
+            self.pending.add(target, priority, sequence, profile)
+            heapq.heappush(self._queue, (priority, sequence, target, profile))
+            self._queued.add(target)
+            return True
+
+    def _pop(self, count: int) -> List[tuple]:
+        """Take the next targets off the queue, they stay on disk until `_done`."""
+        with self._lock:
+            self._load()
+            entries = []
+            while self._queue and len(entries) < count:
+                priority, _, target, profile = heapq.heappop(self._queue)
+                self._queued.discard(target)
+                entries.append((target, profile, priority))
+            return entries
+
+    def _done(self, targets: Iterable[str]):
+        """Drop started or given up targets from the disk copy, unless they were queued again."""
+        with self._lock:
+            targets = [target for target in targets if target not in self._queued]
+            if targets:
+                self.pending.remove(targets)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._queue)
+
+    def _record(self, decision: str, **details):
+        entry = {"time": time.time(), "decision": decision}
+        entry.update(details)
+        with self._lock:
+            self._decisions.append(entry)
+        logger.info("Scheduler %s %s", decision, details)
+
+    def free_slots(self, active: int) -> int:
+        """Scan slots left, 0 when the host lacks CPU or memory headroom."""
+        cpu = self._cpu.percent()
+        memory = psutil.virtual_memory().percent
+        if cpu >= self.max_cpu_percent or memory >= self.max_memory_percent:
+            self._record("throttled", active=active, cpu=cpu, memory=memory)
+            return 0
+        return max(0, self.max_concurrent_scans - active)
+
+    def admit(self):
+        """Run one admission cycle."""
+        if not self.openvas.check_is_vas_online():
+            self._record("skipped", reason="openvas offline")
+            return
+
+        active = self.openvas.active_scans_count()
+        slots = self.free_slots(active)
+        if slots == 0:
+            if active >= self.max_concurrent_scans:
+                self._record("full", active=active, queue_depth=self.queue_depth())
+            return
+
+        missing = slots - self.queue_depth()
+        if missing > 0:
+            self._pull(active, missing)
+
+        entries = self._pop(slots)
+        if not entries:
+            return
+        by_profile = {}
+        for target, profile, priority in entries:
+            by_profile.setdefault(profile, []).append((target, priority))
+        tasks = {}
+        try:
+            for profile, queued in by_profile.items():
+                tasks.update(self.openvas.start_scans(
+                    [target for target, _ in queued],
+                    profile.config_id,
+                    port_list_id=profile.port_list_id,
+                    scanner_id=profile.scanner_id,
+                ))
+        except Exception:
+            self._retry_failed([entry for entry in entries if entry[0] not in tasks])
+            raise
+        finally:
+            with self._lock:
+                for target in tasks:
+                    self._attempts.pop(target, None)
+            self._done(tasks)
+        failed = [entry for entry in entries if entry[0] not in tasks]
+        retried, given_up = self._retry_failed(failed)
+        self.admitted_total += len(tasks)
+        self._record("admitted", active=active, slots=slots, started=len(entries) - len(failed),
+                     retried=retried, failed=given_up)
+
+    def _retry_failed(self, failed: List[tuple]):
+        """Queue targets gvmd did not start again, up to ``max_attempts`` admissions each.
+
+        Returns:
+            - (requeued targets, targets given up).
+        """
+        retried, given_up = [], []
+        for target, profile, priority in failed:
+            with self._lock:
+                attempts = self._attempts.get(target, 0) + 1
+                self._attempts[target] = attempts
+            if attempts < self.max_attempts and self.submit(target, priority, profile):
+                retried.append(target)
+                continue
+            with self._lock:
+                self._attempts.pop(target, None)
+            given_up.append(target)
+        if given_up:
+            logger.info("Giving up on %s after %d start attempts", given_up, self.max_attempts)
+            self._done(given_up)
+        return retried, given_up
+
+    def _pull(self, active: int, limit: int):
+        """Ask the panel for at most ``limit`` targets and queue them."""
+        response = self.fetch_targets(active, PANEL_DOCKER_TYPE, limit)
+        if not response.get("success"):
+            return
+        targets = (response.get("data") or {}).get("targets") or []
+        # The panel may not honour the limit, the surplus waits in the queue, which survives restarts.
+        queued = sum(1 for target in targets if self.submit(target))
+        self._record("pulled", requested=limit, received=len(targets), queued=queued)
+
+    def status(self) -> dict:
+        with self._lock:
+            self._load()
+            pending = [target for _, _, target, _ in heapq.nsmallest(20, self._queue)]
+            depth = len(self._queue)
+            decisions = list(self._decisions)
+        return {
+            "queue_depth": depth,
+            "next_targets": pending,
+            "max_concurrent_scans": self.max_concurrent_scans,
+            "max_cpu_percent": self.max_cpu_percent,
+            "max_memory_percent": self.max_memory_percent,
+            "admitted_total": self.admitted_total,
+            "decisions": decisions,
+        }
+
@@ -0,0 +1,94 @@
+# serialization.py
+import logging
+import os
+from typing import Any, Iterable, Iterator, Tuple
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for PANEL_RESULT_FORMAT=msgpack
+    msgpack = None
+
+# Wire format of result uploads: "json" (array), "ndjson" or "msgpack".
+PANEL_RESULT_FORMAT = os.environ.get("PANEL_RESULT_FORMAT", "json")
+# Rows encoded before a chunk is handed to the HTTP body.
+CHUNK_ROWS = 256
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "msgpack": "application/msgpack",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _default(value: Any) -> Any:
+    # Result records from the XML report parser are sent as their panel dict.
+    to_dict = getattr(value, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Type is not serializable: {type(value).__name__}")
+    return to_dict()
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON encoding used for every payload sent to the panel."""
+    return orjson.dumps(value, default=_default)
+
+
+def iter_json_array(rows: Iterable[Any]) -> Iterator[bytes]:
+    """Encode rows as one JSON array, yielded in chunks of ``CHUNK_ROWS`` rows."""
+    parts = [b"["]
+    first = True
+    for row in rows:
+        if not first:
+            parts.append(b",")
+        parts.append(orjson.dumps(row, default=_default))
+        first = False
+        if len(parts) >= 2 * CHUNK_ROWS:
+            yield b"".join(parts)
+            parts = []
+    parts.append(b"]")
+    yield b"".join(parts)
+
+
+def iter_ndjson(rows: Iterable[Any]) -> Iterator[bytes]:
+    """Encode rows as newline delimited JSON, yielded in chunks of ``CHUNK_ROWS`` rows."""
+    parts = []
+    for row in rows:
+        parts.append(orjson.dumps(row, default=_default, option=orjson.OPT_APPEND_NEWLINE))
+        if len(parts) >= CHUNK_ROWS:
+            yield b"".join(parts)
+            parts = []
+    if parts:
+        yield b"".join(parts)
+
+
+def iter_msgpack(rows: Iterable[Any]) -> Iterator[bytes]:
+    """Encode rows as a stream of concatenated msgpack objects."""
+    packer = msgpack.Packer(default=_default)
+    parts = []
+    for row in rows:
+        parts.append(packer.pack(row))
+        if len(parts) >= CHUNK_ROWS:
+            yield b"".join(parts)
+            parts = []
+    if parts:
+        yield b"".join(parts)
+
+
+def stream_encoder(result_format: str = PANEL_RESULT_FORMAT) -> Tuple[str, Any]:
+    """Pick the streaming encoder for ``result_format``.
+
+    Returns:
+        - (content type, encoder); msgpack falls back to NDJSON when the
+          package is not installed.
+    """
+    if result_format == "msgpack" and msgpack is None:
+        logger.info("msgpack is not installed, sending results as NDJSON")
+        result_format = "ndjson"
+    encoder = {"json": iter_json_array, "ndjson": iter_ndjson, "msgpack": iter_msgpack}.get(result_format)
+    if encoder is None:
+        raise ValueError(f"Unknown result format {result_format}")
+    return CONTENT_TYPES[result_format], encoder
@@ -0,0 +1,93 @@
+# services.py
+import logging
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+from agent.metrics import LOOP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Shared(Generic[T]):
+    """Process wide instance of ``factory``, created by the first call.
+
+    Later calls get that instance, whatever arguments they pass.
+    """
+
+    def __init__(self, factory: Callable[..., T]):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._instance: Optional[T] = None
+
+    def __call__(self, *args, **kwargs) -> T:
+        with self._lock:
+            if self._instance is None:
+                self._instance = self.factory(*args, **kwargs)
+            return self._instance
+
+    def peek(self) -> Optional[T]:
+        """The instance if it was created, without creating it."""
+        with self._lock:
+            return self._instance
+
+
+class LoopService:
+    """Calls ``func`` over and over in a daemon thread until stopped.
+
+    Between iterations the thread waits ``interval`` seconds, or, with ``wait``,
+    until that callable returns; ``delay`` postpones the first iteration. The
+    loop never dies on an exception, every iteration is timed in
+    ``LOOP_SECONDS`` under ``name``.
+    """
+
+    def __init__(self, name: str, func: Callable[[], None], interval: float = 10,
+                 wait: Optional[Callable[[], object]] = None, delay: float = 0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.wait = wait
+        self.delay = delay
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def run(self):
+        if self.delay:
+            self._stop.wait(self.delay)
+        while not self._stop.is_set():
+            try:
+                with LOOP_SECONDS.time(loop=self.name):
+                    self.func()
+            except Exception as e:
+                logger.info("%s iteration failed: %s", self.name, str(e))
+            if self._stop.is_set():
+                return
+            if self.wait is not None:
+                self.wait()
+            else:
+                self._stop.wait(self.interval)
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop after the current iteration, waiting at most ``timeout`` seconds for it."""
+        self._stop.set()
+        if timeout:
+            self.join(timeout)
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait for the thread of a stopped service, returns False if it is still running."""
+        thread = self._thread
+        if thread is None:
+            return True
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.info("%s did not stop within %ss", self.name, timeout)
+            return False
+        return True
@@ -0,0 +1,116 @@
+# target_index.py
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from agent.export_state import EXPORT_STATE_DB, get_state_db
+from agent.services import Shared
+
+TARGET_INDEX_DB = os.environ.get("TARGET_INDEX_DB", EXPORT_STATE_DB)
+# Set to 0 to create a fresh target and task for every scan.
+TARGET_REUSE = os.environ.get("TARGET_REUSE", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reusable_targets (
+    hosts TEXT NOT NULL,
+    port_list_id TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    PRIMARY KEY (hosts, port_list_id)
+);
+CREATE TABLE IF NOT EXISTS reusable_tasks (
+    target_id TEXT NOT NULL,
+    config_id TEXT NOT NULL,
+    scanner_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    PRIMARY KEY (target_id, config_id, scanner_id)
+);
+"""
+
+
+def hosts_key(hosts: Iterable[str]) -> str:
+    """Order independent key of a host list, as given to or returned by gvmd."""
+    return ",".join(sorted({host.strip().lower() for host in hosts if host.strip()}))
+
+
+class TargetIndex:
+    """Persistent (hosts, port list) -> target and (target, config, scanner) -> task index.
+
+    Lets repeat scans of the same hosts reuse the gvmd target, and re-run the
+    previous task, instead of creating new ones. The local tables survive
+    restarts; `load` replaces them with what gvmd actually has.
+    """
+
+    def __init__(self, path: str = TARGET_INDEX_DB):
+        self.db = get_state_db(path)
+        self.db.add_schema(_SCHEMA)
+        self.synced = False
+
+    def load(self, targets: Dict[Tuple[str, str], str], tasks: Dict[Tuple[str, str, str], str]):
+        """Replace the index with the targets and tasks listed by gvmd.
+
+        Args:
+            targets: (hosts key, port list id) -> target id.
+            tasks: (target id, config id, scanner id) -> task id.
+        """
+        with self.db.transaction() as db:
+            db.execute("DELETE FROM reusable_targets")
+            db.execute("DELETE FROM reusable_tasks")
+            db.executemany(
+                "INSERT OR REPLACE INTO reusable_targets VALUES (?, ?, ?)",
+                [(hosts, port_list_id, target_id) for (hosts, port_list_id), target_id in targets.items()],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO reusable_tasks VALUES (?, ?, ?, ?)",
+                [key + (task_id,) for key, task_id in tasks.items()],
+            )
+        self.synced = True
+        logger.info("Target index loaded %d targets and %d tasks from gvmd", len(targets), len(tasks))
+
+    def get_target(self, hosts: Iterable[str], port_list_id: str) -> Optional[str]:
+        with self.db.connection() as db:
+            row = db.execute(
+                "SELECT target_id FROM reusable_targets WHERE hosts = ? AND port_list_id = ?",
+                (hosts_key(hosts), port_list_id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_target(self, hosts: Iterable[str], port_list_id: str, target_id: str):
+        with self.db.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO reusable_targets VALUES (?, ?, ?)",
+                (hosts_key(hosts), port_list_id, target_id),
+            )
+
+    def get_task(self, target_id: str, config_id: str, scanner_id: str) -> Optional[str]:
+        with self.db.connection() as db:
+            row = db.execute(
+                "SELECT task_id FROM reusable_tasks WHERE target_id = ? AND config_id = ? AND scanner_id = ?",
+                (target_id, config_id, scanner_id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_task(self, target_id: str, config_id: str, scanner_id: str, task_id: str):
+        with self.db.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO reusable_tasks VALUES (?, ?, ?, ?)",
+                (target_id, config_id, scanner_id, task_id),
+            )
+
+    def forget_task(self, task_id: str):
+        with self.db.transaction() as db:
+            db.execute("DELETE FROM reusable_tasks WHERE task_id = ?", (task_id,))
+
+    def forget_target(self, target_id: str):
+        """Drop a target and every task scanning it."""
+        with self.db.transaction() as db:
+            db.execute("DELETE FROM reusable_tasks WHERE target_id = ?", (target_id,))
+            db.execute("DELETE FROM reusable_targets WHERE target_id = ?", (target_id,))
+
+    def close(self):
+        self.db.close()
+
+
+get_target_index = Shared(TargetIndex)
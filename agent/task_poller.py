@@ -0,0 +1,341 @@
+# task_poller.py
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, AsyncIterator
+
+from agent.services import LoopService, Shared
+
+TASK_POLL_INTERVAL = float(os.environ.get("TASK_POLL_INTERVAL", "30"))
+# Polling period while only finished-task listeners are registered, scan events
+# trigger a refresh as they come and this just reconciles what they missed.
+TASK_RECONCILE_INTERVAL = float(os.environ.get("TASK_RECONCILE_INTERVAL", "120"))
+ACTIVE_TASKS_TTL = float(os.environ.get("ACTIVE_TASKS_TTL", "5"))
+# A task missing from a listing queried less than this ago is unknown right away.
+TASK_LOOKUP_TTL = float(os.environ.get("TASK_LOOKUP_TTL", "5"))
+# Statuses after which a task will not make progress anymore.
+FINISHED_TASK_STATUSES = ("Done", "Stopped", "Interrupted")
+# Statuses of tasks that occupy (or are about to occupy) the scanner.
+ACTIVE_TASK_STATUSES = ("Requested", "Queued", "Running", "Stop Requested")
+
+logger = logging.getLogger(__name__)
+
+# Queued for subscribers of a task that a complete listing did not contain.
+_NOT_FOUND = object()
+
+
+class UnknownTask(Exception):
+    """Raised when gvmd does not know the task a caller waits for."""
+
+
+class TaskState:
+    """Status and progress of one gvmd task as of the last poll."""
+
+    __slots__ = ("task_id", "name", "status", "progress", "updated_at")
+
+    def __init__(self, task_id: str, name: str, status: str, progress: int, updated_at: float):
+        self.task_id = task_id
+        self.name = name
+        self.status = status
+        self.progress = progress
+        self.updated_at = updated_at
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_TASK_STATUSES
+
+    @property
+    def done(self) -> bool:
+        return self.status == "Done"
+
+    def same_as(self, other: Optional["TaskState"]) -> bool:
+        return other is not None and other.status == self.status and other.progress == self.progress
+
+    def to_dict(self) -> dict:
+        return {
+            "task_id": self.task_id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "updated_at": self.updated_at,
+        }
+
+
+class TaskStatePoller(LoopService):
+    """Single shared poller maintaining a task id -> TaskState index.
+
+    One ``get_tasks`` query per interval serves every waiter. The poller only
+    queries gvmd while somebody is subscribed, or every ``reconcile_interval``
+    while finished-task listeners are registered and a task is still running;
+    subscribing to a task that is not in the index yet, or `wake`, triggers an
+    immediate refresh.
+    """
+
+    def __init__(self, openvas, interval: float = TASK_POLL_INTERVAL,
+                 reconcile_interval: float = TASK_RECONCILE_INTERVAL):
+        super().__init__("task-poller", self.poll, interval, wait=self._wait_next)
+        self.openvas = openvas
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._index: Dict[str, TaskState] = {}
+        self._subscribers: Dict[str, list] = {}
+        self._finished_listeners = []
+        self._refreshed = False
+        # Whether the last listing (or a start since) had a task that can still finish.
+        self._tasks_running = False
+        self._refresh_requested = False
+        # Time the last successful listing was requested from gvmd.
+        self._listed_at = 0.0
+        self._wake = threading.Event()
+        # Poll period of the next wait, set by `poll`.
+        self._next_wait = interval
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        super().stop(timeout)
+
+    def wake(self):
+        """Refresh as soon as possible, e.g. because a scan event arrived."""
+        with self._lock:
+            self._refresh_requested = True
+        self._wake.set()
+
+    def add_finished_listener(self, callback: Callable[[TaskState], None]):
+        """Call ``callback`` from the poller thread whenever a known task finishes."""
+        with self._lock:
+            self._finished_listeners.append(callback)
+        self.start()
+
+    def remove_finished_listener(self, callback: Callable[[TaskState], None]):
+        with self._lock:
+            if callback in self._finished_listeners:
+                self._finished_listeners.remove(callback)
+
+    def get(self, task_id: str) -> Optional[TaskState]:
+        with self._lock:
+            return self._index.get(task_id)
+
+    def refresh(self):
+        """Query gvmd once and notify subscribers of every task that changed."""
+        queried_at = time.time()
+        states = self.openvas.get_task_states()
+        now = time.time()
+        changed = []
+        finished = []
+        with self._lock:
+            # Tasks already finished when the poller first looks are not news.
+            first_refresh = not self._refreshed
+            self._refreshed = True
+            index = {}
+            for task_id, (name, status, progress) in states.items():
+                previous = self._index.get(task_id)
+                if previous is not None and previous.updated_at > queried_at:
+                    # Started after the query was sent, its answer still has the previous run.
+                    index[task_id] = previous
+                    continue
+                state = TaskState(task_id, name, status, progress, now)
+                if not state.same_as(previous):
+                    changed.append(state)
+                    if state.finished and not first_refresh and (previous is None or not previous.finished):
+                        finished.append(state)
+                index[task_id] = state
+            self._index = index
+            self._tasks_running = any(state.status in ACTIVE_TASK_STATUSES for state in index.values())
+            self._listed_at = queried_at
+            notify = [(state, list(self._subscribers.get(state.task_id, ()))) for state in changed]
+            # Only subscribers that were there before the query was sent, the task may be newer.
+            notify.extend((_NOT_FOUND, [s for s in subscribers if s[2] <= queried_at])
+                          for task_id, subscribers in self._subscribers.items() if task_id not in index)
+            listeners = list(self._finished_listeners)
+        for state, subscribers in notify:
+            for loop, queue, _ in subscribers:
+                loop.call_soon_threadsafe(queue.put_nowait, state)
+        for state in finished:
+            for callback in listeners:
+                try:
+                    callback(state)
+                except Exception as e:
+                    logger.info("Finished task listener failed: %s", str(e))
+        # The full listing is fresher than any active-only query.
+        get_active_tasks_cache().update(states)
+
+    def task_started(self, task_id: str):
+        """Replace the state of a (re)started task with ``Requested``.
+
+        A re-run task keeps its id, without this its previous run's finished
+        state would be handed to the next subscriber.
+        """
+        with self._lock:
+            previous = self._index.get(task_id)
+            state = TaskState(task_id, previous.name if previous else "", "Requested", 0, time.time())
+            self._index[task_id] = state
+            self._tasks_running = True
+            self._refresh_requested = True
+            subscribers = list(self._subscribers.get(task_id, ()))
+        for loop, queue, _ in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, state)
+        self._wake.set()
+
+    def poll(self):
+        """One iteration of the poller thread, refresh if anybody needs it."""
+        with self._lock:
+            has_subscribers = bool(self._subscribers)
+            has_listeners = bool(self._finished_listeners)
+            # Listeners only need listings while a task can still finish, or when asked to.
+            listen = has_listeners and (not self._refreshed or self._tasks_running or self._refresh_requested)
+            self._refresh_requested = False
+        self._next_wait = self.reconcile_interval if has_listeners and not has_subscribers else self.interval
+        if has_subscribers or listen:
+            self.refresh()
+
+    def _wait_next(self):
+        self._wake.wait(self._next_wait)
+        self._wake.clear()
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """Register the calling coroutine for updates of ``task_id``.
+
+        The current state, if known, is queued right away. A task missing from
+        a listing that is at most ``TASK_LOOKUP_TTL`` seconds old is reported as
+        unknown without querying gvmd again.
+        """
+        queue = asyncio.Queue()
+        now = time.time()
+        with self._lock:
+            # The poller may be in a reconciliation wait, go back to the shorter interval now.
+            first_subscriber = not self._subscribers
+            self._subscribers.setdefault(task_id, []).append((asyncio.get_running_loop(), queue, now))
+            state = self._index.get(task_id)
+            if state is None and now - self._listed_at < TASK_LOOKUP_TTL:
+                state = _NOT_FOUND
+        if state is not None:
+            queue.put_nowait(state)
+        if state is None or first_subscriber:
+            self._wake.set()
+        self.start()
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = [s for s in self._subscribers.get(task_id, ()) if s[1] is not queue]
+            if subscribers:
+                self._subscribers[task_id] = subscribers
+            else:
+                self._subscribers.pop(task_id, None)
+
+    async def wait_finished(self, task_id: str, timeout: float) -> Optional[TaskState]:
+        """Long-poll until the task finishes or ``timeout`` expires.
+
+        Returns:
+            - the last known TaskState, None if gvmd could not be listed in time.
+
+        Raises:
+            UnknownTask: a listing of gvmd's tasks did not contain ``task_id``.
+        """
+        queue = self.subscribe(task_id)
+        state = None
+        deadline = time.monotonic() + timeout
+        try:
+            while state is None or not state.finished:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    update = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if update is _NOT_FOUND:
+                    raise UnknownTask(task_id)
+                state = update
+        finally:
+            self.unsubscribe(task_id, queue)
+        return state if state is not None else self.get(task_id)
+
+    async def stream(self, task_id: str, heartbeat: float = 15) -> AsyncIterator[Optional[TaskState]]:
+        """Yield every state change of the task until it finishes.
+
+        None is yielded every ``heartbeat`` seconds without a change.
+
+        Raises:
+            UnknownTask: a listing of gvmd's tasks did not contain ``task_id``.
+        """
+        queue = self.subscribe(task_id)
+        try:
+            while True:
+                try:
+                    state = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if state is _NOT_FOUND:
+                    raise UnknownTask(task_id)
+                yield state
+                if state.finished:
+                    return
+        finally:
+            self.unsubscribe(task_id, queue)
+
+
+class ActiveTasksCache:
+    """Short-lived cache of the tasks currently occupying the scanner.
+
+    Shared by telemetry, the target scheduler and the HTTP API so that all of
+    them are answered from at most one gvmd query per ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl: float = ACTIVE_TASKS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._tasks: Dict[str, tuple] = {}
+        self._fetched_at = 0.0
+
+    def _fresh(self) -> bool:
+        return time.monotonic() - self._fetched_at < self.ttl
+
+    def get(self, openvas) -> Dict[str, tuple]:
+        """Return task id -> (name, status, progress) of active tasks.
+
+        Only one caller queries gvmd when the cache expired, the others wait
+        for its answer.
+        """
+        with self._lock:
+            if self._fresh():
+                return self._tasks
+        with self._refresh_lock:
+            with self._lock:
+                if self._fresh():
+                    return self._tasks
+            self.update(openvas.get_active_task_states())
+            with self._lock:
+                return self._tasks
+
+    def update(self, states: Dict[str, tuple]):
+        tasks = {task_id: state for task_id, state in states.items() if state[1] in ACTIVE_TASK_STATUSES}
+        with self._lock:
+            self._tasks = tasks
+            self._fetched_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._fetched_at = 0.0
+
+
+_active_tasks_cache = ActiveTasksCache()
+
+
+def get_active_tasks_cache() -> ActiveTasksCache:
+    return _active_tasks_cache
+
+
+get_task_poller = Shared(TaskStatePoller)
+
+
+def task_started(task_id: str):
+    """Tell the poller, if one runs, that ``task_id`` was just started."""
+    poller = get_task_poller.peek()
+    if poller is not None:
+        poller.task_started(task_id)
@@ -1,20 +1,30 @@
 import csv
 import io
+import itertools
 import os
 
 import psutil
-import json
-import requests
+import socket
+import threading
 import time
-import subprocess
 import logging
 
 from datetime import datetime
 
+from agent.export_state import get_export_state
+from agent.metrics import EXPORT_ROWS
 from agent.openvas_wrapper import OpenVas
+from agent.serialization import stream_encoder
+from agent.tuning import get_tuning
+from agent.uploader import get_uploader
 
 default_scan_config_id = "daba56c8-73ec-11df-a475-002264764cea"  # Default to GVMD_FULL_FAST_CONFIG
 
+# Seconds between refreshes of facts that rarely change (hostname, interfaces, boot time)
+TELEMETRY_STATIC_INTERVAL = float(os.environ.get("TELEMETRY_STATIC_INTERVAL", "600"))
+# Seconds between socket counts
+TELEMETRY_CONNECTIONS_INTERVAL = float(os.environ.get("TELEMETRY_CONNECTIONS_INTERVAL", "60"))
+
 openvas_telemetry = OpenVas()
 
 
@@ -22,22 +32,14 @@ openvas_telemetry = OpenVas()
 
 def send_scan_results(scan_results):
     try:
-        response = requests.post('https://panel.hunterbounter.com/scan_results/save', data=scan_results)
-        if response.status_code != 200:
-            print(f"Failed to send scan results: {response.text}")
+        if not get_uploader().upload("scan-results", scan_results):
+            print("Failed to send scan results")
     except Exception as e:
         print(f"Failed to send scan results: {e}")
 
 
 def get_host_name():
-    try:
-        host_name = subprocess.run(['hostname'], capture_output=True, text=True)
-        return host_name.stdout.strip()
-    except Exception as e:
-        return f"Hata: {e}"
-
-
-get_host_name()
+    return collector.sample("hostname")
 
 
 def get_active_interfaces():
@@ -71,7 +73,11 @@ def classify_status(value, normal_threshold, medium_threshold):
 
 
 def get_uptime():
-    uptime_seconds = int(time.time() - psutil.boot_time())
+    return format_uptime(time.time() - psutil.boot_time())
+
+
+def format_uptime(uptime_seconds):
+    uptime_seconds = int(uptime_seconds)
     uptime_days = uptime_seconds // (24 * 60 * 60)
     uptime_seconds %= (24 * 60 * 60)
     uptime_hours = uptime_seconds // (60 * 60)
@@ -89,17 +95,77 @@ def get_disk_status(used_percent):
         return "CRITICAL"
 
 
-def get_server_stats():
+def count_connections():
+    """Number of open sockets, read from /proc/net instead of psutil.net_connections().
+
+    psutil resolves the owning process of every socket by walking /proc/*/fd,
+    which is very slow with thousands of scanner probe sockets; counting the
+    lines of the kernel socket tables is enough here.
+    """
+    total = 0
     try:
-        hostname = get_host_name()
+        for table in ("tcp", "tcp6", "udp", "udp6"):
+            try:
+                with open(f"/proc/net/{table}", "rb") as f:
+                    total += sum(1 for _ in f) - 1
+            except FileNotFoundError:
+                continue
+        return total
+    except OSError:
+        return len(psutil.net_connections())
+
+
+class TelemetryCollector:
+    """Collects server stats, sampling every metric on its own cadence.
+
+    Static facts (hostname, interfaces, boot time) are refreshed every
+    ``static_interval`` seconds, the socket count every ``connections_interval``
+    seconds; CPU, RAM and scan state are read on every collection.
+    """
+
+    def __init__(self, openvas, static_interval=TELEMETRY_STATIC_INTERVAL,
+                 connections_interval=TELEMETRY_CONNECTIONS_INTERVAL):
+        self.openvas = openvas
+        self.metrics = {
+            "hostname": (socket.gethostname, static_interval),
+            "active_interfaces": (get_active_interfaces, static_interval),
+            "boot_time": (psutil.boot_time, static_interval),
+            "active_connections": (count_connections, connections_interval),
+        }
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def sample(self, name):
+        """Return the cached value of a metric, re-sampling it when it expired."""
+        func, interval = self.metrics[name]
+        now = time.monotonic()
+        with self._lock:
+            cached = self._samples.get(name)
+        if cached is not None and now - cached[1] < interval:
+            return cached[0]
+        started = time.perf_counter()
+        value = func()
+        duration_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._samples[name] = (value, now, duration_ms)
+        return value
+
+    def sample_durations(self):
+        """Duration in ms of the last sample of every cached metric."""
+        with self._lock:
+            return {name: round(sample[2], 3) for name, sample in self._samples.items()}
+
+    def collect(self):
+        started = time.perf_counter()
+        hostname = self.sample("hostname")
 
         ram_usage = psutil.virtual_memory().percent
         cpu_usage = psutil.cpu_percent()
-        active_interfaces = get_active_interfaces()
+        active_interfaces = self.sample("active_interfaces")
 
-        total_scan_count = openvas_telemetry.active_scans_count()
+        total_scan_count = self.openvas.active_scans_count()
 
-        openvas_status = openvas_telemetry.check_is_vas_online()
+        openvas_status = self.openvas.check_is_vas_online()
 
         if openvas_status:
             openvas_status = "online"
@@ -107,7 +173,7 @@ def get_server_stats():
             openvas_status = "offline"
 
         # Sistem uptime
-        uptime = get_uptime()
+        uptime = format_uptime(time.time() - self.sample("boot_time"))
 
         stats = {
             "hostname": hostname,
@@ -118,45 +184,39 @@ def get_server_stats():
             "uptime": uptime,
             "ram_usage": ram_usage,
             "cpu_usage": cpu_usage,
-            "active_connections": len(psutil.net_connections()),
-            "current_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "active_connections": self.sample("active_connections"),
+            "scanners": self.openvas.scanners.status(),
+            # Hardware seen at container start and the settings derived from it.
+            "tuning": get_tuning().values(),
+            "current_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         }
+        stats["sample_durations_ms"] = self.sample_durations()
+        stats["collect_duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return stats
 
-        if openvas_status == "online":
-            logging.info("Getting targets")
-            target_response = get_targets(total_scan_count, 2)
-
-            if target_response['success']:
-                logging.info("Targets received")
-                logging.info("Response -> " + str(target_response))
 
-                targets = target_response['data']['targets']
+collector = TelemetryCollector(openvas_telemetry)
 
-                if targets is not None:
-                    for target in targets:
-                        logging.info(f"Sending scan result for {target}")
-                        start_scan_response = openvas_telemetry.start_scan(target, default_scan_config_id)
-                        logging.info(f"Start scan response: {start_scan_response}")
 
-        return stats
+def get_server_stats():
+    try:
+        return collector.collect()
     except Exception as e:
         print(f"Failed to get server stats: {e}")
         return {"success": False, "message": str(e)}
 
 
-def get_targets(total_running_scan_count, docker_type):
-    url = "https://panel.hunterbounter.com/target"
-    headers = {
-        "Content-Type": "application/json",
-    }
+def get_targets(total_running_scan_count, docker_type, limit=None):
     payload = {
         "total_running_scan_count": total_running_scan_count,
         "docker_type": docker_type
     }
+    if limit is not None:
+        # Only ask for as many targets as the scheduler has free slots for.
+        payload["limit"] = limit
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        logging.info(f"Response: {response.json()}")
+        response = get_uploader().post_json("/target", payload)
         if response.status_code == 200:
             print(f"Success: {response.json()}")
             return response.json()
@@ -173,44 +233,44 @@ def get_targets(total_running_scan_count, docker_type):
 
 def send_telemetry(json_stats):
     try:
-        response = requests.post('https://panel.hunterbounter.com/telemetry/save', data=json_stats)
+        response = get_uploader().post("/telemetry/save", json_stats)
         if response.status_code != 200:
             print(f"Failed to send telemetry data: {response.text}")
     except Exception as e:
         print(f"Failed to send telemetry data: {e}")
 
 
-def send_scan_telemetry():
+def send_scan_telemetry(state=None):
+    """Ship the results added since the last export, returns the number of rows sent."""
     try:
-        scan_results = openvas_telemetry.get_results()
-        print("Scan Results (len): ", len(scan_results))
-
-        # scan results is raise ?
-        if scan_results is None or scan_results == {}:
-            logging.info("Scan results is None")
-            return
-            # to json
-
-        # add machineId
-        hostname = get_host_name()
-
-        # Add machine ID to each scan result
-        for result in scan_results:
-            result['machine_id'] = hostname
-            result['agent_type'] = "openvas"
-
-        json_result = json.dumps(scan_results, indent=4)
-
-        response = requests.post('https://panel.hunterbounter.com/scan_results/openvas/save', data=json_result,
-                                 headers={"Content-Type": "application/json"})
-        if response.status_code != 200:
-            print(f"Failed to send scan results: {response.text}")
+        # Machine ID and agent type travel as headers instead of on every row
+        uploader = get_uploader()
+        uploader.set_agent_headers({"X-Machine-Id": get_host_name(), "X-Agent-Type": "openvas"})
+
+        batch = (state or get_export_state()).begin()
+        scan_results = openvas_telemetry.iter_results(batch)
+
+        first_result = next(scan_results, None)
+        if first_result is None:
+            logging.info("No new scan results")
+            EXPORT_ROWS.observe(0)
+            # Reports without new results still move the watermark forward.
+            batch.commit()
+            # Batches spooled during an outage would otherwise wait for the next new result.
+            uploader.replay()
+            return 0
+
+        # Rows are encoded and sent while they are still being fetched from gvmd
+        content_type, encode = stream_encoder()
+        rows = itertools.chain([first_result], scan_results)
+        # Spooled batches count as delivered, they are replayed once the panel is back.
+        if not uploader.upload_stream("openvas-results", encode(rows), content_type):
+            print("Failed to send scan results")
+            return 0
+        batch.commit()
+        EXPORT_ROWS.observe(len(batch.results))
+        print("Scan Results (len): ", len(batch.results))
+        return len(batch.results)
     except Exception as e:
         print(f"Failed to send scan results: {e}")
-
-
-send_scan_telemetry()
-exit(1)
-server_stats = get_server_stats()
-json_stats = json.dumps(server_stats, indent=4)
-send_telemetry(json_stats)
+        return 0
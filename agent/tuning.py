@@ -0,0 +1,206 @@
+# tuning.py
+import argparse
+import math
+import os
+import shlex
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+from agent.services import Shared
+
+# Written once per container start by scripts/tune.sh, sourced by the service scripts.
+TUNING_FILE = os.environ.get("TUNING_FILE", "/run/agent-tuning.env")
+# Memory kept free for gvmd, gsad, notus, mosquitto and the agent itself.
+SYSTEM_RESERVE_MB = 1024
+# Resident size of one openvas plugin process, bounds scanner parallelism by RAM.
+SCAN_PROCESS_MB = 40
+# Plugin processes per core, most of them wait on the network.
+SCAN_PROCESSES_PER_CORE = 24
+# gvmd does not change Postgres' default, work_mem is sized for all of them sorting at once.
+PG_MAX_CONNECTIONS = 100
+
+
+def _read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cpus() -> Optional[float]:
+    """CPU quota of the container's cgroup (v2, then v1), None if unlimited."""
+    cpu_max = _read_first_line("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    quota = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def _cgroup_memory_mb() -> Optional[int]:
+    """Memory limit of the container's cgroup (v2, then v1), None if unlimited."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        value = _read_first_line(path)
+        if value is None:
+            continue
+        if value == "max":
+            return None
+        # cgroup v1 reports "unlimited" as a page-aligned huge number, min() with RAM takes care of it.
+        return int(value) // (1024 * 1024)
+    return None
+
+
+def detect_hardware() -> Tuple[int, int, bool]:
+    """Cores and MB of RAM this container may use, and whether a cgroup limit applied."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    limited = False
+    quota = _cgroup_cpus()
+    if quota is not None and math.ceil(quota) < cpus:
+        cpus, limited = max(1, math.ceil(quota)), True
+    limit = _cgroup_memory_mb()
+    if limit is not None and limit < memory_mb:
+        memory_mb, limited = limit, True
+    return cpus, memory_mb, limited
+
+
+def _clamp(value: int, low: int, high: int) -> int:
+    return max(low, min(value, high))
+
+
+def derive(cpus: int, memory_mb: int, env=os.environ) -> Dict[str, object]:
+    """Resource settings for ``cpus`` cores and ``memory_mb`` MB of RAM.
+
+    Every setting can be pinned with an environment variable of the same
+    name; settings derived from it (e.g. REDISDBS from the scanner limits)
+    follow the pinned value.
+    """
+
+    def pick(name, value):
+        return env.get(name) or value
+
+    def pick_int(name, value):
+        return int(env[name]) if env.get(name) else value
+
+    shared_buffers = _clamp(memory_mb // 4, 128, 8192)
+    values = {
+        "PG_SHARED_BUFFERS": pick("PG_SHARED_BUFFERS", f"{shared_buffers}MB"),
+        "PG_EFFECTIVE_CACHE_SIZE": pick("PG_EFFECTIVE_CACHE_SIZE", f"{max(memory_mb // 2, shared_buffers)}MB"),
+        "PG_WORK_MEM": pick("PG_WORK_MEM", f"{_clamp(memory_mb // 4 // PG_MAX_CONNECTIONS, 4, 256)}MB"),
+        "PG_MAINTENANCE_WORK_MEM": pick("PG_MAINTENANCE_WORK_MEM", f"{_clamp(memory_mb // 16, 64, 2048)}MB"),
+    }
+
+    # Plugin processes the scanner can run at once, by CPU and by the RAM Postgres leaves over.
+    scanner_mb = max(memory_mb - shared_buffers - SYSTEM_RESERVE_MB, SCAN_PROCESS_MB)
+    processes = max(1, min(cpus * SCAN_PROCESSES_PER_CORE, scanner_mb // SCAN_PROCESS_MB))
+    max_scans = pick_int("SCANNER_MAX_SCANS", _clamp(cpus // 2, 1, 16))
+    max_checks = pick_int("SCANNER_MAX_CHECKS", _clamp(cpus // 4 + 2, 3, 8))
+    max_hosts = pick_int("SCANNER_MAX_HOSTS", _clamp(processes // (max_scans * max_checks), 1, 30))
+    values.update({
+        "SCANNER_MAX_SCANS": max_scans,
+        "SCANNER_MAX_HOSTS": max_hosts,
+        "SCANNER_MAX_CHECKS": max_checks,
+        # ospd-openvas queues new scans while less memory than this is free.
+        "SCANNER_MIN_FREE_MEM_MB": pick_int("SCANNER_MIN_FREE_MEM_MB", _clamp(memory_mb // 10, 256, 4096)),
+    })
+
+    # openvas takes one redis database per host being scanned plus one per scan, doubled for headroom.
+    databases = 2 * (max_scans * max_hosts + max_scans) + 1
+    values["REDISDBS"] = pick_int("REDISDBS", max(32, 1 << (databases - 1).bit_length()))
+    # Every plugin process holds a redis connection.
+    values["REDIS_MAXCLIENTS"] = pick_int("REDIS_MAXCLIENTS", _clamp(2 * max_scans * max_hosts * max_checks + 256,
+                                                                     1024, 65536))
+    return values
+
+
+def write_tuning(values: Dict[str, object], path: str = TUNING_FILE):
+    """Atomically write ``values`` as shell assignments."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tuning-")
+    with os.fdopen(fd, "w") as f:
+        f.write("# Written by agent.tuning at container start, edit the environment instead.\n")
+        for name, value in values.items():
+            f.write(f"{name}={shlex.quote(str(value))}\n")
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def read_tuning(path: str = TUNING_FILE) -> Dict[str, str]:
+    """Values of a tuning file, empty if it does not exist (yet)."""
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                name, _, value = line.partition("=")
+                values[name] = " ".join(shlex.split(value))
+    except OSError:
+        pass
+    return values
+
+
+class TuningFile:
+    """Settings chosen at container start, as seen by the agent.
+
+    The agent starts next to the startup scripts, so the file may appear or be
+    rewritten after it was first read; it is re-read whenever it changed.
+    """
+
+    def __init__(self, path: str = TUNING_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._values = {}
+
+    def values(self) -> Dict[str, str]:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                self._values = read_tuning(self.path) if mtime is not None else {}
+                self._mtime = mtime
+            return dict(self._values)
+
+    def get_int(self, name: str, default: int) -> int:
+        try:
+            return int(self.values()[name])
+        except (KeyError, ValueError):
+            return default
+
+
+# The process wide view of the tuning file.
+get_tuning = Shared(TuningFile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Derive scanner, redis and Postgres settings from the hardware.")
+    parser.add_argument("--output", default=TUNING_FILE, help="file the settings are written to")
+    args = parser.parse_args()
+
+    cpus, memory_mb, limited = detect_hardware()
+    # Pinning the hardware is mostly useful to preview the settings of another node.
+    cpus = int(os.environ.get("TUNING_CPUS") or cpus)
+    memory_mb = int(os.environ.get("TUNING_MEMORY_MB") or memory_mb)
+    values = {"TUNING_CPUS": cpus, "TUNING_MEMORY_MB": memory_mb, "TUNING_CGROUP_LIMITED": str(limited).lower()}
+    values.update(derive(cpus, memory_mb))
+    write_tuning(values, args.output)
+    for name, value in values.items():
+        print(f"{name}={value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+# uploader.py
+import gzip
+import logging
+import os
+import threading
+from email.utils import parsedate_to_datetime
+import time
+import zlib
+from typing import Iterable, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from agent.metrics import PANEL_BYTES_SENT, PANEL_REQUEST_ERRORS, PANEL_REQUEST_SECONDS
+from agent.services import Shared
+
+PANEL_URL = os.environ.get("PANEL_URL", "https://panel.hunterbounter.com")
+PANEL_CONNECT_TIMEOUT = float(os.environ.get("PANEL_CONNECT_TIMEOUT", "5"))
+PANEL_READ_TIMEOUT = float(os.environ.get("PANEL_READ_TIMEOUT", "30"))
+PANEL_RETRIES = int(os.environ.get("PANEL_RETRIES", "3"))
+PANEL_BACKOFF = float(os.environ.get("PANEL_BACKOFF", "0.5"))
+# Bodies smaller than this are sent uncompressed, gzip would not pay off.
+PANEL_GZIP_MIN_BYTES = int(os.environ.get("PANEL_GZIP_MIN_BYTES", "1024"))
+SPOOL_DIR = os.environ.get("PANEL_SPOOL_DIR", "/data/spool")
+SPOOL_MAX_FILES = int(os.environ.get("PANEL_SPOOL_MAX_FILES", "1000"))
+SPOOL_MAX_BYTES = int(os.environ.get("PANEL_SPOOL_MAX_BYTES", str(512 * 1024 * 1024)))
+# Batches the panel rejected for good are moved there, below the spool directory.
+REJECTED_DIR = "rejected"
+# Answers meaning "not now" rather than "never", e.g. while a token is rotated: the batch stays spooled.
+RETRY_LATER_STATUSES = (401, 403, 408, 425, 429)
+# Pause of the replay after such an answer when the panel sent no Retry-After.
+PANEL_RETRY_AFTER = float(os.environ.get("PANEL_RETRY_AFTER", "60"))
+
+# Uploads that may be spooled, keyed by a short name used in spool file names.
+SPOOLED_PATHS = {
+    "openvas-results": "/scan_results/openvas/save",
+    "scan-results": "/scan_results/save",
+}
+
+# Content types a spooled batch can have, keyed by the tag stored in its file name.
+SPOOL_CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "msgpack": "application/msgpack",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class PanelUploader:
+    """Shared HTTP client for every call to the panel.
+
+    Connections are kept alive and pooled by one ``requests.Session``, every
+    request has a connect and read timeout, and transient failures are retried
+    with exponential backoff. Spoolable uploads that still fail are written to a
+    bounded spool directory and replayed in order once the panel answers again.
+    """
+
+    def __init__(
+            self,
+            base_url: str = PANEL_URL,
+            spool_dir: str = SPOOL_DIR,
+            retries: int = PANEL_RETRIES,
+            backoff: float = PANEL_BACKOFF,
+            timeout: tuple = (PANEL_CONNECT_TIMEOUT, PANEL_READ_TIMEOUT),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.spool_dir = spool_dir
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Generator bodies cannot be rewound, a retry would send an empty body.
+        # Streamed uploads are sent once and retried from their spool file instead.
+        self.stream_session = requests.Session()
+        stream_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+        self.stream_session.mount("https://", stream_adapter)
+        self.stream_session.mount("http://", stream_adapter)
+        self._spool_lock = threading.Lock()
+        self._sequence = 0
+        # Monotonic time before which spooled batches are not replayed.
+        self._retry_at = 0.0
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def _request(self, path: str, session: requests.Session = None, **kwargs) -> requests.Response:
+        """POST through the session, recording latency and failures per path."""
+        started = time.perf_counter()
+        try:
+            response = (session or self.session).post(self._url(path), timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            PANEL_REQUEST_ERRORS.inc(path=path, reason=type(e).__name__)
+            raise
+        finally:
+            PANEL_REQUEST_SECONDS.observe(time.perf_counter() - started, path=path)
+        if response.status_code != 200:
+            PANEL_REQUEST_ERRORS.inc(path=path, reason=str(response.status_code))
+        return response
+
+    def _send(self, path: str, body: bytes, headers: dict) -> requests.Response:
+        PANEL_BYTES_SENT.inc(len(body), path=path)
+        return self._request(path, data=body, headers=headers)
+
+    @staticmethod
+    def _encode(data: Union[str, bytes], content_type: str):
+        body = data.encode("utf-8") if isinstance(data, str) else data
+        headers = {"Content-Type": content_type}
+        if len(body) >= PANEL_GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def post(self, path: str, data: Union[str, bytes], content_type: str = "application/json") -> requests.Response:
+        """POST to the panel with pooling, timeouts, retries and compression.
+
+        Raises:
+            requests.RequestException: the panel stayed unreachable.
+        """
+        body, headers = self._encode(data, content_type)
+        return self._send(path, body, headers)
+
+    def set_agent_headers(self, headers: dict):
+        """Headers sent with every request, e.g. the machine id of this agent."""
+        self.session.headers.update(headers)
+        self.stream_session.headers.update(headers)
+
+    def post_json(self, path: str, payload) -> requests.Response:
+        response = self._request(path, json=payload)
+        if response.request.body:
+            PANEL_BYTES_SENT.inc(len(response.request.body), path=path)
+        return response
+
+    def upload(self, name: str, data: Union[str, bytes], content_type: str = "application/json") -> bool:
+        """Deliver a spoolable batch held in memory, see `upload_stream`."""
+        body = data.encode("utf-8") if isinstance(data, str) else data
+        return self.upload_stream(name, [body], content_type)
+
+    def upload_stream(self, name: str, chunks: Iterable[bytes], content_type: str = "application/json") -> bool:
+        """Deliver a spoolable batch as a gzip compressed, chunked request body.
+
+        The chunks are compressed and sent as they are produced while a copy is
+        written to a spool file. The copy is dropped once the panel accepted the
+        batch, moved to the ``rejected`` directory if the panel refused it for
+        good and kept for replay otherwise. The streamed request is not retried,
+        a failed batch is retried by replaying its spool file right away. If
+        older batches are still spooled the new one is only spooled, so batches
+        reach the panel in order.
+
+        Returns:
+            - bool: True if the batch was accepted by the panel, spooled or
+              rejected (sending it again would not change the answer), False
+              if the spool is full.
+
+        Raises:
+            Exception: whatever ``chunks`` raised; nothing is spooled then.
+        """
+        path = SPOOLED_PATHS[name]
+        if not self._spool_has_room():
+            logger.info("Spool %s is full, refusing %s batch", self.spool_dir, name)
+            return False
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with self._spool_lock:
+            self._sequence += 1
+            sequence = self._sequence
+        kind = next(k for k, v in SPOOL_CONTENT_TYPES.items() if v == content_type)
+        file_name = f"{time.time_ns():020d}-{sequence:06d}.{name}.{kind}.gzip.spool"
+        tmp_path = os.path.join(self.spool_dir, f".{file_name}.tmp")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        sent = 0
+        failed = False
+        rejected = False
+        # Set once the compressor was flushed, only a complete batch is sent or spooled.
+        finished = False
+        # Raised by the producer, the HTTP client would turn e.g. a TimeoutError into a ConnectionError.
+        producer_error = None
+
+        with open(tmp_path, "wb") as spool_file:
+            def body():
+                nonlocal sent, finished, producer_error
+                try:
+                    for chunk in chunks:
+                        data = compressor.compress(chunk)
+                        if data:
+                            spool_file.write(data)
+                            sent += len(data)
+                            yield data
+                except BaseException as e:
+                    producer_error = e
+                    raise
+                data = compressor.flush()
+                spool_file.write(data)
+                sent += len(data)
+                finished = True
+                yield data
+
+            stream = body()
+            try:
+                if self.replay():
+                    headers = {"Content-Type": content_type, "Content-Encoding": "gzip"}
+                    try:
+                        response = self._request(path, session=self.stream_session, data=stream, headers=headers)
+                        PANEL_BYTES_SENT.inc(sent, path=path)
+                        if response.status_code == 200 and finished:
+                            os.remove(tmp_path)
+                            return True
+                        if self._retry_later(response):
+                            logger.info("Panel answered %s with %s, spooling", name, response.status_code)
+                            failed = True
+                        elif finished:
+                            logger.info("Panel rejected %s with %s: %s", name, response.status_code, response.text)
+                            rejected = True
+                        else:
+                            failed = True
+                    except requests.RequestException as e:
+                        if producer_error is None:
+                            logger.info("Failed to send %s, spooling: %s", name, str(e))
+                        failed = True
+                if producer_error is None:
+                    # Whatever the request did not consume still has to reach the spool file.
+                    for _ in stream:
+                        pass
+                if producer_error is not None:
+                    raise producer_error
+                if not finished:
+                    raise RuntimeError(f"The {name} batch ended before it was complete")
+                spool_file.flush()
+                os.fsync(spool_file.fileno())
+            except BaseException:
+                # There is no complete batch to keep.
+                os.remove(tmp_path)
+                raise
+
+        if rejected:
+            self._reject(tmp_path, file_name)
+            return True
+        os.replace(tmp_path, os.path.join(self.spool_dir, file_name))
+        if failed:
+            # The spool file is complete and rewindable, the retrying session can resend it.
+            self.replay()
+        return True
+
+    def _retry_later(self, response: requests.Response) -> bool:
+        """True if the batch should be sent again, pausing the replay as the panel asks."""
+        status = response.status_code
+        if status < 500 and status not in RETRY_LATER_STATUSES:
+            return False
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is None and status >= 500:
+            return True
+        delay = PANEL_RETRY_AFTER
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    pass
+        self._retry_at = time.monotonic() + max(0.0, delay)
+        logger.info("Panel answered %s, replaying the spool in %.0fs", status, max(0.0, delay))
+        return True
+
+    def _reject(self, file_path: str, file_name: str):
+        """Keep a batch the panel refused for good out of the replay, but on disk."""
+        rejected_dir = os.path.join(self.spool_dir, REJECTED_DIR)
+        os.makedirs(rejected_dir, exist_ok=True)
+        os.replace(file_path, os.path.join(rejected_dir, file_name))
+        # Bounded like the spool, the oldest rejected batches go first.
+        for old in sorted(os.listdir(rejected_dir))[:-SPOOL_MAX_FILES]:
+            os.remove(os.path.join(rejected_dir, old))
+
+    def _spool_files(self):
+        try:
+            return sorted(f for f in os.listdir(self.spool_dir) if f.endswith(".spool"))
+        except FileNotFoundError:
+            return []
+
+    def _spool_has_room(self) -> bool:
+        files = self._spool_files()
+        size = sum(os.path.getsize(os.path.join(self.spool_dir, f)) for f in files)
+        return len(files) < SPOOL_MAX_FILES and size < SPOOL_MAX_BYTES
+
+    def replay(self) -> bool:
+        """Send spooled batches oldest first, stopping at the first failure.
+
+        A batch the panel refused for good is moved to the ``rejected``
+        directory, after a "retry later" answer the replay pauses for the
+        panel's Retry-After.
+
+        Returns:
+            - bool: True if the spool is empty afterwards.
+        """
+        with self._spool_lock:
+            files = self._spool_files()
+            if files and time.monotonic() < self._retry_at:
+                return False
+            for file_name in files:
+                _, name, kind, encoding, _ = file_name.split(".")
+                path = SPOOLED_PATHS.get(name)
+                file_path = os.path.join(self.spool_dir, file_name)
+                if path is None or kind not in SPOOL_CONTENT_TYPES:
+                    logger.info("Dropping spooled batch for unknown upload %s", file_name)
+                    os.remove(file_path)
+                    continue
+                headers = {"Content-Type": SPOOL_CONTENT_TYPES[kind]}
+                if encoding == "gzip":
+                    headers["Content-Encoding"] = "gzip"
+                try:
+                    # Streamed from disk, urllib3 rewinds the file for retries.
+                    with open(file_path, "rb") as f:
+                        response = self._request(path, data=f, headers=headers)
+                    PANEL_BYTES_SENT.inc(os.path.getsize(file_path), path=path)
+                except requests.RequestException as e:
+                    logger.info("Panel still unreachable, %s stays spooled: %s", file_name, str(e))
+                    return False
+                if response.status_code == 200:
+                    os.remove(file_path)
+                    continue
+                if self._retry_later(response):
+                    return False
+                logger.info("Panel rejected spooled batch %s with %s, moving it to %s: %s",
+                            file_name, response.status_code, REJECTED_DIR, response.text)
+                self._reject(file_path, file_name)
+            return True
+
+    def spool_depth(self) -> int:
+        return len(self._spool_files())
+
+
+get_uploader = Shared(PanelUploader)
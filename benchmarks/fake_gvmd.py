@@ -0,0 +1,362 @@
+# fake_gvmd.py
+"""Minimal GMP-over-TLS server standing in for gvmd in benchmarks.
+
+Speaks enough GMP for the calls the agent makes and serves synthetic tasks,
+targets and reports, in gvmd's native XML report format or as base64 CSV like
+the "CSV Results" report format.
+"""
+import base64
+import csv
+import datetime
+import io
+import os
+import re
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+from xml.sax.saxutils import escape, quoteattr
+
+from lxml import etree
+
+GMP_VERSION = "22.5"
+CSV_REPORT_FORMAT_ID = "c1645568-627a-11e3-a660-406186ea4fc5"
+XML_REPORT_FORMAT_ID = "a994b278-1f62-11e1-96ac-406186ea4fc5"
+PORT_LIST_ID = "4a4717fe-57d2-11e1-9a26-406186ea4fc5"
+CONFIG_ID = "daba56c8-73ec-11df-a475-002264764cea"
+SCANNER_ID = "08b69003-5fc2-4037-a479-93b440211c73"
+CVE_SCANNER_ID = "6acd0832-df90-11e4-b9d5-28d24461215b"
+# Every synthetic result carries a product detection, and an NVT cvss_base that
+# differs from the result severity, so a parser mixing the two is caught.
+PRODUCT_CPE = "cpe:/a:example:httpd:2.4.1"
+PRODUCT_DETECTION_OID = "1.3.6.1.4.1.25623.1.0.10107"
+PRODUCT_DETECTION = f"{PRODUCT_CPE} (OID: {PRODUCT_DETECTION_OID})"
+
+CSV_COLUMNS = [
+    "IP", "Hostname", "Port", "Port Protocol", "CVSS", "Severity", "QoD", "Solution Type", "NVT Name",
+    "Summary", "Specific Result", "NVT OID", "CVEs", "Task ID", "Task Name", "Timestamp", "Result ID",
+    "Impact", "Solution", "Affected Software/OS", "Vulnerability Insight", "Vulnerability Detection Method",
+    "Product Detection Result", "BIDs", "CERTs", "Other References",
+]
+ACTIVE_STATUSES = ("Requested", "Queued", "Running", "Stop Requested")
+
+
+def _uuid(*parts) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, "/".join(str(p) for p in parts)))
+
+
+def _timestamp(offset: int = 0) -> str:
+    moment = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=offset)
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def make_certificate(directory: str):
+    """Write a throw-away self-signed certificate, returns (cert path, key path)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-gvmd")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "fake-gvmd.pem")
+    key_path = os.path.join(directory, "fake-gvmd.key")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class FakeGvmdState:
+    """Synthetic gvmd database.
+
+    Args:
+        tasks: finished tasks created up front, each with one target.
+        reports_per_task: finished reports of every task.
+        results_per_report: result rows of every report.
+        result_size: approximate size in bytes of one CSV result row.
+        latency: seconds slept before every response.
+    """
+
+    def __init__(self, tasks: int = 10, reports_per_task: int = 1, results_per_report: int = 100,
+                 result_size: int = 1024, latency: float = 0.0):
+        self.results_per_report = results_per_report
+        self.result_size = result_size
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.tasks = {}
+        self.reports = {}
+        for t in range(tasks):
+            target_id = _uuid("target", t)
+            task_id = _uuid("task", t)
+            self.targets[target_id] = {"hosts": f"10.0.{t // 250}.{t % 250 + 1}", "port_list": PORT_LIST_ID}
+            self.tasks[task_id] = {"name": f"Scan Host {t}", "status": "Done", "progress": -1,
+                                   "target": target_id, "config": CONFIG_ID, "scanner": SCANNER_ID,
+                                   "modification_time": _timestamp(t)}
+            for r in range(reports_per_task):
+                self.reports[_uuid("report", t, r)] = {"task": task_id, "status": "Done",
+                                                       "modification_time": _timestamp(t)}
+
+    def report_csv(self, report_id: str, first: int, rows: int) -> bytes:
+        report = self.reports[report_id]
+        task = self.tasks.get(report["task"], {})
+        end = self.results_per_report if rows < 0 else min(self.results_per_report, first - 1 + rows)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(CSV_COLUMNS)
+        filler = "x" * max(0, self.result_size - 400)
+        for i in range(first - 1, end):
+            writer.writerow([
+                f"10.1.{i // 250 % 250}.{i % 250 + 1}", "host.example", str(1 + i % 65535), "tcp", "5.0", "Medium",
+                "80", "VendorFix", f"Synthetic NVT {i}", f"Summary {filler}", "Specific result", f"1.3.6.1.4.{i}",
+                "CVE-2024-0001", report["task"], task.get("name", ""), report["modification_time"],
+                _uuid("result", report_id, i), "Impact", "Update", "", "Insight", "Detection", PRODUCT_DETECTION, "", "", "",
+            ])
+        return out.getvalue().encode("utf-8")
+
+    def report_xml(self, report_id: str, first: int, rows: int) -> str:
+        """Results of a report in gvmd's native XML report format."""
+        report = self.reports[report_id]
+        task = self.tasks.get(report["task"], {})
+        end = self.results_per_report if rows < 0 else min(self.results_per_report, first - 1 + rows)
+        filler = "x" * max(0, self.result_size - 400)
+        parts = []
+        for i in range(first - 1, end):
+            parts.append(
+                f'<result id="{_uuid("result", report_id, i)}"><name>Synthetic NVT {i}</name>'
+                f'<creation_time>{report["modification_time"]}</creation_time>'
+                f'<host>10.1.{i // 250 % 250}.{i % 250 + 1}<asset asset_id=""/>'
+                f'<hostname>host.example</hostname></host><port>{1 + i % 65535}/tcp</port>'
+                f'<nvt oid="1.3.6.1.4.{i}"><type>nvt</type><name>Synthetic NVT {i}</name>'
+                f'<cvss_base>6.4</cvss_base><tags>cvss_base_vector=AV:N/AC:L|summary=Summary {filler}'
+                f'|insight=Insight|affected=|impact=Impact|vuldetect=Detection|solution_type=VendorFix</tags>'
+                f'<solution type="VendorFix">Update</solution>'
+                f'<refs><ref type="cve" id="CVE-2024-0001"/></refs></nvt>'
+                f'<threat>Medium</threat><severity>5.0</severity><qod><value>80</value>'
+                f'<type>remote_banner</type></qod><description>Specific result</description>'
+                f'<detection><result id="{_uuid("detection", report_id, i)}"><details>'
+                f'<detail><name>product</name><value>{PRODUCT_CPE}</value></detail>'
+                f'<detail><name>location</name><value>{1 + i % 65535}/tcp</value></detail>'
+                f'<detail><name>source_oid</name><value>{PRODUCT_DETECTION_OID}</value></detail>'
+                f'</details></result></detection></result>'
+            )
+        return (f'<task id="{report["task"]}"><name>{escape(task.get("name", ""))}</name></task>'
+                f'<scan_run_status>{report["status"]}</scan_run_status>'
+                f'<results start="{first}" max="{rows}">{"".join(parts)}</results>')
+
+    def report_response(self, report_id: str, first: int, rows: int, format_id: str = None) -> str:
+        """Complete get_reports_response for one report page, CSV if ``format_id`` is given."""
+        if not format_id or format_id == XML_REPORT_FORMAT_ID:
+            return (f'<get_reports_response status="200" status_text="OK">'
+                    f'<report id="{report_id}" format_id="{XML_REPORT_FORMAT_ID}" extension="xml" '
+                    f'content_type="text/xml"><report id="{report_id}">'
+                    f'{self.report_xml(report_id, first, rows)}</report></report></get_reports_response>')
+        content = base64.b64encode(self.report_csv(report_id, first, rows)).decode("ascii")
+        return (f'<get_reports_response status="200" status_text="OK">'
+                f'<report id="{report_id}" format_id={quoteattr(format_id)} extension="csv" '
+                f'content_type="text/csv"><report_format id={quoteattr(format_id)}>'
+                f'<name>CSV Results</name></report_format>{content}</report></get_reports_response>')
+
+
+class GmpHandler(socketserver.BaseRequestHandler):
+    """One TLS connection, answering GMP commands until the client disconnects."""
+
+    def handle(self):
+        state: FakeGvmdState = self.server.state
+        parser = etree.XMLPullParser(events=("start", "end"))
+        depth = 0
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except (ConnectionError, ssl.SSLError):
+                return
+            if not data:
+                return
+            parser.feed(data)
+            for event, element in parser.read_events():
+                depth += 1 if event == "start" else -1
+                if event == "end" and depth == 0:
+                    if state.latency:
+                        time.sleep(state.latency)
+                    self.request.sendall(self.respond(state, element).encode("utf-8"))
+                    parser = etree.XMLPullParser(events=("start", "end"))
+
+    def respond(self, state: FakeGvmdState, command) -> str:
+        handler = getattr(self, f"cmd_{command.tag}", None)
+        if handler is None:
+            return f'<{command.tag}_response status="400" status_text="Bogus command name"/>'
+        with state.lock:
+            return handler(state, command)
+
+    @staticmethod
+    def _filter(command, attribute: str = "filter") -> str:
+        return command.get(attribute) or command.get("filter") or ""
+
+    @staticmethod
+    def _page(filter_string: str, default_rows: int = 10):
+        first = re.search(r"\bfirst=(-?\d+)", filter_string)
+        rows = re.search(r"\brows=(-?\d+)", filter_string)
+        return (max(1, int(first.group(1))) if first else 1), (int(rows.group(1)) if rows else default_rows)
+
+    def cmd_get_version(self, state, command):
+        return f'<get_version_response status="200" status_text="OK"><version>{GMP_VERSION}</version></get_version_response>'
+
+    def cmd_authenticate(self, state, command):
+        return ('<authenticate_response status="200" status_text="OK">'
+                '<role>Admin</role><timezone>UTC</timezone></authenticate_response>')
+
+    def _task_xml(self, task_id: str, task: dict) -> str:
+        return (f'<task id="{task_id}"><name>{escape(task["name"])}</name>'
+                f'<modification_time>{task["modification_time"]}</modification_time>'
+                f'<config id="{task["config"]}"/><target id="{task["target"]}"/>'
+                f'<scanner id="{task["scanner"]}"/><status>{task["status"]}</status>'
+                f'<progress>{task["progress"]}</progress></task>')
+
+    def cmd_get_tasks(self, state, command):
+        task_id = command.get("task_id")
+        if task_id:
+            if task_id not in state.tasks:
+                return f'<get_tasks_response status="404" status_text="Failed to find task {task_id}"/>'
+            selected = [(task_id, state.tasks[task_id])]
+        else:
+            statuses = re.findall(r'status="([^"]+)"', self._filter(command))
+            selected = [(i, t) for i, t in state.tasks.items() if not statuses or t["status"] in statuses]
+        body = "".join(self._task_xml(i, t) for i, t in selected)
+        return f'<get_tasks_response status="200" status_text="OK">{body}</get_tasks_response>'
+
+    def cmd_get_scanners(self, state, command):
+        return ('<get_scanners_response status="200" status_text="OK">'
+                f'<scanner id="{SCANNER_ID}"><name>OpenVAS Default</name><type>2</type></scanner>'
+                f'<scanner id="{CVE_SCANNER_ID}"><name>CVE</name><type>3</type></scanner>'
+                '</get_scanners_response>')
+
+    def cmd_verify_scanner(self, state, command):
+        return ('<verify_scanner_response status="200" status_text="OK">'
+                '<version>OTP/2.0</version></verify_scanner_response>')
+
+    def cmd_get_targets(self, state, command):
+        target_id = command.get("target_id")
+        if target_id and target_id not in state.targets:
+            return f'<get_targets_response status="404" status_text="Failed to find target {target_id}"/>'
+        selected = [(target_id, state.targets[target_id])] if target_id else list(state.targets.items())
+        body = ""
+        for i, target in selected:
+            in_use = int(any(t["target"] == i for t in state.tasks.values()))
+            body += (f'<target id="{i}"><hosts>{escape(target["hosts"])}</hosts>'
+                     f'<port_list id="{target["port_list"]}"/><in_use>{in_use}</in_use></target>')
+        return f'<get_targets_response status="200" status_text="OK">{body}</get_targets_response>'
+
+    def cmd_create_target(self, state, command):
+        target_id = str(uuid.uuid4())
+        state.targets[target_id] = {"hosts": command.findtext("hosts") or "",
+                                    "port_list": command.find("port_list").get("id")}
+        return f'<create_target_response status="201" status_text="OK, resource created" id="{target_id}"/>'
+
+    def cmd_create_task(self, state, command):
+        target_id = command.find("target").get("id")
+        if target_id not in state.targets:
+            return '<create_task_response status="404" status_text="Failed to find target"/>'
+        task_id = str(uuid.uuid4())
+        state.tasks[task_id] = {"name": command.findtext("name") or "", "status": "New", "progress": -1,
+                                "target": target_id, "config": command.find("config").get("id"),
+                                "scanner": command.find("scanner").get("id"),
+                                "modification_time": _timestamp()}
+        return f'<create_task_response status="201" status_text="OK, resource created" id="{task_id}"/>'
+
+    def cmd_start_task(self, state, command):
+        task = state.tasks.get(command.get("task_id"))
+        if task is None:
+            return '<start_task_response status="404" status_text="Failed to find task"/>'
+        if task["status"] in ACTIVE_STATUSES:
+            return '<start_task_response status="400" status_text="Task is active already"/>'
+        # Scans finish immediately, the report has the configured number of results.
+        task["status"] = "Done"
+        report_id = str(uuid.uuid4())
+        state.reports[report_id] = {"task": command.get("task_id"), "status": "Done",
+                                    "modification_time": _timestamp()}
+        return (f'<start_task_response status="202" status_text="OK, request submitted">'
+                f'<report_id>{report_id}</report_id></start_task_response>')
+
+    def cmd_delete_task(self, state, command):
+        task_id = command.get("task_id")
+        state.tasks.pop(task_id, None)
+        for report_id in [i for i, r in state.reports.items() if r["task"] == task_id]:
+            del state.reports[report_id]
+        return '<delete_task_response status="200" status_text="OK"/>'
+
+    def cmd_delete_target(self, state, command):
+        state.targets.pop(command.get("target_id"), None)
+        return '<delete_target_response status="200" status_text="OK"/>'
+
+    def cmd_get_report_formats(self, state, command):
+        return ('<get_report_formats_response status="200" status_text="OK">'
+                f'<report_format id="{CSV_REPORT_FORMAT_ID}"><name>CSV Results</name></report_format>'
+                f'<report_format id="{XML_REPORT_FORMAT_ID}"><name>XML</name></report_format>'
+                '</get_report_formats_response>')
+
+    def cmd_get_reports(self, state, command):
+        report_id = command.get("report_id")
+        if report_id:
+            return self._get_report(state, command, report_id)
+        body = "".join(
+            f'<report id="{i}"><task id="{r["task"]}"/><modification_time>{r["modification_time"]}'
+            f'</modification_time><report id="{i}"><scan_run_status>{r["status"]}</scan_run_status>'
+            f'</report></report>'
+            for i, r in state.reports.items()
+        )
+        return f'<get_reports_response status="200" status_text="OK">{body}</get_reports_response>'
+
+    def _get_report(self, state, command, report_id):
+        if report_id not in state.reports:
+            return f'<get_reports_response status="404" status_text="Failed to find report {report_id}"/>'
+        if command.get("ignore_pagination") == "1":
+            first, rows = 1, -1
+        else:
+            first, rows = self._page(self._filter(command, "report_filter"))
+        return state.report_response(report_id, first, rows, command.get("format_id"))
+
+
+class FakeGvmd(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, state: FakeGvmdState, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), GmpHandler)
+        self.state = state
+        self._certificate_dir = tempfile.mkdtemp(prefix="fake-gvmd-")
+        cert_path, key_path = make_certificate(self._certificate_dir)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert_path, key_path)
+
+    def get_request(self):
+        sock, address = super().get_request()
+        # The handshake runs on the first recv, in the handler thread.
+        return self.context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False), address
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+def serve(ready, port_value, **state_kwargs):
+    """Process entry point, publishes the bound port through ``port_value``."""
+    server = FakeGvmd(FakeGvmdState(**state_kwargs))
+    port_value.value = server.port
+    ready.set()
+    server.serve_forever()
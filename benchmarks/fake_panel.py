@@ -0,0 +1,64 @@
+# fake_panel.py
+"""Local HTTP stand-in for the panel, accepting every upload and counting its bytes."""
+import http.server
+import json
+import threading
+import time
+
+
+class PanelHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        received = 0
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                received += len(self.rfile.read(size + 2)) - 2
+                if size == 0:
+                    break
+        else:
+            length = int(self.headers.get("Content-Length", 0))
+            received = len(self.rfile.read(length))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_received += received
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.path == "/target":
+            payload = {"success": True, "data": {"targets": []}}
+        else:
+            payload = {"success": True}
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakePanel(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), PanelHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_received = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+def serve(ready, port_value, latency: float = 0.0):
+    """Process entry point, publishes the bound port through ``port_value``."""
+    server = FakePanel(latency=latency)
+    port_value.value = server.server_address[1]
+    ready.set()
+    server.serve_forever()
@@ -0,0 +1,120 @@
+# parse_report.py
+"""Peak memory and CPU of parsing one report, CSV Results path vs streaming XML path.
+
+Both parsers run the agent's own code on the same synthetic report, read the
+way python-gvm reads a response, each in a fresh process so their peak RSS is
+comparable.
+
+    PYTHONPATH=. python -m benchmarks.parse_report --results 10000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks.fake_gvmd import CSV_REPORT_FORMAT_ID, FakeGvmdState, _uuid
+
+CHUNK_SIZE = 64 * 1024
+PARSERS = ("csv", "xml")
+
+
+def _chunks(path: str):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class _CsvGmp:
+    """Answers get_report like python-gvm does: whole response read, then parsed into a tree."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_report(self, report_id, **kwargs):
+        from gvm.transforms import EtreeTransform
+
+        response = bytearray()
+        for chunk in _chunks(self.path):
+            response += chunk
+        return EtreeTransform()(response.decode("utf-8"))
+
+
+class _XmlGmp:
+    """Answers get_report like a session of the report pool: the whole response as text."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_report(self, report_id, **kwargs):
+        response = bytearray()
+        for chunk in _chunks(self.path):
+            response += chunk
+        return response.decode("utf-8")
+
+
+def _parse(parser: str, path: str, results: int, queue):
+    from agent.openvas_wrapper import OpenVas
+
+    # Page size above the result count, one request like a single report page.
+    openvas = OpenVas(pool=object(), page_size=results + 1)
+    report_id = _uuid("report", 0, 0)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    if parser == "csv":
+        rows = openvas._iter_report_rows(_CsvGmp(path), report_id, CSV_REPORT_FORMAT_ID)
+    else:
+        rows = openvas._iter_xml_report_rows(report_id, _XmlGmp(path))
+    count = sum(1 for _ in rows)
+    queue.put({
+        "parser": parser,
+        "results": count,
+        "response_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+        "seconds": round(time.perf_counter() - started, 3),
+        "cpu_seconds": round(time.process_time() - cpu_started, 3),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_delta_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024, 1),
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--results", type=int, default=10000, help="results in the report")
+    parser.add_argument("--result-size", type=int, default=1024, help="approximate bytes per result")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    options = parser.parse_args(argv)
+
+    state = FakeGvmdState(tasks=1, reports_per_task=1, results_per_report=options.results,
+                          result_size=options.result_size)
+    report_id = _uuid("report", 0, 0)
+    context = multiprocessing.get_context("spawn")
+    summaries = []
+    with tempfile.TemporaryDirectory(prefix="bench-parse-") as workdir:
+        for name in PARSERS:
+            path = os.path.join(workdir, f"report.{name}")
+            format_id = CSV_REPORT_FORMAT_ID if name == "csv" else None
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(state.report_response(report_id, 1, -1, format_id))
+            queue = context.Queue()
+            process = context.Process(target=_parse, args=(name, path, options.results, queue))
+            process.start()
+            summaries.append(queue.get())
+            process.join()
+
+    if options.json:
+        print(json.dumps(summaries, indent=2))
+        return
+    print(f"{'parser':<8}{'results':>9}{'resp MB':>9}{'seconds':>9}{'cpu s':>8}{'peak MB':>9}")
+    for summary in summaries:
+        print(f"{summary['parser']:<8}{summary['results']:>9}{summary['response_mb']:>9}{summary['seconds']:>9}"
+              f"{summary['cpu_seconds']:>8}{summary['peak_rss_delta_mb']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# run.py
+"""Benchmarks of the scan submission and result export paths.
+
+Runs the agent code against a local fake gvmd (GMP over TLS) and a local panel
+stand-in, and reports throughput, p50/p99 latency and peak RSS per scenario.
+Every scenario runs in a fresh process so peak RSS is not inherited.
+
+    PYTHONPATH=. python -m benchmarks.run --tasks 50 --results-per-report 2000
+    PYTHONPATH=. python -m benchmarks.run --scenario export --gmp-latency-ms 5 --json
+    PYTHONPATH=. python -m benchmarks.run --scenario parity
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import fake_gvmd, fake_panel
+
+SCENARIOS = ("submit", "submit_batch", "export", "parity")
+
+
+def percentile(values, percent: float) -> float:
+    """Nearest-rank percentile, 0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _summary(name: str, operations: int, unit: str, elapsed: float, latencies, **extra) -> dict:
+    summary = {
+        "scenario": name,
+        "operations": operations,
+        "unit": unit,
+        "seconds": round(elapsed, 3),
+        "throughput": round(operations / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    summary.update(extra)
+    return summary
+
+
+def _configure(options, workdir: str):
+    """Point the agent at the fakes, must run before any agent module is imported."""
+    os.environ.update({
+        "GMP_HOST": "127.0.0.1",
+        "GMP_PORT": str(options.gmp_port),
+        "GMP_POOL_SIZE": str(options.concurrency),
+        "PANEL_URL": f"http://127.0.0.1:{options.panel_port}",
+        "PANEL_SPOOL_DIR": os.path.join(workdir, "spool"),
+        "EXPORT_STATE_DB": os.path.join(workdir, "agent-state.db"),
+        "TARGET_INDEX_DB": os.path.join(workdir, "agent-state.db"),
+        "REPORT_PAGE_SIZE": str(options.page_size),
+        "PANEL_RESULT_FORMAT": options.result_format,
+        "REPORT_WORKERS": str(options.report_workers),
+    })
+
+
+def run_submit(options) -> dict:
+    from agent.openvas_wrapper import OpenVas, GVMD_FULL_FAST_CONFIG
+
+    openvas = OpenVas()
+    targets = [f"10.2.{i // 250 % 250}.{i % 250 + 1}" for i in range(options.submissions)]
+
+    def submit(target):
+        started = time.perf_counter()
+        openvas.start_scan(target, GVMD_FULL_FAST_CONFIG)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(options.concurrency) as executor:
+        latencies = list(executor.map(submit, targets))
+    return _summary("submit", len(targets), "targets", time.perf_counter() - started, latencies)
+
+
+def run_submit_batch(options) -> dict:
+    from agent.openvas_wrapper import OpenVas, GVMD_FULL_FAST_CONFIG
+
+    openvas = OpenVas()
+    targets = [f"10.3.{i // 250 % 250}.{i % 250 + 1}" for i in range(options.submissions)]
+    batches = [targets[i:i + options.batch_size] for i in range(0, len(targets), options.batch_size)]
+    latencies = []
+    started = time.perf_counter()
+    for batch in batches:
+        call_started = time.perf_counter()
+        openvas.start_scans(batch, GVMD_FULL_FAST_CONFIG, options.group_size)
+        latencies.append(time.perf_counter() - call_started)
+    return _summary("submit_batch", len(targets), "targets", time.perf_counter() - started, latencies,
+                    batch_size=options.batch_size, group_size=options.group_size)
+
+
+def run_export(options) -> dict:
+    from agent import telemetry
+    from agent.export_state import ExportState
+    from agent.uploader import get_uploader
+
+    openvas = telemetry.openvas_telemetry
+    uploader = get_uploader()
+    state_dir = os.path.dirname(os.environ["EXPORT_STATE_DB"])
+    latencies = []
+    rows = 0
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for cycle in range(options.cycles):
+        # A fresh watermark per cycle, so every cycle exports every report.
+        state = ExportState(os.path.join(state_dir, f"export-{cycle}.db"))
+        cycle_started = time.perf_counter()
+        rows += telemetry.send_scan_telemetry(state)
+        latencies.append(time.perf_counter() - cycle_started)
+        state.close()
+    elapsed = time.perf_counter() - started
+    # CPU spent in the agent process itself, parsing in report workers is not counted.
+    cpu_seconds = round(time.process_time() - cpu_started, 3)
+    if openvas.report_workers is not None:
+        # Idle workers would otherwise keep this scenario process from exiting.
+        openvas.report_workers.shutdown()
+    return _summary("export", rows, "rows", elapsed, latencies, cycles=options.cycles,
+                    spooled=uploader.spool_depth(), agent_cpu_seconds=cpu_seconds,
+                    report_workers=options.report_workers)
+
+
+def run_parity(options) -> dict:
+    """Fetch every report with both parsers and count the rows whose payload differs."""
+    from agent.openvas_wrapper import OpenVas
+
+    openvas = OpenVas()
+    rows = mismatches = 0
+    first_mismatch = None
+    latencies = []
+    started = time.perf_counter()
+    with openvas.pool.session() as gmp:
+        report_format_id = openvas._get_report_format_id(gmp, "CSV Results")
+        report_ids = [report.attrib.get("id") for report in
+                      gmp.get_reports(details=False, filter_string="rows=-1 first=1").xpath("report")]
+        for report_id in report_ids:
+            report_started = time.perf_counter()
+            csv_rows = list(openvas._iter_report_rows(gmp, report_id, report_format_id))
+            xml_rows = [record.to_dict() for record in openvas._iter_xml_report_rows(report_id)]
+            for csv_row, xml_row in itertools.zip_longest(csv_rows, xml_rows):
+                rows += 1
+                if csv_row != xml_row:
+                    mismatches += 1
+                    if first_mismatch is None:
+                        first_mismatch = {"csv": csv_row, "xml": xml_row}
+            latencies.append(time.perf_counter() - report_started)
+    return _summary("parity", rows, "rows", time.perf_counter() - started, latencies,
+                    mismatches=mismatches, first_mismatch=first_mismatch)
+
+
+RUNNERS = {"submit": run_submit, "submit_batch": run_submit_batch, "export": run_export, "parity": run_parity}
+
+
+def _run_scenario(name: str, options, results):
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    # Keep the agent's progress logging and prints out of the measurements.
+    logging.disable(logging.INFO)
+    try:
+        _configure(options, workdir)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            summary = RUNNERS[name](options)
+        results.put(summary)
+    except Exception as e:
+        results.put({"scenario": name, "error": repr(e)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _start(context, target, **kwargs):
+    ready = context.Event()
+    port = context.Value("i", 0)
+    process = context.Process(target=target, args=(ready, port), kwargs=kwargs, daemon=True)
+    process.start()
+    if not ready.wait(30):
+        raise RuntimeError(f"{target.__module__} did not start")
+    return process, port.value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument("--tasks", type=int, default=20, help="finished tasks in the fake gvmd")
+    parser.add_argument("--reports-per-task", type=int, default=1)
+    parser.add_argument("--results-per-report", type=int, default=500)
+    parser.add_argument("--result-size", type=int, default=1024, help="approximate bytes per CSV result")
+    parser.add_argument("--gmp-latency-ms", type=float, default=0.0, help="delay before every GMP response")
+    parser.add_argument("--panel-latency-ms", type=float, default=0.0, help="delay before every panel response")
+    parser.add_argument("--submissions", type=int, default=200, help="targets submitted by the submit scenarios")
+    parser.add_argument("--concurrency", type=int, default=4, help="submitting threads and GMP pool size")
+    parser.add_argument("--batch-size", type=int, default=50, help="targets per start_scans call")
+    parser.add_argument("--group-size", type=int, default=1, help="hosts per gvmd target in start_scans")
+    parser.add_argument("--page-size", type=int, default=500, help="REPORT_PAGE_SIZE of the agent")
+    parser.add_argument("--result-format", default="json", choices=("json", "ndjson", "msgpack"))
+    parser.add_argument("--report-workers", type=int, default=0,
+                        help="REPORT_WORKERS of the agent, 0 parses in the exporting thread")
+    parser.add_argument("--cycles", type=int, default=3, help="export cycles")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    options = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    summaries = []
+    for name in options.scenario or SCENARIOS:
+        # Fresh fakes per scenario, submissions would otherwise add reports to the export.
+        gvmd, options.gmp_port = _start(
+            context, fake_gvmd.serve, tasks=options.tasks, reports_per_task=options.reports_per_task,
+            results_per_report=options.results_per_report, result_size=options.result_size,
+            latency=options.gmp_latency_ms / 1000,
+        )
+        panel, options.panel_port = _start(context, fake_panel.serve, latency=options.panel_latency_ms / 1000)
+        try:
+            results = context.Queue()
+            process = context.Process(target=_run_scenario, args=(name, options, results))
+            process.start()
+            summaries.append(results.get())
+            process.join()
+        finally:
+            gvmd.terminate()
+            panel.terminate()
+
+    if options.json:
+        print(json.dumps(summaries, indent=2))
+        return
+    print(f"{'scenario':<14}{'ops':>9}{'seconds':>10}{'ops/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for summary in summaries:
+        if "error" in summary:
+            print(f"{summary['scenario']:<14} failed: {summary['error']}")
+            continue
+        print(f"{summary['scenario']:<14}{summary['operations']:>9}{summary['seconds']:>10}"
+              f"{summary['throughput']:>11}{summary['p50_ms']:>10}{summary['p99_ms']:>10}"
+              f"{summary['peak_rss_mb']:>10}")
+        if summary.get("mismatches"):
+            print(f"{'':<14}{summary['mismatches']} rows differ, first: {summary['first_mismatch']}")
+
+
+if __name__ == "__main__":
+    main()
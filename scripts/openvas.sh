@@ -14,6 +14,15 @@ done
 if  ! grep -qis  mosquitto /etc/openvas/openvas.conf; then  
 	echo "mqtt_server_uri = mosquitto:1883" |  tee -a /etc/openvas/openvas.conf
 fi
+# Scanner parallelism chosen by /scripts/tune.sh
+SCANNER_ARGS=""
+TUNING_FILE=${TUNING_FILE:-/run/agent-tuning.env}
+if [ -f "$TUNING_FILE" ]; then
+	. "$TUNING_FILE"
+	sed -i '/^max_hosts\|^max_checks/d' /etc/openvas/openvas.conf
+	echo -e "max_hosts = $SCANNER_MAX_HOSTS\nmax_checks = $SCANNER_MAX_CHECKS" >> /etc/openvas/openvas.conf
+	SCANNER_ARGS="--max-scans $SCANNER_MAX_SCANS --min-free-mem-scan-queue $SCANNER_MIN_FREE_MEM_MB"
+fi
 echo "Starting Open Scanner Protocol daemon for OpenVAS..."
 /usr/local/bin/ospd-openvas --unix-socket /var/run/ospd/ospd-openvas.sock \
 	--pid-file /run/ospd/ospd-openvas.pid \
@@ -23,5 +32,6 @@ echo "Starting Open Scanner Protocol daemon for OpenVAS..."
 	--mqtt-broker-address mosquitto \
 	--mqtt-broker-port 1883 \
 	--notus-feed-dir /var/lib/notus/advisories \
+	$SCANNER_ARGS \
 	-f
 
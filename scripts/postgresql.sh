@@ -47,6 +47,20 @@ if [ ! -f "/setup" ]; then
 	touch /setup
 fi
 
+# Memory settings chosen by /scripts/tune.sh, rewritten on every start.
+TUNING_FILE=${TUNING_FILE:-/run/agent-tuning.env}
+if [ -f "$TUNING_FILE" ]; then
+	. "$TUNING_FILE"
+	echo "shared_buffers = '$PG_SHARED_BUFFERS'" > /data/database/agent-tuning.conf
+	echo "effective_cache_size = '$PG_EFFECTIVE_CACHE_SIZE'" >> /data/database/agent-tuning.conf
+	echo "work_mem = '$PG_WORK_MEM'" >> /data/database/agent-tuning.conf
+	echo "maintenance_work_mem = '$PG_MAINTENANCE_WORK_MEM'" >> /data/database/agent-tuning.conf
+	chown postgres:postgres /data/database/agent-tuning.conf
+fi
+if ! grep -qs "agent-tuning.conf" /data/database/postgresql.conf; then
+	echo "include_if_exists = 'agent-tuning.conf'" >> /data/database/postgresql.conf
+fi
+
 PGFAIL=0
 PGUPFAIL=0
 echo "Starting PostgreSQL..."
@@ -1,11 +1,17 @@
 #!/usr/bin/env bash
 rm /run/redisup
 set -Eeuo pipefail
+# Settings chosen by /scripts/tune.sh, they already include values pinned in the environment.
+TUNING_FILE=${TUNING_FILE:-/run/agent-tuning.env}
+if [ -f "$TUNING_FILE" ]; then
+	. "$TUNING_FILE"
+fi
 REDISDBS=${REDISDBS:-512}
+REDIS_MAXCLIENTS=${REDIS_MAXCLIENTS:-4096}
 
 # Fire up redis
 redis-server --unixsocket /run/redis/redis.sock --unixsocketperm 700 \
-             --timeout 0 --databases $REDISDBS --maxclients 4096 --daemonize yes \
+             --timeout 0 --databases $REDISDBS --maxclients $REDIS_MAXCLIENTS --daemonize yes \
              --port 6379 --bind 127.0.0.1 --loglevel warning --logfile /data/var-log/gvm/redis-server.log
 
 echo "Wait for redis socket to be created..."
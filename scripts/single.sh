@@ -13,7 +13,17 @@ USERNAME=${USERNAME:-admin}
 PASSWORD=${PASSWORD:-admin}
 RELAYHOST=${RELAYHOST:-172.17.0.1}
 SMTPPORT=${SMTPPORT:-25}
+# Settings chosen by /scripts/tune.sh, they already include values pinned in the environment.
+TUNING_FILE=${TUNING_FILE:-/run/agent-tuning.env}
+if [ -f "$TUNING_FILE" ]; then
+	. "$TUNING_FILE"
+fi
 REDISDBS=${REDISDBS:-512}
+REDIS_MAXCLIENTS=${REDIS_MAXCLIENTS:-4096}
+SCANNER_MAX_SCANS=${SCANNER_MAX_SCANS:-0}
+SCANNER_MAX_HOSTS=${SCANNER_MAX_HOSTS:-30}
+SCANNER_MAX_CHECKS=${SCANNER_MAX_CHECKS:-10}
+SCANNER_MIN_FREE_MEM_MB=${SCANNER_MIN_FREE_MEM_MB:-0}
 QUIET=${QUIET:-false}
 # use this to rebuild the DB from scratch instead of using the one in the image.
 NEWDB=${NEWDB:-false}
@@ -56,7 +66,7 @@ fi
 
 # Fire up redis
 redis-server --unixsocket /run/redis/redis.sock --unixsocketperm 700 \
-             --timeout 0 --databases $REDISDBS --maxclients 4096 --daemonize yes \
+             --timeout 0 --databases $REDISDBS --maxclients $REDIS_MAXCLIENTS --daemonize yes \
              --port 6379 --bind 127.0.0.1 --loglevel warning --logfile /data/var-log/gvm/redis-server.log
 
 echo "Wait for redis socket to be created..."
@@ -93,6 +103,17 @@ if [ ! -f "/setup" ]; then
         echo "log_timezone = 'Etc/UTC'" >> /data/database/postgresql.conf
 	chown postgres:postgres -R /data/database
 fi
+# Memory settings chosen by /scripts/tune.sh, rewritten on every start.
+if [ -n "${PG_SHARED_BUFFERS:-}" ]; then
+	echo "shared_buffers = '$PG_SHARED_BUFFERS'" > /data/database/agent-tuning.conf
+	echo "effective_cache_size = '$PG_EFFECTIVE_CACHE_SIZE'" >> /data/database/agent-tuning.conf
+	echo "work_mem = '$PG_WORK_MEM'" >> /data/database/agent-tuning.conf
+	echo "maintenance_work_mem = '$PG_MAINTENANCE_WORK_MEM'" >> /data/database/agent-tuning.conf
+	chown postgres:postgres /data/database/agent-tuning.conf
+fi
+if ! grep -qs "agent-tuning.conf" /data/database/postgresql.conf; then
+	echo "include_if_exists = 'agent-tuning.conf'" >> /data/database/postgresql.conf
+fi
 PGFAIL=0
 PGUPFAIL=0
 echo "Starting PostgreSQL..."
@@ -423,7 +444,9 @@ fi
 
 # Create openvas.conf 
 echo "table_driven_lsc = yes
-mqtt_server_uri = tcp://localhost:1883" > /etc/openvas/openvas.conf
+mqtt_server_uri = tcp://localhost:1883
+max_hosts = $SCANNER_MAX_HOSTS
+max_checks = $SCANNER_MAX_CHECKS" > /etc/openvas/openvas.conf
 
 echo "Starting Open Scanner Protocol daemon for OpenVAS..."
 /usr/local/bin/ospd-openvas --unix-socket /var/run/ospd/ospd-openvas.sock \
@@ -433,7 +456,9 @@ echo "Starting Open Scanner Protocol daemon for OpenVAS..."
 	--socket-mode 0o770 \
 	--mqtt-broker-address localhost \
 	--mqtt-broker-port 1883 \
-	--notus-feed-dir /var/lib/notus/advisories
+	--notus-feed-dir /var/lib/notus/advisories \
+	--max-scans $SCANNER_MAX_SCANS \
+	--min-free-mem-scan-queue $SCANNER_MIN_FREE_MEM_MB
 
 # wait for ospd to start by looking for the socket creation.
 #while  [ ! -S /var/run/ospd/ospd-openvas.sock]; do
@@ -13,6 +13,9 @@ else
         find /run -iname "*.pid" -exec rm -f {} \;
 fi
 
+# Sized for this host on every start, cgroup limits may have changed since the last one.
+/scripts/tune.sh
+
 echo "Choosing container start method from:"
 echo "$@"
 # We'll use this later to know how to check container health
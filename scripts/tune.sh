@@ -0,0 +1,11 @@
+#!/usr/bin/env bash
+# Derive redis, Postgres and scanner settings from the cores, RAM and cgroup
+# limits of this container. Runs once per container start, the service scripts
+# source the result. Any setting can be pinned by setting it in the environment.
+TUNING_FILE=${TUNING_FILE:-/run/agent-tuning.env}
+
+echo "Tuning resources for this host..."
+if ! PYTHONPATH=/app /venv/bin/python3.11 -m agent.tuning --output "$TUNING_FILE"; then
+	echo "Tuning failed, the services start with their built-in defaults."
+	rm -f "$TUNING_FILE"
+fi
@@ -0,0 +1,172 @@
+import os
+
+import pytest
+
+from agent.export_state import ExportState, StateDb, get_state_db
+from agent.pipeline import PendingDiscoveries
+from agent.scheduler import PendingTargets
+from agent.target_index import TargetIndex
+
+
+def test_stores_share_one_connection_per_file(tmp_path):
+    path = str(tmp_path / "state" / "agent-state.db")
+    stores = [ExportState(path), TargetIndex(path), PendingTargets(path), PendingDiscoveries(path)]
+
+    assert {id(store.db) for store in stores} == {id(get_state_db(path))}
+    # Creating the stores does not touch the disk.
+    assert not os.path.exists(path)
+
+    with stores[0].db.connection() as db:
+        tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == {"shipped_reports", "shipped_results", "reusable_targets", "reusable_tasks",
+                      "pending_targets", "pending_discoveries"}
+
+
+def test_schema_added_after_the_file_was_opened(tmp_path):
+    db = StateDb(str(tmp_path / "agent-state.db"))
+    db.add_schema("CREATE TABLE IF NOT EXISTS a (x INTEGER);")
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO a VALUES (1)")
+
+    db.add_schema("CREATE TABLE IF NOT EXISTS b (y INTEGER);")
+    with db.connection() as conn:
+        assert conn.execute("SELECT count(*) FROM b").fetchone() == (0,)
+
+
+def test_closed_db_reopens_on_next_statement(tmp_path):
+    path = str(tmp_path / "agent-state.db")
+    index = TargetIndex(path)
+    index.add_target(["10.0.0.5"], "port-list", "target-1")
+
+    index.close()
+
+    assert index.get_target(["10.0.0.5"], "port-list") == "target-1"
+
+
+REPORT = "report-1"
+
+
+def row(result_id, timestamp="2024-05-02T09:38:12Z"):
+    return {"Result ID": result_id, "Timestamp": timestamp, "report_id": REPORT}
+
+
+def test_committed_batch_moves_the_watermark(tmp_path):
+    state = ExportState(str(tmp_path / "agent-state.db"))
+    batch = state.begin()
+    batch.add_report(REPORT, "2024-05-02T10:00:00Z", "Done")
+    assert batch.add_result(row("r1")) is True
+    assert batch.add_result(row("r1")) is False
+    batch.commit()
+
+    batch = state.begin()
+    assert batch.skip_report(REPORT, "2024-05-02T10:00:00Z") is True
+    # A report modified since is looked at again, but only changed results are new.
+    assert batch.skip_report(REPORT, "2024-05-02T11:00:00Z") is False
+    assert batch.add_result(row("r1")) is False
+    assert batch.add_result(row("r1", "2024-05-02T11:00:00Z")) is True
+
+
+def test_uncommitted_batch_leaves_the_watermark_alone(tmp_path):
+    state = ExportState(str(tmp_path / "agent-state.db"))
+    batch = state.begin()
+    batch.add_report(REPORT, "2024-05-02T10:00:00Z", "Done")
+    batch.add_result(row("r1"))
+    batch.discard()
+    batch.commit()
+
+    # Neither a discarded nor an abandoned batch marks anything as shipped.
+    state.begin().add_report(REPORT, "2024-05-02T10:00:00Z", "Done")
+    batch = state.begin()
+    assert batch.skip_report(REPORT, "2024-05-02T10:00:00Z") is False
+    assert batch.add_result(row("r1")) is True
+
+
+def test_running_report_is_not_skipped(tmp_path):
+    state = ExportState(str(tmp_path / "agent-state.db"))
+    batch = state.begin()
+    batch.add_report(REPORT, "2024-05-02T10:00:00Z", "Running")
+    batch.add_result(row("r1"))
+    batch.commit()
+
+    batch = state.begin()
+    assert batch.skip_report(REPORT, "2024-05-02T10:00:00Z") is False
+    assert batch.add_result(row("r1")) is False
+
+
+def test_forget_report_drops_its_watermark(tmp_path):
+    state = ExportState(str(tmp_path / "agent-state.db"))
+    batch = state.begin()
+    batch.add_report(REPORT, "2024-05-02T10:00:00Z", "Done")
+    batch.add_result(row("r1"))
+    batch.commit()
+
+    state.forget_report(REPORT)
+
+    batch = state.begin()
+    assert batch.skip_report(REPORT, "2024-05-02T10:00:00Z") is False
+    assert batch.add_result(row("r1")) is True
+
+
+class FakeUploader:
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.payloads = []
+
+    def set_agent_headers(self, headers):
+        pass
+
+    def upload_stream(self, name, chunks, content_type):
+        self.payloads.append(b"".join(chunks))
+        return self.accept
+
+    def replay(self):
+        return True
+
+
+class FakeOpenVas:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def iter_results(self, batch):
+        batch.add_report(REPORT, "2024-05-02T10:00:00Z", "Done")
+        for result_id in ("r1", "r2"):
+            if self.fail and result_id == "r2":
+                raise TimeoutError("gvmd timed out")
+            if batch.add_result(row(result_id)):
+                yield row(result_id)
+
+
+@pytest.fixture
+def export(monkeypatch):
+    from agent import telemetry
+
+    monkeypatch.setattr(telemetry, "get_host_name", lambda: "agent-1")
+
+    def run(state, uploader, openvas):
+        monkeypatch.setattr(telemetry, "get_uploader", lambda: uploader)
+        monkeypatch.setattr(telemetry, "openvas_telemetry", openvas)
+        return telemetry.send_scan_telemetry(state)
+
+    return run
+
+
+def test_export_commits_after_the_upload(tmp_path, export):
+    state = ExportState(str(tmp_path / "agent-state.db"))
+    uploader = FakeUploader()
+
+    assert export(state, uploader, FakeOpenVas()) == 2
+    assert export(state, uploader, FakeOpenVas()) == 0
+    assert len(uploader.payloads) == 1
+
+
+@pytest.mark.parametrize("uploader, openvas", [(FakeUploader(accept=False), FakeOpenVas()),
+                                               (FakeUploader(), FakeOpenVas(fail=True))],
+                         ids=["spool full", "producer failed"])
+def test_failed_export_is_not_committed(tmp_path, export, uploader, openvas):
+    state = ExportState(str(tmp_path / "agent-state.db"))
+
+    assert export(state, uploader, openvas) == 0
+
+    batch = state.begin()
+    assert batch.skip_report(REPORT, "2024-05-02T10:00:00Z") is False
+    assert batch.add_result(row("r1")) is True
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+from gvm.errors import GvmError, GvmResponseError
+
+from agent import gmp_pool
+from agent.gmp_pool import GmpSessionPool
+
+
+class FakeGmp:
+    """Answers every command with its name, raises the queued errors first."""
+
+    def __init__(self, number):
+        self.number = number
+        self.errors = []
+        self.commands = []
+
+    def is_connected(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+    def get_version(self):
+        return "22.4"
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append(name)
+            if self.errors:
+                raise self.errors.pop(0)
+            return (name, self.number)
+
+        return command
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    opened = []
+
+    def fake_open(session):
+        session.gmp = FakeGmp(len(opened) + 1)
+        session.last_used = time.monotonic()
+        opened.append(session.gmp)
+
+    monkeypatch.setattr(gmp_pool.GmpSession, "open", fake_open)
+    pool = GmpSessionPool("admin", "secret", size=1)
+    pool.opened = opened
+    return pool
+
+
+def idle_gmp(pool) -> FakeGmp:
+    with pool.session() as gmp:
+        gmp.get_tasks()
+    return pool.opened[-1]
+
+
+@pytest.mark.parametrize("error", [GvmError("Remote closed the connection"), BrokenPipeError(32, "Broken pipe")])
+def test_stale_reused_session_reconnects_once(pool, error):
+    idle_gmp(pool).errors.append(error)
+
+    with pool.session() as gmp:
+        assert gmp.get_tasks() == ("get_tasks", 2)
+        assert gmp.get_reports() == ("get_reports", 2)
+
+    assert len(pool.opened) == 2
+    # The fresh session went back to the pool.
+    with pool.session() as gmp:
+        assert gmp.get_tasks() == ("get_tasks", 2)
+
+
+def test_gvmd_error_answer_is_not_retried(pool):
+    idle_gmp(pool).errors.append(GvmResponseError("400", "Bogus filter"))
+
+    with pytest.raises(GvmResponseError):
+        with pool.session() as gmp:
+            gmp.get_tasks(filter_string="bogus")
+
+    assert len(pool.opened) == 1
+
+
+def test_only_the_first_command_is_retried(pool):
+    stale = idle_gmp(pool)
+
+    with pytest.raises(GvmError):
+        with pool.session() as gmp:
+            gmp.get_tasks()
+            stale.errors.append(GvmError("Remote closed the connection"))
+            gmp.get_reports()
+
+    assert len(pool.opened) == 1
+
+
+def test_new_session_errors_are_not_retried(pool):
+    with pytest.raises(OSError):
+        with pool.session() as gmp:
+            pool.opened[-1].errors.append(ConnectionResetError(104, "Connection reset by peer"))
+            gmp.get_tasks()
+
+    assert len(pool.opened) == 1
@@ -0,0 +1,60 @@
+from agent.openvas_wrapper import ScanProfile
+from agent.pipeline import PendingDiscoveries, ScanPipeline
+
+
+class FakePoller:
+    def __init__(self):
+        self.listeners = []
+
+    def add_finished_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_finished_listener(self, callback):
+        self.listeners.remove(callback)
+
+
+class FakeOpenVas:
+    def __init__(self):
+        self.started = 0
+
+    def start_scans(self, targets, config_id, group_size, port_list_id, scanner_id):
+        self.started += 1
+        return {target: f"discovery-{self.started}" for target in targets}
+
+    def get_open_port_hosts(self, task_id):
+        return ["10.0.0.5"]
+
+
+def make_pipeline(tmp_path, poller):
+    submitted = []
+    pipeline = ScanPipeline(FakeOpenVas(), submit=lambda *args: submitted.append(args) or True,
+                            task_poller=poller, pending=PendingDiscoveries(str(tmp_path / "state.db")))
+    pipeline.start = lambda: None
+    return pipeline, submitted
+
+
+def test_pipeline_listens_only_while_discoveries_are_pending(tmp_path):
+    poller = FakePoller()
+    pipeline, submitted = make_pipeline(tmp_path, poller)
+    profile = ScanProfile("full-config")
+
+    pipeline.start_discovery(["10.0.0.0/24"], profile, 5)
+    pipeline.start_discovery(["10.0.1.0/24"], profile, 5)
+    assert poller.listeners == [pipeline._task_finished]
+
+    pipeline.finish("discovery-1", "Done")
+    assert poller.listeners == [pipeline._task_finished]
+    pipeline.finish("discovery-2", "Stopped")
+    assert poller.listeners == []
+    assert submitted == [("10.0.0.5", 5, profile)]
+
+
+def test_pipeline_listens_for_discoveries_pending_before_a_restart(tmp_path):
+    pipeline, _ = make_pipeline(tmp_path, FakePoller())
+    pipeline.start_discovery(["10.0.0.0/24"], ScanProfile("full-config"), 5)
+    pipeline.store.close()
+
+    poller = FakePoller()
+    restarted, _ = make_pipeline(tmp_path, poller)
+    assert restarted.status()["pending_discoveries"] == ["discovery-1"]
+    assert poller.listeners == [restarted._task_finished]
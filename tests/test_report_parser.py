@@ -0,0 +1,124 @@
+import os
+import pickle
+
+import pytest
+from gvm.errors import GvmError, GvmResponseError
+
+from agent.report_parser import ResultRecord, fetch_report_results, iter_xml_results
+from agent.serialization import dumps
+
+REPORT_ID = "5a3c9f1e-2b7d-4c61-9e0a-8f4d2c1b6a70"
+
+with open(os.path.join(os.path.dirname(__file__), "data", "report.xml"), encoding="utf-8") as f:
+    SAMPLE_REPORT = f.read()
+
+# The first result of data/report.xml as gvmd's "CSV Results" format exports it.
+FIRST_RESULT = {
+    "IP": "10.0.0.5",
+    "Hostname": "web.example.org",
+    "Port": "443",
+    "Port Protocol": "tcp",
+    "CVSS": "7.5",
+    "Severity": "High",
+    "QoD": "80",
+    "Solution Type": "VendorFix",
+    "NVT Name": "OpenSSL: Denial of Service Vulnerability (CVE-2023-0286)",
+    "Summary": "OpenSSL is prone to a type confusion vulnerability.",
+    "Specific Result": "Installed version: 3.0.2\nFixed version:     3.0.8\nInstallation\n"
+                       "path / port:       443/tcp",
+    "NVT OID": "1.3.6.1.4.1.25623.1.0.104552",
+    "CVEs": "CVE-2023-0286",
+    "Task ID": "0d8f7e6c-5b4a-4392-8170-6f5e4d3c2b1a",
+    "Task Name": "10.0.0.5",
+    "Timestamp": "2024-05-02T09:38:12Z",
+    "Result ID": "b1f6a8c2-7d3e-4f5a-9b0c-1d2e3f4a5b6c",
+    "Impact": "An attacker may read memory contents or enact a denial of service.",
+    "Solution": "Update to version 3.0.8 or later.",
+    "Affected Software/OS": "OpenSSL version 3.0.0 through 3.0.7.",
+    "Vulnerability Insight": "There is a type confusion vulnerability relating to X.400 address processing.",
+    "Vulnerability Detection Method": "Checks if a vulnerable version is present on the target host.",
+    "Product Detection Result": "cpe:/a:openssl:openssl:3.0.2 (OID: 1.3.6.1.4.1.25623.1.0.806723)",
+    "CERTs": "CERT-Bund: WID-SEC-2023-0319,DFN-CERT: DFN-CERT-2023-0278,DFN-CERT: DFN-CERT-2023-0281",
+    "Other References": "https://www.openssl.org/news/secadv/20230207.txt",
+    "report_id": REPORT_ID,
+}
+
+
+def _chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_sample_report_matches_csv_export():
+    records = list(iter_xml_results([SAMPLE_REPORT], REPORT_ID))
+
+    assert len(records) == 2
+    assert records[0].to_dict() == FIRST_RESULT
+    second = records[1].to_dict()
+    # No hostname, no product detection and a port without number, like "general/tcp" in the CSV.
+    assert "Hostname" not in second and "Product Detection Result" not in second and "Port" not in second
+    assert second["Port Protocol"] == "tcp"
+    assert second["CVSS"] == "2.6" and second["Severity"] == "Low"
+    assert second["Other References"] == ("https://datatracker.ietf.org/doc/html/rfc1323,"
+                                          "https://datatracker.ietf.org/doc/html/rfc7323")
+
+
+@pytest.mark.parametrize("size", [1, 97, 4096])
+def test_chunk_boundaries_do_not_change_records(size):
+    records = [record.to_dict() for record in iter_xml_results(_chunks(SAMPLE_REPORT, size), REPORT_ID)]
+
+    assert records == [record.to_dict() for record in iter_xml_results([SAMPLE_REPORT], REPORT_ID)]
+
+
+def test_bytes_chunks_are_accepted():
+    records = list(iter_xml_results(_chunks(SAMPLE_REPORT.encode("utf-8"), 512), REPORT_ID))
+
+    assert records[0].to_dict() == FIRST_RESULT
+
+
+def test_error_status_raises():
+    response = '<get_reports_response status="404" status_text="Failed to find report x"/>'
+
+    with pytest.raises(GvmResponseError):
+        list(iter_xml_results([response], REPORT_ID))
+
+
+def test_truncated_response_raises():
+    with pytest.raises(GvmError):
+        list(iter_xml_results([SAMPLE_REPORT[:len(SAMPLE_REPORT) // 2]], REPORT_ID))
+
+
+def test_record_behaves_like_a_csv_row():
+    record = next(iter_xml_results([SAMPLE_REPORT], REPORT_ID))
+
+    assert record.get("Result ID") == FIRST_RESULT["Result ID"]
+    assert record.get("BIDs") is None
+    assert record.get("BIDs", "") == ""
+    assert dict(record.items()) == FIRST_RESULT
+    assert not hasattr(record, "__dict__")
+
+
+def test_record_pickles_and_serializes():
+    record = next(iter_xml_results([SAMPLE_REPORT], REPORT_ID))
+
+    assert pickle.loads(pickle.dumps(record)).to_dict() == FIRST_RESULT
+    assert dumps([record]) == dumps([FIRST_RESULT])
+
+
+def test_fetch_report_results_uses_public_get_report():
+    class RawGmp:
+        """A report pool session, python-gvm without a transform answers with the response text."""
+
+        def __init__(self):
+            self.calls = []
+
+        def get_report(self, report_id, **kwargs):
+            self.calls.append((report_id, kwargs))
+            return SAMPLE_REPORT
+
+    gmp = RawGmp()
+    records = list(fetch_report_results(gmp, REPORT_ID, "rows=500 first=1"))
+
+    assert gmp.calls == [(REPORT_ID, {"filter_string": "rows=500 first=1", "details": True})]
+    assert [record.get("Result ID") for record in records] == [
+        "b1f6a8c2-7d3e-4f5a-9b0c-1d2e3f4a5b6c", "d3b8c0e4-9f5a-4b7c-9d2e-3f4a5b6c7d8e"]
+    assert isinstance(records[0], ResultRecord)
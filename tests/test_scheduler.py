@@ -0,0 +1,185 @@
+import collections
+
+import psutil
+import pytest
+
+from agent.openvas_wrapper import ScanProfile
+from agent.scheduler import CpuSampler, PendingTargets, ScanScheduler
+
+PROFILE = ScanProfile("full-config")
+
+
+class FakeOpenVas:
+    """Starts every target except those in ``refuse``, raises with ``error``."""
+
+    def __init__(self, active=0):
+        self.active = active
+        self.refuse = set()
+        self.error = None
+        self.started = []
+
+    def check_is_vas_online(self):
+        return True
+
+    def active_scans_count(self):
+        return self.active
+
+    def start_scans(self, targets, config_id, port_list_id=None, scanner_id=None):
+        if self.error is not None:
+            raise self.error
+        started = {target: f"task-{target}" for target in targets if target not in self.refuse}
+        self.started.extend(started)
+        return started
+
+
+class FakePanel:
+    def __init__(self, targets=()):
+        self.targets = list(targets)
+        self.requests = []
+
+    def __call__(self, active, docker_type, limit):
+        self.requests.append(limit)
+        targets, self.targets = self.targets[:limit], self.targets[limit:]
+        return {"success": True, "data": {"targets": targets}}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "agent-state.db")
+
+
+def make_scheduler(openvas, db_path, panel=None, max_concurrent_scans=2, max_attempts=3):
+    return ScanScheduler(openvas, fetch_targets=panel or FakePanel(), scan_config_id=PROFILE.config_id,
+                         max_concurrent_scans=max_concurrent_scans, max_cpu_percent=101, max_memory_percent=101,
+                         max_attempts=max_attempts, pending=PendingTargets(db_path))
+
+
+def test_admit_starts_queued_targets_by_priority(db_path):
+    openvas = FakeOpenVas()
+    scheduler = make_scheduler(openvas, db_path)
+    scheduler.submit("10.0.0.3", 200)
+    scheduler.submit("10.0.0.1", 100)
+    scheduler.submit("10.0.0.2", 100)
+
+    scheduler.admit()
+
+    assert openvas.started == ["10.0.0.1", "10.0.0.2"]
+    assert scheduler.queue_depth() == 1
+    assert [target for _, _, target, _ in scheduler.pending.load()] == ["10.0.0.3"]
+
+
+def test_admit_pulls_the_missing_targets_from_the_panel(db_path):
+    openvas = FakeOpenVas(active=1)
+    panel = FakePanel(["10.0.0.7", "10.0.0.8"])
+    scheduler = make_scheduler(openvas, db_path, panel, max_concurrent_scans=3)
+
+    scheduler.admit()
+
+    assert panel.requests == [2]
+    assert openvas.started == ["10.0.0.7", "10.0.0.8"]
+
+
+def test_full_scanner_admits_nothing(db_path):
+    openvas = FakeOpenVas(active=2)
+    panel = FakePanel(["10.0.0.7"])
+    scheduler = make_scheduler(openvas, db_path, panel)
+
+    scheduler.admit()
+
+    assert panel.requests == [] and openvas.started == []
+    assert scheduler.status()["decisions"][-1]["decision"] == "full"
+
+
+def test_refused_target_is_retried_then_given_up(db_path):
+    openvas = FakeOpenVas()
+    openvas.refuse.add("10.0.0.1")
+    scheduler = make_scheduler(openvas, db_path, max_attempts=3)
+    scheduler.submit("10.0.0.1")
+
+    scheduler.admit()
+    scheduler.admit()
+    assert scheduler.queue_depth() == 1
+    assert scheduler.status()["decisions"][-1]["retried"] == ["10.0.0.1"]
+
+    scheduler.admit()
+    assert scheduler.queue_depth() == 0
+    assert scheduler.status()["decisions"][-1]["failed"] == ["10.0.0.1"]
+    assert scheduler.pending.load() == []
+
+
+def test_start_error_requeues_the_targets(db_path):
+    openvas = FakeOpenVas()
+    openvas.error = ConnectionError("gvmd went away")
+    scheduler = make_scheduler(openvas, db_path)
+    scheduler.submit("10.0.0.1")
+
+    with pytest.raises(ConnectionError):
+        scheduler.admit()
+
+    assert scheduler.queue_depth() == 1
+    openvas.error = None
+    scheduler.admit()
+    assert openvas.started == ["10.0.0.1"]
+    assert scheduler.pending.load() == []
+
+
+def test_started_target_resets_its_attempts(db_path):
+    openvas = FakeOpenVas()
+    openvas.refuse.add("10.0.0.1")
+    scheduler = make_scheduler(openvas, db_path, max_attempts=2)
+    scheduler.submit("10.0.0.1")
+    scheduler.admit()
+
+    openvas.refuse.clear()
+    scheduler.admit()
+    assert openvas.started == ["10.0.0.1"]
+
+    # A later submission of the same target gets its full number of attempts again.
+    openvas.refuse.add("10.0.0.1")
+    scheduler.submit("10.0.0.1")
+    scheduler.admit()
+    assert scheduler.queue_depth() == 1
+
+
+def test_queue_survives_a_restart(db_path):
+    scheduler = make_scheduler(FakeOpenVas(), db_path)
+    scheduler.submit("10.0.0.2", 100)
+    scheduler.submit("10.0.0.1", 50, ScanProfile("discovery-config"))
+    scheduler.pending.close()
+
+    openvas = FakeOpenVas()
+    restarted = make_scheduler(openvas, db_path)
+    assert restarted.queue_depth() == 2
+    assert restarted.submit("10.0.0.1") is False
+
+    restarted.admit()
+    assert openvas.started == ["10.0.0.1", "10.0.0.2"]
+
+
+def cpu_times(busy, idle):
+    return collections.namedtuple("scputimes", "user idle iowait guest")(busy, idle, 0.0, 0.0)
+
+
+def test_cpu_sampler_keeps_its_own_baseline(monkeypatch):
+    samples = iter([cpu_times(100, 100), cpu_times(110, 140), cpu_times(150, 150), cpu_times(240, 160)])
+    monkeypatch.setattr(psutil, "cpu_times", lambda: next(samples))
+    sampler, telemetry = CpuSampler(), CpuSampler()
+
+    assert sampler.percent() == 0.0
+    # Another sampler in between does not shorten the window, unlike psutil.cpu_percent().
+    telemetry.percent()
+    assert sampler.percent() == 50.0
+    assert sampler.percent() == 90.0
+
+
+def test_busy_host_throttles_admission(db_path, monkeypatch):
+    openvas = FakeOpenVas()
+    scheduler = make_scheduler(openvas, db_path)
+    scheduler.max_cpu_percent = 85
+    scheduler.submit("10.0.0.1")
+    monkeypatch.setattr(scheduler._cpu, "percent", lambda: 95.0)
+
+    scheduler.admit()
+
+    assert openvas.started == []
+    assert scheduler.status()["decisions"][-1]["decision"] == "throttled"
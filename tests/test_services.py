@@ -0,0 +1,74 @@
+import threading
+import time
+
+from agent.services import LoopService, Shared
+from agent.task_poller import TaskStatePoller
+
+
+def test_stop_waits_for_the_current_iteration():
+    entered = threading.Event()
+    finished = []
+
+    def iteration():
+        entered.set()
+        time.sleep(0.2)
+        finished.append(True)
+
+    service = LoopService("test-loop", iteration, interval=60)
+    service.start()
+    entered.wait(1)
+    service.stop(timeout=5)
+
+    assert finished == [True]
+    assert not service._thread.is_alive()
+
+
+def test_join_reports_a_service_that_did_not_stop():
+    release = threading.Event()
+    service = LoopService("test-stuck", lambda: release.wait(5), interval=60)
+    service.start()
+
+    service.stop()
+    assert service.join(0.05) is False
+    release.set()
+    assert service.join(5) is True
+
+
+def test_delay_postpones_the_first_iteration():
+    calls = []
+    service = LoopService("test-delay", lambda: calls.append(True), interval=60, delay=60)
+    service.start()
+    service.stop(timeout=5)
+
+    assert calls == []
+
+
+def test_poller_stop_interrupts_its_wait():
+    class IdleOpenVas:
+        def get_task_states(self):
+            return {}
+
+    poller = TaskStatePoller(IdleOpenVas(), interval=60, reconcile_interval=60)
+    poller.add_finished_listener(lambda state: None)
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    poller.stop(timeout=5)
+    assert time.monotonic() - started < 1
+    assert not poller._thread.is_alive()
+
+
+def test_shared_creates_one_instance_on_first_call():
+    created = []
+
+    def factory(*args):
+        created.append(args)
+        return object()
+
+    shared = Shared(factory)
+    assert shared.peek() is None
+
+    first = shared("a")
+    assert shared("b") is first
+    assert shared.peek() is first
+    assert created == [("a",)]
@@ -0,0 +1,196 @@
+import asyncio
+import time
+
+import pytest
+
+from agent.task_poller import TaskStatePoller, UnknownTask
+
+
+class FakeOpenVas:
+    """Answers get_task_states from ``tasks``, task id -> (name, status, progress)."""
+
+    def __init__(self, tasks=None):
+        self.tasks = dict(tasks or {})
+        self.listings = 0
+
+    def get_task_states(self):
+        self.listings += 1
+        return dict(self.tasks)
+
+
+def run_poller(openvas, listener, seconds=0.3):
+    poller = TaskStatePoller(openvas, interval=0.01, reconcile_interval=0.01)
+    poller.add_finished_listener(listener)
+    time.sleep(seconds)
+    poller.stop()
+    return poller
+
+
+def test_listener_alone_does_not_poll_idle_gvmd():
+    openvas = FakeOpenVas({"t1": ("a", "Done", 100), "t2": ("b", "New", -1)})
+
+    run_poller(openvas, lambda state: None)
+
+    # The first listing shows nothing can finish, no listing follows it.
+    assert openvas.listings == 1
+
+
+def test_listener_polls_while_a_task_runs():
+    openvas = FakeOpenVas({"t1": ("a", "Running", 40)})
+    finished = []
+
+    poller = TaskStatePoller(openvas, interval=0.01, reconcile_interval=0.01)
+    poller.add_finished_listener(finished.append)
+    time.sleep(0.1)
+    openvas.tasks["t1"] = ("a", "Done", 100)
+    time.sleep(0.1)
+    listings = openvas.listings
+    time.sleep(0.1)
+    poller.stop()
+
+    assert [state.task_id for state in finished] == ["t1"]
+    # Listings stop once the task finished.
+    assert listings > 2 and openvas.listings <= listings + 1
+
+
+def test_started_task_and_wake_resume_polling():
+    openvas = FakeOpenVas({})
+    poller = TaskStatePoller(openvas, interval=0.01, reconcile_interval=0.01)
+    poller.add_finished_listener(lambda state: None)
+    time.sleep(0.1)
+    assert openvas.listings == 1
+
+    poller.wake()
+    time.sleep(0.1)
+    assert openvas.listings == 2
+
+    openvas.tasks["t1"] = ("a", "Running", 0)
+    poller.task_started("t1")
+    time.sleep(0.1)
+    poller.stop()
+    assert openvas.listings > 3
+
+
+def test_removed_listener_stops_polling():
+    openvas = FakeOpenVas({"t1": ("a", "Running", 40)})
+    listener = lambda state: None
+    poller = TaskStatePoller(openvas, interval=0.01, reconcile_interval=0.01)
+    poller.add_finished_listener(listener)
+    time.sleep(0.05)
+
+    poller.remove_finished_listener(listener)
+    time.sleep(0.05)
+    listings = openvas.listings
+    time.sleep(0.1)
+    poller.stop()
+
+    assert openvas.listings <= listings + 1
+
+
+def quiet_poller(openvas):
+    """A poller refreshed by the test only, its thread is never started."""
+    poller = TaskStatePoller(openvas)
+    poller.start = lambda: None
+    return poller
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_refresh_notifies_subscribers_of_changes_only():
+    openvas = FakeOpenVas({"t1": ("a", "Running", 10)})
+    poller = quiet_poller(openvas)
+
+    async def scenario():
+        poller.refresh()
+        queue = poller.subscribe("t1")
+        # The known state is queued right away.
+        assert [state.progress for state in drain(queue)] == [10]
+
+        poller.refresh()
+        await asyncio.sleep(0)
+        assert drain(queue) == []
+
+        openvas.tasks["t1"] = ("a", "Running", 50)
+        poller.refresh()
+        await asyncio.sleep(0)
+        assert [(state.status, state.progress) for state in drain(queue)] == [("Running", 50)]
+
+        openvas.tasks["t1"] = ("a", "Done", 100)
+        assert (await asyncio.gather(poller.wait_finished("t1", 1), refresh_soon(poller)))[0].done
+
+    asyncio.run(scenario())
+
+
+async def refresh_soon(poller):
+    await asyncio.sleep(0.01)
+    poller.refresh()
+
+
+def test_task_missing_from_a_listing_is_unknown():
+    poller = quiet_poller(FakeOpenVas({"t1": ("a", "Running", 10)}))
+
+    async def scenario():
+        waiter = asyncio.ensure_future(poller.wait_finished("gone", 5))
+        await asyncio.sleep(0.01)
+        poller.refresh()
+        with pytest.raises(UnknownTask):
+            await waiter
+        # Known as missing from a fresh listing, answered without asking gvmd.
+        with pytest.raises(UnknownTask):
+            await poller.wait_finished("gone", 5)
+
+    asyncio.run(scenario())
+
+
+def test_subscriber_newer_than_the_listing_is_not_told_unknown():
+    openvas = FakeOpenVas({})
+    poller = quiet_poller(openvas)
+
+    async def scenario():
+        def subscribe_during_query():
+            # The task was created while gvmd answered the listing.
+            queue.append(poller.subscribe("new"))
+            return {}
+
+        queue = []
+        openvas.get_task_states = subscribe_during_query
+        poller.refresh()
+        await asyncio.sleep(0)
+        assert drain(queue[0]) == []
+
+    asyncio.run(scenario())
+
+
+def test_finished_listeners_see_transitions_only():
+    openvas = FakeOpenVas({"old": ("a", "Done", 100), "t1": ("b", "Running", 10)})
+    poller = quiet_poller(openvas)
+    finished = []
+    poller.add_finished_listener(finished.append)
+
+    poller.refresh()
+    assert finished == []
+
+    openvas.tasks["t1"] = ("b", "Stopped", 40)
+    poller.refresh()
+    poller.refresh()
+    assert [(state.task_id, state.status) for state in finished] == [("t1", "Stopped")]
+
+
+def test_restarted_task_is_not_reported_with_its_previous_state():
+    openvas = FakeOpenVas({"t1": ("a", "Done", 100)})
+    poller = quiet_poller(openvas)
+    poller.refresh()
+
+    # A listing sent before the restart still has the previous run.
+    def listing_from_before_the_restart():
+        poller.task_started("t1")
+        return {"t1": ("a", "Done", 100)}
+
+    openvas.get_task_states = listing_from_before_the_restart
+    poller.refresh()
+    assert poller.get("t1").status == "Requested"
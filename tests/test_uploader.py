@@ -0,0 +1,233 @@
+import gzip
+import http.server
+import os
+import threading
+
+import pytest
+
+from agent.uploader import PanelUploader
+
+
+class RecordingHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        try:
+            if self.headers.get("Transfer-Encoding") == "chunked":
+                body = b""
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    body += self.rfile.read(size + 2)[:-2]
+                    if size == 0:
+                        break
+            else:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        except ValueError:
+            # The client gave up in the middle of the body.
+            self.close_connection = True
+            return
+        with self.server.lock:
+            self.server.bodies.append(body)
+            status, headers = self.server.statuses.pop(0) if self.server.statuses else (200, {})
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RecordingPanel(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RecordingHandler)
+        self.lock = threading.Lock()
+        self.bodies = []
+        # (status, headers) answered to the next requests, 200 once empty.
+        self.statuses = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def payloads(self):
+        return [gzip.decompress(body) for body in self.bodies]
+
+
+@pytest.fixture
+def panel():
+    server = RecordingPanel()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def spool_dir(tmp_path):
+    return str(tmp_path / "spool")
+
+
+def make_uploader(url, spool_dir):
+    return PanelUploader(base_url=url, spool_dir=spool_dir, retries=0, backoff=0, timeout=(2, 5))
+
+
+def spooled(spool_dir):
+    return sorted(f for f in os.listdir(spool_dir) if not os.path.isdir(os.path.join(spool_dir, f)))
+
+
+def rows(count=3, fail_at=None, error=TimeoutError):
+    yield b"["
+    for i in range(count):
+        if i == fail_at:
+            raise error("timed out")
+        yield (b"," if i else b"") + b'{"row": %d}' % i
+    yield b"]"
+
+
+def test_accepted_batch_is_not_spooled(panel, spool_dir):
+    uploader = make_uploader(panel.url, spool_dir)
+
+    assert uploader.upload_stream("openvas-results", rows()) is True
+    assert panel.payloads() == [b'[{"row": 0},{"row": 1},{"row": 2}]']
+    assert spooled(spool_dir) == []
+
+
+@pytest.mark.parametrize("error", [TimeoutError, OSError, ValueError])
+def test_producer_failure_is_raised_and_nothing_spooled(panel, spool_dir, error):
+    uploader = make_uploader(panel.url, spool_dir)
+
+    with pytest.raises(error):
+        uploader.upload_stream("openvas-results", rows(fail_at=2, error=error))
+
+    # The panel never got a complete body and no truncated batch is left for replay.
+    assert panel.bodies == []
+    assert spooled(spool_dir) == []
+    assert uploader.replay() is True
+    assert panel.bodies == []
+
+
+def test_producer_failure_while_only_spooling(spool_dir):
+    uploader = make_uploader("http://127.0.0.1:9", spool_dir)
+
+    with pytest.raises(TimeoutError):
+        uploader.upload_stream("openvas-results", rows(fail_at=1))
+
+    assert spooled(spool_dir) == []
+
+
+def test_panel_down_spools_and_replays_intact_batch(panel, spool_dir):
+    down = make_uploader("http://127.0.0.1:9", spool_dir)
+
+    assert down.upload_stream("openvas-results", rows()) is True
+    assert len(spooled(spool_dir)) == 1
+
+    assert make_uploader(panel.url, spool_dir).replay() is True
+    assert panel.payloads() == [b'[{"row": 0},{"row": 1},{"row": 2}]']
+    assert spooled(spool_dir) == []
+
+
+def test_server_error_spools_batch(panel, spool_dir):
+    uploader = make_uploader(panel.url, spool_dir)
+    # The streamed attempt and the replay right after it.
+    panel.statuses = [(503, {}), (503, {})]
+
+    assert uploader.upload_stream("openvas-results", rows()) is True
+    assert len(spooled(spool_dir)) == 1
+
+    assert uploader.replay() is True
+    assert panel.payloads() == [b'[{"row": 0},{"row": 1},{"row": 2}]'] * 3
+    assert spooled(spool_dir) == []
+
+
+def test_spooled_batches_keep_their_order(panel, spool_dir):
+    down = make_uploader("http://127.0.0.1:9", spool_dir)
+    for count in (1, 2):
+        down.upload_stream("openvas-results", rows(count))
+
+    uploader = make_uploader(panel.url, spool_dir)
+    assert uploader.upload_stream("openvas-results", rows(3)) is True
+
+    assert panel.payloads() == [b'[{"row": 0}]', b'[{"row": 0},{"row": 1}]',
+                                b'[{"row": 0},{"row": 1},{"row": 2}]']
+
+
+def rejected(spool_dir):
+    path = os.path.join(spool_dir, "rejected")
+    return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+
+def spool_one(spool_dir):
+    make_uploader("http://127.0.0.1:9", spool_dir).upload_stream("openvas-results", rows())
+    assert len(spooled(spool_dir)) == 1
+
+
+@pytest.mark.parametrize("status", [401, 403, 408, 425, 429])
+def test_replay_keeps_batch_on_retry_later_answers(panel, spool_dir, status):
+    spool_one(spool_dir)
+    uploader = make_uploader(panel.url, spool_dir)
+    panel.statuses = [(status, {"Retry-After": "120"})]
+
+    assert uploader.replay() is False
+    assert len(spooled(spool_dir)) == 1
+    # Retry-After is honoured, the panel is not asked again before it passed.
+    assert uploader.replay() is False
+    assert len(panel.bodies) == 1
+
+    uploader._retry_at = 0.0
+    assert uploader.replay() is True
+    assert spooled(spool_dir) == [] and rejected(spool_dir) == []
+
+
+def test_retry_after_http_date_and_default(panel, spool_dir, monkeypatch):
+    spool_one(spool_dir)
+    uploader = make_uploader(panel.url, spool_dir)
+    monkeypatch.setattr("agent.uploader.PANEL_RETRY_AFTER", 0.0)
+    panel.statuses = [(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), (403, {})]
+
+    # A date in the past and no header with a zero default both allow the next replay.
+    assert uploader.replay() is False
+    assert uploader.replay() is False
+    assert uploader.replay() is True
+    assert len(panel.bodies) == 3
+
+
+def test_replay_quarantines_rejected_batch(panel, spool_dir):
+    spool_one(spool_dir)
+    file_name = spooled(spool_dir)[0]
+    uploader = make_uploader(panel.url, spool_dir)
+    panel.statuses = [(400, {})]
+
+    assert uploader.replay() is True
+    assert spooled(spool_dir) == []
+    assert rejected(spool_dir) == [file_name]
+    # Quarantined batches are not sent again.
+    assert uploader.replay() is True
+    assert len(panel.bodies) == 1
+
+
+def test_streamed_batch_rejected_for_good_is_quarantined(panel, spool_dir):
+    uploader = make_uploader(panel.url, spool_dir)
+    panel.statuses = [(422, {})]
+
+    assert uploader.upload_stream("openvas-results", rows()) is True
+    assert spooled(spool_dir) == []
+    (file_name,) = rejected(spool_dir)
+    with open(os.path.join(spool_dir, "rejected", file_name), "rb") as f:
+        assert gzip.decompress(f.read()) == b'[{"row": 0},{"row": 1},{"row": 2}]'
+
+
+def test_streamed_batch_answered_429_stays_spooled(panel, spool_dir):
+    uploader = make_uploader(panel.url, spool_dir)
+    panel.statuses = [(429, {"Retry-After": "120"})]
+
+    assert uploader.upload_stream("openvas-results", rows()) is True
+    assert len(spooled(spool_dir)) == 1
+    # Neither the replay right after the failure nor the next batch hits the panel before Retry-After.
+    assert uploader.upload_stream("openvas-results", rows(1)) is True
+    assert len(panel.bodies) == 1
+    assert len(spooled(spool_dir)) == 2